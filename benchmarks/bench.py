@@ -0,0 +1,282 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from unittest.mock import patch
+
+from database.memory_collection import InMemoryCollection
+from src import app
+from src.cache import ApiCache, set_cache
+from src.move_index import MoveIndex, set_move_index
+from src.models.battle import Battle
+from src.models.move import Move
+from src.models.species import SpeciesTemplate
+from src.simulation import simulate_battles
+from src.stub_api import StubApiServer, load_fixtures
+
+# recorded PokeAPI documents served by the stub server in the fetch benchmarks
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures.json')
+# species of the fixtures
+SPECIES = ['pikachu', 'charizard', 'blastoise', 'gengar', 'bulbasaur']
+# default maximum change of a result, relative to the baseline, before it is flagged as a regression
+DEFAULT_THRESHOLD = 0.1
+# number of measures of each benchmark, the result is their median
+ROUNDS = 5
+
+# benchmarks by name, registered with the benchmark decorator
+BENCHMARKS = {}
+
+
+def benchmark(name, unit, higher_is_better):
+    """
+    Register a benchmark. The benchmark function takes the scale of the work (1 for a full run, less for a
+    quick one) and returns a list of measures, one per round, and optionally a dictionary of extra information
+    :param name: the name of the benchmark
+    :param unit: the unit of the measures
+    :param higher_is_better: whether a higher measure is an improvement
+    """
+    def register(function):
+        BENCHMARKS[name] = (function, unit, higher_is_better)
+        return function
+    return register
+
+
+def rate(function, number):
+    """
+    Measure how many times per second a function runs
+    :param function: the function, called without arguments
+    :param number: the number of calls
+    :return: the calls per second
+    """
+    start = time.perf_counter()
+    for _ in range(number):
+        function()
+    return number / (time.perf_counter() - start)
+
+
+def template(name, hp, attack, defense, power, types=('normal',)):
+    """
+    Build a species template with 4 moves of the same power, so that the length of its battles is predictable
+    """
+    moves = [Move(name='{0}-{1}'.format(name, i), type=types[0], power=power, accuracy=100, pp=20, max_pp=20)
+             for i in range(4)]
+    return SpeciesTemplate(id=1, name=name, hp=hp, attack=attack, defense=defense, speed=50, types=list(types),
+                           moves=moves)
+
+
+# matchups of different lengths: a few turns, a few tens of turns, until the PP run out
+MATCHUPS = {
+    'short': (template('striker', 40, 120, 40, 12), template('target', 40, 40, 40, 4)),
+    'medium': (template('pikachu', 60, 55, 60, 5), template('eevee', 60, 55, 60, 5)),
+    'long': (template('shuckle', 200, 10, 230, 1), template('chansey', 250, 5, 10, 1)),
+}
+
+
+@benchmark('attack_rival', 'attacks/s', True)
+def bench_attack_rival(scale):
+    attacker = template('pikachu', 60, 55, 60, 5).instantiate(20)
+    rival = template('eevee', 60, 55, 60, 5).instantiate(20)
+    for move in attacker.moves:
+        move.pp = move.max_pp = 10 ** 9
+    rival.hp = rival.max_hp = 10 ** 9
+    move = attacker.moves[0]
+    return [rate(lambda: attacker.attack_rival(rival, move), int(20000 * scale)) for _ in range(ROUNDS)]
+
+
+def _bench_perform_battle(matchup, scale):
+    template1, template2 = MATCHUPS[matchup]
+    turns = []
+
+    def battle():
+        battle = Battle(pokemon1=template1.instantiate(20), pokemon2=template2.instantiate(20), winner="", loser="")
+        battle.perform_battle()
+        turns.append(battle.turns)
+
+    measures = [rate(battle, int(2000 * scale)) for _ in range(ROUNDS)]
+    return measures, {'mean_turns': statistics.mean(turns)}
+
+
+for _matchup in MATCHUPS:
+    benchmark('perform_battle_{0}'.format(_matchup), 'battles/s', True)(
+        lambda scale, matchup=_matchup: _bench_perform_battle(matchup, scale))
+
+
+def _bench_simulate_battles(matchup, scale):
+    # measured on one CPU: about 7M, 2M and 0.5M battles/s on the short, medium and long matchups (5, 20 and 80
+    # turns), that is 10^6 battles in 0.14s, 0.5s and 1.9s, about 25ns per turn of a battle
+    pokemon1, pokemon2 = (species.instantiate(20) for species in MATCHUPS[matchup])
+    simulations = max(1, int(10 ** 6 * scale))
+    results = []
+
+    def simulate():
+        results.append(simulate_battles(pokemon1, pokemon2, simulations, seed=len(results)))
+
+    measures = [rate(simulate, 1) * simulations for _ in range(ROUNDS)]
+    return measures, {'mean_turns': statistics.mean(result.mean_turns for result in results)}
+
+
+for _matchup in MATCHUPS:
+    benchmark('simulate_battles_{0}'.format(_matchup), 'battles/s', True)(
+        lambda scale, matchup=_matchup: _bench_simulate_battles(matchup, scale))
+
+
+def _bench_generate_pokemon(scale, api_cache, templates):
+    """
+    Measure the latency of generate_pokemon against the stub server
+    :param api_cache: whether the PokeAPI cache is warm
+    :param templates: whether the species templates are cached
+    """
+    with StubApiServer() as server, patch('src.app.API_URL', server.url), patch('src.app.get_pokedex', return_value=None):
+        server.documents.update(load_fixtures(FIXTURES_PATH, server.url))
+        cache = ApiCache(':memory:')
+        set_cache(cache)
+        set_move_index(MoveIndex())
+        try:
+            for name in SPECIES:
+                app.generate_pokemon(name, 20)
+            measures = []
+            for _ in range(ROUNDS):
+                latencies = []
+                for _ in range(max(int(20 * scale), 1)):
+                    if not api_cache:
+                        cache.clear()
+                        set_move_index(MoveIndex())
+                    if not templates:
+                        app.species_templates.clear()
+                    for name in SPECIES:
+                        start = time.perf_counter()
+                        app.generate_pokemon(name, 20)
+                        latencies.append((time.perf_counter() - start) * 1000)
+                measures.append(statistics.median(latencies))
+            return measures, {'requests': sum(server.requests.values())}
+        finally:
+            set_cache(None)
+            set_move_index(None)
+            app.species_templates.clear()
+
+
+@benchmark('generate_pokemon_cold', 'ms', False)
+def bench_generate_pokemon_cold(scale):
+    return _bench_generate_pokemon(scale, api_cache=False, templates=False)
+
+
+@benchmark('generate_pokemon_warm', 'ms', False)
+def bench_generate_pokemon_warm(scale):
+    return _bench_generate_pokemon(scale, api_cache=True, templates=False)
+
+
+@benchmark('generate_pokemon_template', 'ms', False)
+def bench_generate_pokemon_template(scale):
+    return _bench_generate_pokemon(scale, api_cache=True, templates=True)
+
+
+def _bench_save_to_db(compact, scale):
+    template1, template2 = MATCHUPS['medium']
+    battles = []
+    for _ in range(100):
+        battle = Battle(pokemon1=template1.instantiate(20), pokemon2=template2.instantiate(20), winner="", loser="")
+        battle.perform_battle()
+        battles.append(battle)
+    collection = InMemoryCollection()
+    battle = itertools.cycle(battles)
+    return [rate(lambda: next(battle).save_to_db(collection, compact), int(1000 * scale)) for _ in range(ROUNDS)]
+
+
+@benchmark('save_to_db', 'battles/s', True)
+def bench_save_to_db(scale):
+    return _bench_save_to_db(False, scale)
+
+
+@benchmark('save_to_db_compact', 'battles/s', True)
+def bench_save_to_db_compact(scale):
+    return _bench_save_to_db(True, scale)
+
+
+def run(names=None, scale=1.0):
+    """
+    Run the benchmarks
+    :param names: the names of the benchmarks to run, all of them if None
+    :param scale: the scale of the work, less than 1 for a quick run
+    :return: the results, with the median of the measures of each benchmark
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        function, unit, higher_is_better = BENCHMARKS[name]
+        output = function(scale)
+        measures, extra = output if isinstance(output, tuple) else (output, {})
+        results[name] = dict(value=statistics.median(measures), unit=unit, higher_is_better=higher_is_better,
+                             measures=measures, **extra)
+        print("{0:<28} {1:>12.2f} {2}".format(name, results[name]['value'], unit), file=sys.stderr)
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the results with a baseline
+    :param results: the results, as returned by run
+    :param baseline: the baseline results
+    :param threshold: the maximum change, relative to the baseline, before a result is a regression
+    :return: a list of (name, baseline value, value, relative change, regression) for the benchmarks of both,
+    the change is positive when the result improved
+    """
+    comparison = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]['value']
+        change = (result['value'] - base) / base
+        if not result['higher_is_better']:
+            change = -change
+        comparison.append((name, base, result['value'], change, change < -threshold))
+    return comparison
+
+
+def main(argv=None):
+    """
+    Run the benchmarks of the battle, fetch and persistence hot paths, offline
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('names', nargs='*', help='the benchmarks to run (all by default): {0}'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--output', help='the JSON file where the results are written')
+    parser.add_argument('--baseline', help='the JSON file of the results to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='the relative slowdown flagged as a regression (default 0.1)')
+    parser.add_argument('--quick', action='store_true', help='run a tenth of the work, less precise')
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: {0}'.format(', '.join(sorted(unknown))))
+    # the battles are not described in the logs, as in the batch mode
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.WARNING)
+
+    results = run(args.names or None, 0.1 if args.quick else 1.0)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            comparison = compare(results, json.load(file), args.threshold)
+        regressions = 0
+        for name, base, value, change, regression in comparison:
+            regressions += regression
+            print("{0:<28} {1:>12.2f} -> {2:>12.2f} {3:>+8.1%}{4}".format(
+                name, base, value, change, '  REGRESSION' if regression else ''))
+        if regressions:
+            print("{0} regressions above {1:.0%}".format(regressions, args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
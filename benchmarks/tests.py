@@ -0,0 +1,31 @@
+import unittest
+from benchmarks import bench
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_run(self):
+        results = bench.run(['perform_battle_short', 'generate_pokemon_template'], scale=0.01)
+
+        # Assert that each benchmark gives a positive result with its unit
+        self.assertEqual(set(results['results']), {'perform_battle_short', 'generate_pokemon_template'})
+        self.assertGreater(results['results']['perform_battle_short']['value'], 0)
+        self.assertEqual(results['results']['generate_pokemon_template']['unit'], 'ms')
+
+    def test_compare(self):
+        baseline = {'results': {'battles': {'value': 100, 'higher_is_better': True},
+                                'latency': {'value': 10, 'higher_is_better': False}}}
+        results = {'results': {'battles': {'value': 85, 'higher_is_better': True},
+                               'latency': {'value': 9, 'higher_is_better': False},
+                               'new': {'value': 1, 'higher_is_better': True}}}
+        comparison = {name: (change, regression) for name, _, _, change, regression in bench.compare(results, baseline)}
+
+        # Assert that slower results beyond the threshold are regressions, and faster ones improvements
+        self.assertEqual(set(comparison), {'battles', 'latency'})
+        self.assertAlmostEqual(comparison['battles'][0], -0.15)
+        self.assertTrue(comparison['battles'][1])
+        self.assertAlmostEqual(comparison['latency'][0], 0.1)
+        self.assertFalse(comparison['latency'][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import logging
+import queue
+import threading
+import time
+
+from bson import encode
+from pymongo import errors
+
+from src import metrics
+from src.models.battle import DB_BYTES, DB_INSERTS
+
+# default number of battles per insert and maximum time in seconds a battle waits before being inserted
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+# default maximum number of battles waiting to be inserted, adding more blocks until they are inserted
+DEFAULT_MAX_PENDING = 10000
+
+# marks the end of the battles in the queue
+_CLOSE = object()
+# interval in seconds at which the producers waiting on the sink check that its thread is still running
+_POLL_INTERVAL = 0.1
+
+
+class BattleSink:
+    """
+    Write-behind sink of battles: battles are buffered and inserted by a background thread with unordered
+    insert_many calls, when the buffer holds batch_size battles or when the oldest one waited flush_interval seconds.
+    Adding a battle blocks while max_pending battles are waiting, so a slow database slows down the producers
+    instead of filling the memory.
+    Failed documents are logged and collected in failed instead of raising. Adding or flushing battles raises
+    RuntimeError if the background thread is no longer running.
+    """
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_pending=DEFAULT_MAX_PENDING, compact=False, store=None,
+                 leaderboard=None):
+        """
+        Create the sink and start its background thread
+        :param collection: the collection where the battles will be saved
+        :param batch_size: the number of battles per insert
+        :param flush_interval: the maximum time in seconds a battle waits before being inserted
+        :param max_pending: the maximum number of battles waiting to be inserted
+        :param compact: if True, save the battles in the compact format (see Battle.to_document)
+        :param store: the NormalizedStore of the collection, to save the battles with references to their species
+        and moves instead of embedding them
+        :param leaderboard: the Leaderboard updated with each batch of inserted battles
+        """
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compact = compact
+        self.store = store
+        self.leaderboard = leaderboard
+        # number of inserted documents, and failed documents with their error
+        self.inserted = 0
+        self.failed = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='battle-sink', daemon=True)
+        self._thread.start()
+
+    def add(self, battle):
+        """
+        Add a battle to the sink, blocking while the sink is full
+        :param battle: the battle
+        """
+        if self.store is not None:
+            self.add_document(self.store.to_document(battle, self.compact))
+        else:
+            self.add_document(battle.to_document(self.compact))
+
+    def add_document(self, document):
+        """
+        Add a battle document to the sink, blocking while the sink is full
+        :param document: the battle document
+        """
+        self._put(document)
+
+    def flush(self):
+        """
+        Insert the battles added so far and wait until they are inserted
+        """
+        done = threading.Event()
+        self._put(done)
+        while not done.wait(_POLL_INTERVAL):
+            if not self._thread.is_alive():
+                raise RuntimeError("The battle sink is closed")
+
+    def close(self):
+        """
+        Insert the remaining battles and stop the background thread
+        """
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        logging.info("Battle sink closed: {0} battles inserted, {1} failed".format(self.inserted, len(self.failed)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _put(self, item):
+        # the producers never wait for a thread that is no longer running
+        while True:
+            if not self._thread.is_alive():
+                raise RuntimeError("The battle sink is closed")
+            try:
+                self._queue.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, dict):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+            self._insert(batch)
+            batch = []
+            deadline = None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _CLOSE:
+                return
+
+    def _insert(self, batch):
+        if not batch:
+            return
+        try:
+            with metrics.timer('db_insert_many'):
+                self.collection.insert_many(batch, ordered=False)
+        except errors.BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            failed = {write_error['index'] for write_error in write_errors}
+            self._update_leaderboard([document for index, document in enumerate(batch) if index not in failed])
+            self.inserted += e.details.get('nInserted', len(batch) - len(write_errors))
+            DB_INSERTS.inc(e.details.get('nInserted', len(batch) - len(write_errors)))
+            for write_error in write_errors:
+                self.failed.append((batch[write_error['index']], write_error.get('errmsg')))
+            logging.error('Unable to insert {0} battles to DB!'.format(len(write_errors)))
+        except Exception as e:
+            # e.g. a database error, or a document that can't be encoded, the next batches are still inserted
+            self.failed.extend((document, str(e)) for document in batch)
+            logging.error('Unable to insert {0} battles to DB!\n{1}'.format(len(batch), e))
+        else:
+            self.inserted += len(batch)
+            DB_INSERTS.inc(len(batch))
+            # the size of the documents is only computed for the metrics
+            if metrics.enabled():
+                DB_BYTES.inc(sum(len(encode(document)) for document in batch))
+            self._update_leaderboard(batch)
+            logging.debug("{0} battles saved to the database.".format(len(batch)))
+
+    def _update_leaderboard(self, documents):
+        if self.leaderboard is None:
+            return
+        try:
+            for document in documents:
+                self.leaderboard.record_document(document)
+            self.leaderboard.flush()
+        except Exception as e:
+            # the battles are saved, only their statistics are missing until the next backfill
+            logging.error('Unable to update the leaderboard!\n{0}'.format(e))
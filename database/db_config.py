@@ -1,5 +1,21 @@
+import os
+import threading
 from configparser import ConfigParser
 
+# the file and section of the database information
+FILENAME = 'db_info.ini'
+SECTION = 'mongo-db'
+# url of the MongoDB server, can be changed with the MONGO_URL environment variable
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://mongo:27017')
+# name of the database of the battles
+DATABASE = 'pokemon'
+# maximum number of pooled connections of the client
+MAX_POOL_SIZE = 16
+
+# the client is created on first use, and shared by all the threads of the program
+_client = None
+_client_lock = threading.Lock()
+
 
 def get_db_info(filename, section):
     """
@@ -20,3 +36,42 @@ def get_db_info(filename, section):
             db_info[item[0]] = item[1]  # index 0: key & index 1: value
 
     return db_info
+
+
+def get_client():
+    """
+    Get the MongoDB client, created on the first call with the credentials of the db_info.ini file.
+    The client holds a pool of connections and is thread safe, so it is reused by the whole program
+    :return: the client
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # imported lazily, the programs that never save a battle don't load the driver
+                from pymongo import MongoClient
+
+                db_info = get_db_info(FILENAME, SECTION)
+                _client = MongoClient(MONGO_URL, username=db_info.get('username'), password=db_info.get('password'),
+                                      authSource=DATABASE, authMechanism="SCRAM-SHA-256",
+                                      uuidRepresentation='standard', maxPoolSize=MAX_POOL_SIZE)
+    return _client
+
+
+def set_client(client):
+    """
+    Replace the MongoDB client shared by the whole process
+    :param client: the new client, None to create one on next use
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def get_collection(name='battle'):
+    """
+    Get a collection of the battle database, with the shared client
+    :param name: the name of the collection
+    :return: the collection
+    """
+    return get_client()[DATABASE][name]
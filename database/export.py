@@ -0,0 +1,173 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+# default number of battles read per round trip, and written per chunk file
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_CHUNK_SIZE = 200000
+# file with the chunks already exported and the last exported _id, in the output directory
+MANIFEST = 'manifest.json'
+# value of the integer columns that are unknown: the final HP of the compact battles, the missing seeds
+MISSING = -1
+# fields of the battle documents read by the export, the same in the embedded and normalized layouts
+PROJECTION = {'pokemon1.name': 1, 'pokemon1.level': 1, 'pokemon1.hp': 1, 'pokemon2.name': 1, 'pokemon2.level': 1,
+              'pokemon2.hp': 1, 'winner': 1, 'turns': 1, 'seed': 1, 'compact': 1}
+# columns of the export, with their numpy type ('U' strings are sized by their longest value in each chunk)
+COLUMNS = {
+    'id': 'U',
+    'pokemon1': 'U',
+    'pokemon2': 'U',
+    'level1': np.int16,
+    'level2': np.int16,
+    'winner': 'U',
+    'turns': np.int32,
+    'hp1': np.int32,
+    'hp2': np.int32,
+    'seed': np.int64,
+}
+
+
+def flatten(document):
+    """
+    Get the row of a battle document
+    :param document: the battle document, with the fields of PROJECTION
+    :return: a tuple with the value of each column
+    """
+    pokemon1, pokemon2 = document['pokemon1'], document['pokemon2']
+    # the compact battles are saved with the pokemon before the battle, their final HP is not known
+    compact = document.get('compact', False)
+    seed = document.get('seed')
+    return (str(document['_id']), pokemon1['name'], pokemon2['name'], pokemon1['level'], pokemon2['level'],
+            document['winner'], document.get('turns', 0), MISSING if compact else pokemon1['hp'],
+            MISSING if compact else pokemon2['hp'], seed if seed is not None and 0 <= seed < 2 ** 63 else MISSING)
+
+
+def write_chunk(path, rows):
+    """
+    Write rows to a compressed columnar file, one array per column
+    :param path: the path of the file
+    :param rows: the rows, as returned by flatten
+    """
+    columns = {}
+    for (name, dtype), values in zip(COLUMNS.items(), zip(*rows)):
+        columns[name] = np.array(values, dtype=str if dtype == 'U' else dtype)
+    with open(path, 'wb') as file:
+        np.savez_compressed(file, **columns)
+
+
+def read_manifest(directory):
+    """
+    Read the manifest of an export
+    :param directory: the output directory of the export
+    :return: the manifest, with the chunk files, the number of rows and the last exported _id
+    """
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'chunks': [], 'rows': 0, 'last_id': None}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _write_manifest(directory, manifest):
+    # the manifest is replaced atomically, an interrupted export resumes after the last complete chunk
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def export(collection, directory, incremental=False, batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Export the battles to compressed columnar files, reading the collection in _id order with a batched cursor.
+    At most chunk_size rows are held in memory, whatever the size of the collection.
+    In the incremental mode only the battles after the last exported _id are exported, in new chunk files.
+    The ObjectIds given by MongoDB increase with the insert time, so the new battles come after it, except those
+    inserted by another client in the same second as the last exported one: the incremental exports should run
+    when no battles are being saved
+    :param collection: the battle collection
+    :param directory: the output directory, with the chunk files and the manifest
+    :param incremental: if True, resume from the manifest of the previous export instead of starting over
+    :param batch_size: the number of battles read per round trip
+    :param chunk_size: the number of battles per chunk file
+    :return: the number of exported battles
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    if not incremental:
+        for chunk in manifest['chunks']:
+            path = os.path.join(directory, chunk)
+            if os.path.exists(path):
+                os.remove(path)
+        manifest = {'chunks': [], 'rows': 0, 'last_id': None}
+    last_id = manifest['last_id']
+    if last_id is not None:
+        # imported lazily, the files can be read without the database driver
+        from bson import ObjectId
+        last_id = ObjectId(last_id) if ObjectId.is_valid(last_id) else last_id
+
+    exported = 0
+    rows = []
+    cursor = collection.find({'_id': {'$gt': last_id}} if last_id is not None else {}, projection=PROJECTION,
+                             sort=[('_id', 1)], batch_size=batch_size)
+    for document in cursor:
+        rows.append(flatten(document))
+        if len(rows) == chunk_size:
+            exported += _flush(directory, manifest, rows)
+            rows = []
+    if rows:
+        exported += _flush(directory, manifest, rows)
+    _write_manifest(directory, manifest)
+    return exported
+
+
+def _flush(directory, manifest, rows):
+    chunk = 'battles-{0:06d}.npz'.format(len(manifest['chunks']))
+    write_chunk(os.path.join(directory, chunk), rows)
+    manifest['chunks'].append(chunk)
+    manifest['rows'] += len(rows)
+    manifest['last_id'] = rows[-1][0]
+    _write_manifest(directory, manifest)
+    logging.info("{0} battles exported to {1}".format(len(rows), chunk))
+    return len(rows)
+
+
+def load(directory):
+    """
+    Read all the chunks of an export
+    :param directory: the output directory of the export
+    :return: a dictionary with the array of each column
+    """
+    chunks = []
+    for chunk in read_manifest(directory)['chunks']:
+        with np.load(os.path.join(directory, chunk)) as data:
+            chunks.append({name: data[name] for name in COLUMNS})
+    if not chunks:
+        return {name: np.array([], dtype=str if dtype == 'U' else dtype) for name, dtype in COLUMNS.items()}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in COLUMNS}
+
+
+def main(argv=None):
+    """
+    Export the battle collection to compressed columnar files
+    """
+    from database.db_config import get_collection
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('output', help='the output directory')
+    parser.add_argument('--incremental', action='store_true', help='only export the battles saved since the last export')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='the battles read per round trip')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='the battles per chunk file')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    exported = export(get_collection(), args.output, args.incremental, args.batch_size, args.chunk_size)
+    logging.info("{0} battles exported, {1} in total".format(exported, read_manifest(args.output)['rows']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import logging
+import threading
+
+from pymongo import DESCENDING, UpdateOne, errors
+
+from src import metrics
+
+# default number of battles read per round trip by the backfill
+DEFAULT_BACKFILL_BATCH_SIZE = 1000
+# fields of the battle documents read by the backfill
+BACKFILL_PROJECTION = {'_id': 0, 'pokemon1.name': 1, 'pokemon1.hp': 1, 'pokemon2.name': 1, 'winner': 1, 'turns': 1,
+                       'compact': 1}
+
+
+class Leaderboard:
+    """
+    Win and loss counts of each species and of each ordered matchup (pokemon1 against pokemon2, pokemon1 being
+    the one that moves first), kept up to date as the battles are saved instead of scanning the battle collection.
+    The battles are counted in memory by record() and written by flush() with one $inc upsert per species and
+    per matchup, so a batch of battles between the same pokemon costs a couple of updates.
+    Each query reads one or two documents by _id, whatever the number of battles
+    """
+
+    def __init__(self, species, matchups):
+        """
+        Create the leaderboard
+        :param species: the collection of the statistics of each species
+        :param matchups: the collection of the statistics of each ordered matchup
+        """
+        self.species = species
+        self.matchups = matchups
+        # counts not written yet: [wins, losses] by species, [wins of pokemon1, losses of pokemon1, turns] by matchup
+        self._species_counts = {}
+        self._matchup_counts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_collection(cls, battles):
+        """
+        Create the leaderboard of a battle collection, with the statistics collections of the same database
+        :param battles: the collection of the battles
+        :return: the leaderboard
+        """
+        return cls(battles.database['species_stats'], battles.database['matchup_stats'])
+
+    def create_indexes(self):
+        """
+        Create the indexes of the leaderboards, if they don't exist yet
+        """
+        self.species.create_index([('wins', DESCENDING)])
+        self.species.create_index([('battles', DESCENDING)])
+
+    def record(self, pokemon1, pokemon2, winner, turns=0, first_won=None):
+        """
+        Count a battle, written by the next flush()
+        :param pokemon1: the name of the pokemon that moved first
+        :param pokemon2: the name of the other pokemon
+        :param winner: the name of the winner
+        :param turns: the number of turns of the battle
+        :param first_won: whether pokemon1 won, None to tell it from the name of the winner. The name can't tell
+        the sides of a mirror match apart (two pokemon of the same species): the mirror matches without it are
+        only counted in the species totals, with a win and a loss
+        """
+        mirror_unknown = pokemon1 == pokemon2 and first_won is None
+        won = winner == pokemon1 if first_won is None else first_won
+        with self._lock:
+            for name, wins in ((pokemon1, won), (pokemon2, not won)):
+                counts = self._species_counts.setdefault(name, [0, 0])
+                counts[0 if wins else 1] += 1
+            if mirror_unknown:
+                return
+            counts = self._matchup_counts.setdefault((pokemon1, pokemon2), [0, 0, 0])
+            counts[0 if won else 1] += 1
+            counts[2] += turns
+
+    def record_document(self, document):
+        """
+        Count a battle from its document, embedded or normalized
+        :param document: the battle document
+        """
+        # pokemon1 won if it still has HP at the end of the battle, the compact documents only have its HP before it
+        first_won = None if document.get('compact') else document['pokemon1']['hp'] > 0
+        self.record(document['pokemon1']['name'], document['pokemon2']['name'], document['winner'],
+                    document.get('turns', 0), first_won)
+
+    def flush(self):
+        """
+        Write the battles counted since the last flush, with unordered $inc upserts.
+        If a write fails, the counts it did not write are kept for the next flush and the error is raised.
+        The matchups are only written after the species, so the two collections count the same battles
+        """
+        with self._lock:
+            species_counts, self._species_counts = self._species_counts, {}
+            matchup_counts, self._matchup_counts = self._matchup_counts, {}
+        if not species_counts and not matchup_counts:
+            return
+        with metrics.timer('leaderboard_update'):
+            try:
+                if species_counts:
+                    self.species.bulk_write([
+                        UpdateOne({'_id': name}, {'$inc': {'wins': wins, 'losses': losses, 'battles': wins + losses}},
+                                  upsert=True)
+                        for name, (wins, losses) in species_counts.items()], ordered=False)
+            except Exception as e:
+                self._restore(_unwritten(species_counts, e), matchup_counts)
+                raise
+            if not matchup_counts:
+                return
+            try:
+                self.matchups.bulk_write([
+                    UpdateOne({'_id': _matchup_key(pokemon1, pokemon2)},
+                              {'$setOnInsert': {'pokemon1': pokemon1, 'pokemon2': pokemon2},
+                               '$inc': {'wins': wins, 'losses': losses, 'battles': wins + losses, 'turns': turns}},
+                              upsert=True)
+                    for (pokemon1, pokemon2), (wins, losses, turns) in matchup_counts.items()], ordered=False)
+            except Exception as e:
+                self._restore({}, _unwritten(matchup_counts, e))
+                raise
+
+    def _restore(self, species_counts, matchup_counts):
+        # the counts not written are added back to the ones recorded since the flush started
+        with self._lock:
+            for pending, counts in ((self._species_counts, species_counts), (self._matchup_counts, matchup_counts)):
+                for key, values in counts.items():
+                    current = pending.setdefault(key, [0] * len(values))
+                    for i, value in enumerate(values):
+                        current[i] += value
+
+    def clear(self):
+        """
+        Delete all the statistics, written and not
+        """
+        with self._lock:
+            self._species_counts.clear()
+            self._matchup_counts.clear()
+        self.species.delete_many({})
+        self.matchups.delete_many({})
+
+    def record_of(self, name):
+        """
+        Get the record of a species
+        :param name: the name of the species
+        :return: a dictionary with the battles, wins, losses and win rate of the species
+        """
+        return _record(self.species.find_one({'_id': name}))
+
+    def head_to_head(self, pokemon1, pokemon2):
+        """
+        Get the record of a species against another, whichever moved first
+        :param pokemon1: the name of the species
+        :param pokemon2: the name of the rival species
+        :return: a dictionary with the battles, wins, losses and win rate of pokemon1 against pokemon2,
+        the mean number of turns, and the record of each order ('first' when pokemon1 moved first, 'second' otherwise)
+        """
+        first = self.matchups.find_one({'_id': _matchup_key(pokemon1, pokemon2)}) or {}
+        # the two orders of a mirror match are the same matchup
+        second = self.matchups.find_one({'_id': _matchup_key(pokemon2, pokemon1)}) or {} if pokemon1 != pokemon2 else {}
+        # in the other order the wins of the matchup are the ones of pokemon2
+        second = {'wins': second.get('losses', 0), 'losses': second.get('wins', 0), 'turns': second.get('turns', 0)}
+        total = {field: first.get(field, 0) + second[field] for field in ('wins', 'losses', 'turns')}
+        record = _record(total)
+        record.update(pokemon1=pokemon1, pokemon2=pokemon2, first=_record(first), second=_record(second),
+                      mean_turns=total['turns'] / record['battles'] if record['battles'] else 0.0)
+        return record
+
+    def top(self, n=10, by='wins'):
+        """
+        Get the leaderboard of the species
+        :param n: the number of species
+        :param by: the field the species are ranked by, 'wins' or 'battles'
+        :return: the records of the first n species, with their name
+        """
+        return [dict(_record(document), name=document['_id'])
+                for document in self.species.find({}, sort=[(by, DESCENDING)], limit=n)]
+
+    def backfill(self, battles, batch_size=DEFAULT_BACKFILL_BATCH_SIZE):
+        """
+        Rebuild the statistics from the battles already saved, reading only the names, the winner and the turns
+        of batch_size battles per round trip. The statistics are cleared first, so the battles saved during
+        the backfill must not be recorded at the same time
+        :param battles: the collection of the battles
+        :param batch_size: the number of battles read and counted per flush
+        :return: the number of battles counted
+        """
+        self.clear()
+        count = 0
+        for document in battles.find({}, projection=BACKFILL_PROJECTION, batch_size=batch_size):
+            self.record_document(document)
+            count += 1
+            if count % batch_size == 0:
+                self.flush()
+                logging.info("{0} battles counted in the leaderboard".format(count))
+        self.flush()
+        return count
+
+
+def _unwritten(counts, error):
+    # the writes are unordered, after a BulkWriteError only the updates in its write errors were not applied
+    if isinstance(error, errors.BulkWriteError):
+        failed = {write_error['index'] for write_error in error.details.get('writeErrors', [])}
+        return {key: values for index, (key, values) in enumerate(counts.items()) if index in failed}
+    return counts
+
+
+def _matchup_key(pokemon1, pokemon2):
+    return '{0}|{1}'.format(pokemon1, pokemon2)
+
+
+def _record(document):
+    document = document or {}
+    wins = document.get('wins', 0)
+    losses = document.get('losses', 0)
+    battles = wins + losses
+    return {'battles': battles, 'wins': wins, 'losses': losses, 'win_rate': wins / battles if battles else 0.0}
@@ -0,0 +1,178 @@
+import copy
+import threading
+
+from bson import ObjectId
+from pymongo import errors
+
+
+class InMemoryCollection:
+    """
+    In-memory stand-in for a pymongo collection, implementing the few methods used by the program,
+    to run tests and benchmarks without a MongoDB server
+    """
+
+    def __init__(self, name='battle'):
+        """
+        Create an empty collection
+        :param name: the name of the collection
+        """
+        self.name = name
+        self.documents = {}
+        # the keys of the indexes created on the collection, they are not used by the queries
+        self.indexes = []
+        self._lock = threading.Lock()
+
+    def insert_one(self, document):
+        """
+        Insert a document, adding an _id if it has none
+        :param document: the document
+        """
+        with self._lock:
+            self._insert(document)
+
+    def insert_many(self, documents, ordered=True):
+        """
+        Insert many documents, adding an _id to those that have none.
+        As in pymongo, an unordered insert goes on after a failed document
+        :param documents: the documents
+        :param ordered: if True, stop at the first failed document
+        """
+        write_errors = []
+        inserted = 0
+        with self._lock:
+            for index, document in enumerate(documents):
+                try:
+                    self._insert(document)
+                    inserted += 1
+                except errors.DuplicateKeyError as e:
+                    write_errors.append({'index': index, 'code': 11000, 'errmsg': str(e), 'op': document})
+                    if ordered:
+                        break
+        if write_errors:
+            raise errors.BulkWriteError({'writeErrors': write_errors, 'nInserted': inserted})
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, batch_size=0):
+        """
+        Find the documents whose fields are equal to the ones of the filter
+        :param filter: the filter, a dictionary of dotted field names and values
+        :param projection: ignored, the whole documents are returned
+        :param sort: the list of (field, direction) to sort the documents by
+        :param limit: the maximum number of documents, 0 for no limit
+        :param batch_size: ignored, the documents are already in memory
+        :return: copies of the matching documents
+        """
+        with self._lock:
+            documents = [document for document in self.documents.values() if _matches(document, filter or {})]
+        for field, direction in reversed(sort or []):
+            documents.sort(key=lambda document: _get(document, field), reverse=direction < 0)
+        if limit:
+            documents = documents[:limit]
+        return [copy.deepcopy(document) for document in documents]
+
+    def find_one(self, filter=None):
+        """
+        Find the first document whose fields are equal to the ones of the filter
+        :param filter: the filter
+        :return: a copy of the document, or None if no document matches
+        """
+        if filter and set(filter) == {'_id'} and not isinstance(filter['_id'], dict):
+            with self._lock:
+                document = self.documents.get(filter['_id'])
+            return copy.deepcopy(document)
+        documents = self.find(filter)
+        return documents[0] if documents else None
+
+    def update_one(self, filter, update, upsert=False):
+        """
+        Update the first document matching the filter, with the $set, $setOnInsert and $inc operators.
+        With upsert, a document made of the filter and the update is inserted if no document matches
+        :param filter: the filter
+        :param update: the update
+        :param upsert: whether to insert a document if no document matches
+        """
+        with self._lock:
+            if set(filter) == {'_id'} and not isinstance(filter['_id'], dict):
+                matching = [self.documents[filter['_id']]] if filter['_id'] in self.documents else []
+            else:
+                matching = [document for document in self.documents.values() if _matches(document, filter)]
+            if matching:
+                document = matching[0]
+            elif upsert:
+                document = {field: value for field, value in filter.items() if not isinstance(value, dict)}
+                _set_fields(document, update.get('$setOnInsert', {}))
+                self._insert(document)
+                document = self.documents[document['_id']]
+            else:
+                return
+            _set_fields(document, update.get('$set', {}))
+            for field, amount in update.get('$inc', {}).items():
+                _set_fields(document, {field: (_get(document, field) or 0) + amount})
+
+    def bulk_write(self, requests, ordered=True):
+        """
+        Run many UpdateOne requests
+        :param requests: the pymongo UpdateOne requests
+        :param ordered: ignored, the updates can't fail
+        """
+        for request in requests:
+            self.update_one(request._filter, request._doc, upsert=request._upsert)
+
+    def delete_many(self, filter):
+        """
+        Delete the documents whose fields are equal to the ones of the filter
+        :param filter: the filter
+        """
+        with self._lock:
+            for key in [key for key, document in self.documents.items() if _matches(document, filter)]:
+                del self.documents[key]
+
+    def create_index(self, keys, **kwargs):
+        """
+        Create an index, only recorded in indexes
+        :param keys: the key or the list of (key, direction) of the index
+        """
+        self.indexes.append(keys)
+
+    def count_documents(self, filter):
+        """
+        Count the documents whose fields are equal to the ones of the filter
+        :param filter: the filter
+        :return: the number of matching documents
+        """
+        return len(self.find(filter))
+
+    def _insert(self, document):
+        document.setdefault('_id', ObjectId())
+        if document['_id'] in self.documents:
+            raise errors.DuplicateKeyError('E11000 duplicate key error collection: {0} dup key: {{ _id: {1} }}'.format(
+                self.name, document['_id']))
+        self.documents[document['_id']] = copy.deepcopy(document)
+
+
+def _get(document, field):
+    for key in field.split('.'):
+        if not isinstance(document, dict) or key not in document:
+            return None
+        document = document[key]
+    return document
+
+
+def _set_fields(document, fields):
+    for field, value in fields.items():
+        *parents, key = field.split('.')
+        for parent in parents:
+            document = document.setdefault(parent, {})
+        document[key] = copy.deepcopy(value)
+
+
+def _matches(document, filter):
+    for field, value in filter.items():
+        if isinstance(value, dict) and '$in' in value:
+            if _get(document, field) not in value['$in']:
+                return False
+        elif isinstance(value, dict) and '$gt' in value:
+            if _get(document, field) is None or not _get(document, field) > value['$gt']:
+                return False
+        elif _get(document, field) != value:
+            return False
+    return True
@@ -0,0 +1,178 @@
+import logging
+import threading
+
+from bson import encode
+from pymongo import errors
+
+from src import metrics
+from src.models.battle import DB_BYTES, DB_INSERTS, Battle
+from src.models.battle_log import BattleLog
+from src.models.move import Move
+from src.models.pokemon import Pokemon
+
+# fields of the battle documents that are indexed, to find the battles of a pokemon
+INDEXES = ['winner', 'loser', 'pokemon1.id', 'pokemon2.id']
+
+
+class NormalizedStore:
+    """
+    Normalized storage of the battles: the species and the moves are saved once in their own collections,
+    keyed by PokeAPI id, and the battle documents only reference them, with the state of each pokemon
+    in the battle (level, HP, and the PP of its moves).
+    Species and moves are never updated once saved, as the PokeAPI data of an id does not change
+    """
+
+    def __init__(self, battles, species, moves):
+        """
+        Create the store
+        :param battles: the collection of the battles
+        :param species: the collection of the species
+        :param moves: the collection of the moves
+        """
+        self.battles = battles
+        self.species = species
+        self.moves = moves
+        # ids of the species and moves already saved by the store, they are not sent to the database again
+        self._saved_species = set()
+        self._saved_moves = set()
+        # species and moves already read by the store, by id
+        self._species_cache = {}
+        self._moves_cache = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_collection(cls, battles):
+        """
+        Create the store of a battle collection, with the species and move collections of the same database
+        :param battles: the collection of the battles
+        :return: the store
+        """
+        return cls(battles, battles.database['species'], battles.database['move'])
+
+    def create_indexes(self):
+        """
+        Create the indexes of the battle collection, if they don't exist yet
+        """
+        for field in INDEXES:
+            self.battles.create_index(field)
+
+    def to_document(self, battle, compact=False):
+        """
+        Get the normalized document of a battle, saving its species and moves first if needed
+        :param battle: the battle
+        :param compact: if True, save the pokemon as they were before the battle and no events (see Battle.to_document)
+        :return: the document
+        """
+        if compact and not battle.compact:
+            pokemon = battle.starting_pokemon()
+            events = BattleLog()
+        else:
+            pokemon = (battle.pokemon1, battle.pokemon2)
+            events = battle.events
+        document = battle.model_dump(exclude={'pokemon1', 'pokemon2', 'events'})
+        document.update(pokemon1=self._reference(pokemon[0]), pokemon2=self._reference(pokemon[1]),
+                        events=events.to_document(), compact=compact or battle.compact, normalized=True)
+        return document
+
+    def save(self, battle, compact=False):
+        """
+        Save a battle to the database
+        :param battle: the battle
+        :param compact: if True, save the battle in the compact format
+        """
+        with metrics.timer('serialize'):
+            document = self.to_document(battle, compact)
+        try:
+            with metrics.timer('db_insert'):
+                self.battles.insert_one(document)
+        except errors.PyMongoError as e:
+            logging.error('Unable to insert battle to DB!\n{0}'.format(e))
+            raise e
+        else:
+            DB_INSERTS.inc()
+            if metrics.enabled():
+                DB_BYTES.inc(len(encode(document)))
+            logging.info("Battle saved to the database.")
+            logging.info("Battle id: {0}".format(document["_id"]))
+
+    def load(self, document):
+        """
+        Rebuild a battle from its normalized document, the species and moves are read once and then cached
+        :param document: the battle document
+        :return: the battle
+        """
+        document = dict(document)
+        document['pokemon1'] = self._pokemon(document['pokemon1'])
+        document['pokemon2'] = self._pokemon(document['pokemon2'])
+        return Battle(**document)
+
+    def find(self, filter=None):
+        """
+        Find battles
+        :param filter: the filter of the battle documents
+        :return: a generator of the battles
+        """
+        for document in self.battles.find(filter or {}):
+            yield self.load(document)
+
+    def _reference(self, pokemon):
+        self._save_species(pokemon)
+        for move in pokemon.moves:
+            self._save_move(move)
+        return {'id': pokemon.id, 'name': pokemon.name, 'level': pokemon.level, 'hp': pokemon.hp,
+                'max_hp': pokemon.max_hp, 'moves': [_move_key(move) for move in pokemon.moves],
+                'pp': [move.pp for move in pokemon.moves]}
+
+    def _save_species(self, pokemon):
+        if pokemon.id in self._saved_species:
+            return
+        # the base HP of the species, a pokemon has the base HP plus its level
+        self._upsert(self.species, pokemon.id, {'name': pokemon.name, 'hp': pokemon.max_hp - pokemon.level,
+                                                'attack': pokemon.attack, 'defense': pokemon.defense,
+                                                'speed': pokemon.speed, 'types': list(pokemon.types)})
+        with self._lock:
+            self._saved_species.add(pokemon.id)
+
+    def _save_move(self, move):
+        key = _move_key(move)
+        if key in self._saved_moves:
+            return
+        self._upsert(self.moves, key, {'name': move.name, 'type': move.type, 'power': move.power,
+                                       'accuracy': move.accuracy, 'max_pp': move.max_pp})
+        with self._lock:
+            self._saved_moves.add(key)
+
+    @staticmethod
+    def _upsert(collection, key, document):
+        try:
+            collection.update_one({'_id': key}, {'$setOnInsert': document}, upsert=True)
+        except errors.DuplicateKeyError:
+            # another process saved it at the same time
+            pass
+
+    def _pokemon(self, reference):
+        species = self._cached(self._species_cache, self.species, reference['id'])
+        moves = []
+        for key, pp in zip(reference['moves'], reference['pp']):
+            move = self._cached(self._moves_cache, self.moves, key)
+            moves.append(Move(id=move['_id'] if isinstance(move['_id'], int) else None, name=move['name'],
+                              type=move['type'], power=move['power'], accuracy=move['accuracy'], pp=pp,
+                              max_pp=move['max_pp']))
+        return Pokemon(id=reference['id'], name=reference['name'], level=reference['level'], hp=reference['hp'],
+                       max_hp=reference['max_hp'], attack=species['attack'], defense=species['defense'],
+                       speed=species['speed'], types=species['types'], moves=moves)
+
+    def _cached(self, cache, collection, key):
+        document = cache.get(key)
+        if document is None:
+            document = collection.find_one({'_id': key})
+            if document is None:
+                raise LookupError("{0} {1} not found".format(collection.name, key))
+            with self._lock:
+                cache[key] = document
+        return document
+
+
+def _move_key(move):
+    # the moves built without a PokeAPI id (e.g. in tests) are keyed by name
+    return move.id if move.id is not None else move.name
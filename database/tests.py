@@ -0,0 +1,299 @@
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from bson import encode
+from pymongo import errors
+from database import db_config, export
+from database.battle_sink import BattleSink
+from database.leaderboard import Leaderboard
+from database.memory_collection import InMemoryCollection
+from database.normalized import NormalizedStore
+from src.models.tests import make_battle
+
+
+class TestBattleSink(unittest.TestCase):
+    def setUp(self):
+        self.collection = InMemoryCollection()
+
+    def test_batches(self):
+        with patch.object(self.collection, 'insert_many', wraps=self.collection.insert_many) as insert_many:
+            with BattleSink(self.collection, batch_size=10, flush_interval=60) as sink:
+                for i in range(25):
+                    sink.add_document({'_id': i})
+
+        # Assert that the battles are inserted in batches, and the last one when the sink is closed
+        self.assertEqual(len(self.collection.documents), 25)
+        self.assertEqual([len(call.args[0]) for call in insert_many.call_args_list], [10, 10, 5])
+        self.assertEqual(sink.inserted, 25)
+
+    def test_flush_interval(self):
+        with BattleSink(self.collection, batch_size=10, flush_interval=0.01) as sink:
+            sink.add_document({'_id': 1})
+            time.sleep(0.2)
+
+            # Assert that the battle is inserted before the batch is full
+            self.assertEqual(len(self.collection.documents), 1)
+
+    def test_failed_documents(self):
+        with BattleSink(self.collection, batch_size=3) as sink:
+            for i in (1, 2, 1):
+                sink.add_document({'_id': i})
+            sink.flush()
+
+            # Assert that the duplicate battle is reported instead of raising
+            self.assertEqual(sink.inserted, 2)
+            self.assertEqual(len(sink.failed), 1)
+            self.assertEqual(sink.failed[0][0], {'_id': 1})
+
+    def test_unexpected_errors(self):
+        original_insert_many = self.collection.insert_many
+
+        def insert_many(documents, ordered):
+            if {'_id': 1} in documents:
+                raise ValueError("cannot encode object")
+            return original_insert_many(documents, ordered)
+
+        leaderboard = Leaderboard(InMemoryCollection(), InMemoryCollection())
+        with patch.object(self.collection, 'insert_many', side_effect=insert_many), \
+                patch.object(leaderboard, 'record_document', side_effect=KeyError('pokemon1')):
+            with BattleSink(self.collection, batch_size=1, leaderboard=leaderboard) as sink:
+                for i in range(3):
+                    sink.add_document({'_id': i})
+                sink.flush()
+
+                # Assert that the failed batch is reported and the writer keeps inserting the next ones
+                self.assertEqual(sink.inserted, 2)
+                self.assertEqual(sink.failed, [({'_id': 1}, 'cannot encode object')])
+
+    def test_closed(self):
+        sink = BattleSink(self.collection)
+        sink.close()
+
+        # Assert that a closed sink raises instead of waiting for its thread
+        with self.assertRaises(RuntimeError):
+            sink.add_document({'_id': 1})
+        with self.assertRaises(RuntimeError):
+            sink.flush()
+
+    def test_backpressure(self):
+        insert = threading.Event()
+        original_insert_many = self.collection.insert_many
+        self.collection.insert_many = lambda documents, ordered: insert.wait() and original_insert_many(documents, ordered)
+        sink = BattleSink(self.collection, batch_size=1, max_pending=1)
+        adding = threading.Thread(target=lambda: [sink.add_document({'_id': i}) for i in range(3)])
+        adding.start()
+        adding.join(0.2)
+
+        # Assert that adding blocks while the database is stuck, and resumes when it is back
+        self.assertTrue(adding.is_alive())
+        insert.set()
+        adding.join()
+        sink.close()
+        self.assertEqual(len(self.collection.documents), 3)
+
+    def test_add_battle(self):
+        battle = make_battle()
+        battle.perform_battle()
+        with BattleSink(self.collection) as sink:
+            sink.add(battle)
+
+        document = self.collection.find({'winner': battle.winner})[0]
+        self.assertEqual(document['seed'], battle.seed)
+
+
+class TestNormalizedStore(unittest.TestCase):
+    def setUp(self):
+        self.store = NormalizedStore(InMemoryCollection(), InMemoryCollection('species'), InMemoryCollection('move'))
+        self.battle = make_battle()
+        self.battle.perform_battle()
+
+    def test_round_trip(self):
+        self.store.save(self.battle)
+        self.store.save(self.battle.model_copy(deep=True))
+
+        # Assert that the species and the moves are saved once, and the battles are rebuilt equal to the original one
+        self.assertEqual(len(self.store.species.documents), 2)
+        self.assertEqual(len(self.store.moves.documents), 7)
+        battles = list(self.store.find({'winner': self.battle.winner}))
+        self.assertEqual(len(battles), 2)
+        self.assertEqual(battles[0].model_dump(), self.battle.model_dump())
+        self.assertEqual(battles[0].battle_log(), self.battle.battle_log())
+
+    def test_compact(self):
+        self.store.save(self.battle, compact=True)
+        battle = next(self.store.find())
+
+        # Assert that the compact battle is replayed from the pokemon rebuilt from the references
+        self.assertTrue(battle.compact)
+        self.assertEqual(battle.replay().model_dump(exclude={'compact'}), self.battle.model_dump(exclude={'compact'}))
+
+    def test_document_size(self):
+        # Assert that the normalized document is smaller than the embedded one
+        self.assertLess(len(encode(self.store.to_document(self.battle))), len(encode(self.battle.to_document())))
+
+    def test_indexes(self):
+        self.store.create_indexes()
+
+        # Assert that the battles can be found by pokemon
+        self.assertIn('pokemon1.id', self.store.battles.indexes)
+        self.assertIn('winner', self.store.battles.indexes)
+
+    def test_sink(self):
+        with BattleSink(self.store.battles, store=self.store) as sink:
+            sink.add(self.battle)
+
+        # Assert that the sink saves the normalized document
+        document = self.store.battles.find({'pokemon1.id': 1})[0]
+        self.assertTrue(document['normalized'])
+        self.assertEqual(document['pokemon1']['moves'], [move.name for move in self.battle.pokemon1.moves])
+
+
+class TestLeaderboard(unittest.TestCase):
+    def setUp(self):
+        self.leaderboard = Leaderboard(InMemoryCollection('species_stats'), InMemoryCollection('matchup_stats'))
+        self.battles = InMemoryCollection()
+        for i, (pokemon1, pokemon2, winner) in enumerate([('pikachu', 'charizard', 'pikachu'),
+                                                          ('pikachu', 'charizard', 'charizard'),
+                                                          ('charizard', 'pikachu', 'charizard'),
+                                                          ('pikachu', 'eevee', 'pikachu')]):
+            self.battles.insert_one({'_id': i, 'pokemon1': {'name': pokemon1, 'hp': 10 if winner == pokemon1 else 0},
+                                     'pokemon2': {'name': pokemon2}, 'winner': winner, 'turns': 10})
+
+    def test_backfill(self):
+        with patch.object(self.leaderboard, 'flush', wraps=self.leaderboard.flush) as flush:
+            count = self.leaderboard.backfill(self.battles, batch_size=3)
+
+        # Assert that the battles are counted in batches
+        self.assertEqual(count, 4)
+        self.assertEqual(flush.call_count, 2)
+        self.assertEqual(self.leaderboard.record_of('pikachu'),
+                         {'battles': 4, 'wins': 2, 'losses': 2, 'win_rate': 0.5})
+        self.assertEqual([record['name'] for record in self.leaderboard.top(2)], ['pikachu', 'charizard'])
+
+        # Assert that the backfill can run again without counting the battles twice
+        self.leaderboard.backfill(self.battles)
+        self.assertEqual(self.leaderboard.record_of('eevee')['losses'], 1)
+
+    def test_head_to_head(self):
+        self.leaderboard.backfill(self.battles)
+        record = self.leaderboard.head_to_head('pikachu', 'charizard')
+
+        # Assert that both orders of the matchup are combined
+        self.assertEqual((record['battles'], record['wins'], record['losses']), (3, 1, 2))
+        self.assertEqual(record['first']['battles'], 2)
+        self.assertEqual(record['second'], {'battles': 1, 'wins': 0, 'losses': 1, 'win_rate': 0.0})
+        self.assertEqual(record['mean_turns'], 10)
+        self.assertEqual(self.leaderboard.head_to_head('eevee', 'charizard')['battles'], 0)
+
+    def test_mirror_match(self):
+        # pikachu moving first wins, then loses, then a compact battle whose winning side is unknown
+        self.leaderboard.record_document({'pokemon1': {'name': 'pikachu', 'hp': 5}, 'pokemon2': {'name': 'pikachu'},
+                                          'winner': 'pikachu', 'turns': 4})
+        self.leaderboard.record_document({'pokemon1': {'name': 'pikachu', 'hp': 0}, 'pokemon2': {'name': 'pikachu'},
+                                          'winner': 'pikachu', 'turns': 6})
+        self.leaderboard.record_document({'pokemon1': {'name': 'pikachu', 'hp': 50}, 'pokemon2': {'name': 'pikachu'},
+                                          'winner': 'pikachu', 'turns': 8, 'compact': True})
+        self.leaderboard.flush()
+        record = self.leaderboard.head_to_head('pikachu', 'pikachu')
+
+        # Assert that the side that won is counted, and each mirror match is a win and a loss of the species
+        self.assertEqual((record['battles'], record['wins'], record['losses']), (2, 1, 1))
+        self.assertEqual(record['mean_turns'], 5)
+        self.assertEqual(self.leaderboard.record_of('pikachu'), {'battles': 6, 'wins': 3, 'losses': 3, 'win_rate': 0.5})
+
+    def test_flush(self):
+        with patch.object(self.leaderboard.species, 'bulk_write', wraps=self.leaderboard.species.bulk_write) as bulk_write:
+            for _ in range(100):
+                self.leaderboard.record('pikachu', 'charizard', 'pikachu', 5)
+            self.leaderboard.flush()
+            self.leaderboard.flush()
+
+        # Assert that the battles are written with one update per species, and nothing when there is nothing new
+        self.assertEqual(bulk_write.call_count, 1)
+        self.assertEqual(len(bulk_write.call_args.args[0]), 2)
+        self.assertEqual(self.leaderboard.record_of('charizard')['losses'], 100)
+
+    def test_flush_error(self):
+        self.leaderboard.record('pikachu', 'charizard', 'pikachu', 5)
+        with patch.object(self.leaderboard.matchups, 'bulk_write', side_effect=errors.AutoReconnect('down')):
+            with self.assertRaises(errors.AutoReconnect):
+                self.leaderboard.flush()
+        self.leaderboard.record('pikachu', 'charizard', 'charizard', 5)
+        with patch.object(self.leaderboard.species, 'bulk_write', side_effect=errors.AutoReconnect('down')):
+            with self.assertRaises(errors.AutoReconnect):
+                self.leaderboard.flush()
+        self.leaderboard.flush()
+
+        # Assert that the counts of the failed writes are written by the next flush, once
+        self.assertEqual(self.leaderboard.record_of('pikachu'), {'battles': 2, 'wins': 1, 'losses': 1, 'win_rate': 0.5})
+        self.assertEqual(self.leaderboard.head_to_head('pikachu', 'charizard')['battles'], 2)
+
+    def test_sink(self):
+        with BattleSink(InMemoryCollection(), batch_size=2, leaderboard=self.leaderboard) as sink:
+            for document in self.battles.find():
+                sink.add_document(document)
+            sink.add_document(self.battles.find_one({'_id': 0}))
+
+        # Assert that the inserted battles are counted, and not the duplicate
+        self.assertEqual(self.leaderboard.record_of('pikachu')['battles'], 4)
+
+
+class TestDbConfig(unittest.TestCase):
+    def tearDown(self):
+        db_config.set_client(None)
+
+    def test_lazy_client(self):
+        db_config.set_client(None)
+        with patch('pymongo.MongoClient') as client:
+            collection = db_config.get_collection()
+            db_config.get_collection('species')
+
+        # Assert that the client is created once, on first use, and shared
+        client.assert_called_once()
+        self.assertEqual(client.call_args.kwargs['authSource'], db_config.DATABASE)
+        self.assertIs(collection, client.return_value[db_config.DATABASE]['battle'])
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.collection = InMemoryCollection()
+        self.battle = make_battle()
+        self.battle.perform_battle()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_export(self):
+        for _ in range(5):
+            self.battle.save_to_db(self.collection)
+        self.battle.save_to_db(self.collection, compact=True)
+        count = export.export(self.collection, self.directory.name, chunk_size=4)
+        columns = export.load(self.directory.name)
+
+        # Assert that the battles are flattened in chunks, the compact battles without final HP
+        self.assertEqual(count, 6)
+        self.assertEqual(export.read_manifest(self.directory.name)['chunks'], ['battles-000000.npz', 'battles-000001.npz'])
+        self.assertEqual(list(columns['pokemon1']), ['Pikachu'] * 6)
+        self.assertEqual(list(columns['winner']), [self.battle.winner] * 6)
+        self.assertEqual(list(columns['turns']), [self.battle.turns] * 6)
+        self.assertEqual(list(columns['hp1']), [self.battle.pokemon1.hp] * 5 + [export.MISSING])
+        self.assertEqual(columns['seed'][0], self.battle.seed)
+        self.assertEqual(len(set(columns['id'])), 6)
+
+    def test_incremental(self):
+        self.battle.save_to_db(self.collection)
+        export.export(self.collection, self.directory.name)
+        for _ in range(2):
+            self.battle.save_to_db(self.collection)
+
+        # Assert that only the new battles are exported, and a full export starts over
+        self.assertEqual(export.export(self.collection, self.directory.name, incremental=True), 2)
+        self.assertEqual(export.export(self.collection, self.directory.name, incremental=True), 0)
+        self.assertEqual(len(export.load(self.directory.name)['id']), 3)
+        self.assertEqual(export.export(self.collection, self.directory.name), 3)
+        self.assertEqual(export.read_manifest(self.directory.name)['chunks'], ['battles-000000.npz'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,32 +1,91 @@
+import argparse
 import logging
 import random
-from src.app import get_input_pokemon
-from database.db_config import get_db_info
+from src import metrics
+from database.db_config import FILENAME, SECTION, get_collection, get_db_info
 import sys
-from src.models.battle import Battle
 import uuid
-from pymongo import MongoClient, errors
-
-logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
-
-# get the database information from the db_info.ini file
-filename = 'db_info.ini'
-section = 'mongo-db'
-db_info = get_db_info(filename, section)
-
-# connect to the database
-try:
-    client = MongoClient('mongodb://mongo:27017', username="username", password="secret", authSource="pokemon", authMechanism="SCRAM-SHA-256", uuidRepresentation='standard')
-    db = client['pokemon']
-    collection = db['battle']
-except errors.ConnectionFailure as e:
-    logging.error('Unable to connect to DB!\n{0}'.format(e))
-    sys.exit(1)
-else:
-    logging.info("Successfully connected to the database.")
 
-if __name__ == '__main__':
+# the PokeAPI, models and database modules are imported by the functions that use them,
+# so that the program starts fast and the runs that don't save battles never load the database driver
+
+
+def connect():
+    """
+    Connect to the database, with the client shared by the whole program
+    :return: the battle collection
+    """
+    from pymongo import errors
+
+    try:
+        collection = get_collection()
+    except errors.ConnectionFailure as e:
+        logging.error('Unable to connect to DB!\n{0}'.format(e))
+        sys.exit(1)
+    else:
+        logging.info("Successfully connected to the database.")
+    return collection
+
+
+def normalized_store(collection):
+    """
+    Get the normalized store of the battle collection, creating its indexes
+    :param collection: the battle collection
+    :return: the store
+    """
+    from database.normalized import NormalizedStore
+
+    store = NormalizedStore.from_collection(collection)
+    store.create_indexes()
+    return store
+
+
+def leaderboard_of(collection):
+    """
+    Get the leaderboard of the battle collection, creating its indexes
+    :param collection: the battle collection
+    :return: the leaderboard
+    """
+    from database.leaderboard import Leaderboard
+
+    leaderboard = Leaderboard.from_collection(collection)
+    leaderboard.create_indexes()
+    return leaderboard
+
+
+def leaderboard(collection, backfill, head_to_head):
+    """
+    Print the leaderboard of the species, or the head-to-head record of two species
+    :param collection: the battle collection
+    :param backfill: if True, rebuild the leaderboard from the saved battles first
+    :param head_to_head: the names of the two species, or None for the leaderboard
+    """
+    board = leaderboard_of(collection)
+    if backfill:
+        logging.info("{0} battles counted in the leaderboard".format(board.backfill(collection)))
+    if head_to_head:
+        record = board.head_to_head(*head_to_head)
+        print("{0} vs {1}: {2} battles, {3} wins, {4} losses ({5:.1%}), {6:.1f} turns on average".format(
+            record['pokemon1'], record['pokemon2'], record['battles'], record['wins'], record['losses'],
+            record['win_rate'], record['mean_turns']))
+    else:
+        for rank, record in enumerate(board.top(), 1):
+            print("{0:>3}. {1:<20} {2:>8} wins {3:>8} losses ({4:.1%})".format(
+                rank, record['name'], record['wins'], record['losses'], record['win_rate']))
+
+
+def play(compact, normalized=False):
+    """
+    Play battles between pokemon chosen by the user until the user stops
+    :param compact: if True, save the battles in the compact format
+    :param normalized: if True, save the battles in the normalized layout
+    """
+    from src.app import get_input_pokemon
+    from src.models.battle import Battle
+
     logging.info("Starting the pokemon battle...")
+    # the database is reached on the first save
+    collection = store = board = None
 
     battle_again = True
     while battle_again:
@@ -49,13 +108,23 @@ if __name__ == '__main__':
             'pokemon2': pokemon2,
             'winner': "",
             'loser': "",
-            'moves': [],
         }
-        battle = Battle(**battle)
+        with metrics.timer('validate'):
+            battle = Battle(**battle)
         battle.perform_battle()
 
         # save the battle to the database
-        battle.save_to_db(collection)
+        # in the compact storage mode only the pokemon, the seed and the result are saved
+        if collection is None:
+            collection = connect()
+            store = normalized_store(collection) if normalized else None
+            board = leaderboard_of(collection)
+        if store is not None:
+            store.save(battle, compact=compact)
+        else:
+            battle.save_to_db(collection, compact=compact)
+        board.record(battle.pokemon1.name, battle.pokemon2.name, battle.winner, battle.turns, battle.pokemon1.hp > 0)
+        board.flush()
 
         # ask the user if they want to battle again
         while True:
@@ -70,3 +139,79 @@ if __name__ == '__main__':
                 break
             else:
                 continue
+
+
+def batch(path, save, compact, normalized=False):
+    """
+    Play the battles of a file of matchup specs, one JSON object per line, and write the results to stdout
+    :param path: the path of the file, '-' for stdin
+    :param save: if True, save the battles to the database
+    :param compact: if True, save the battles in the compact format
+    :param normalized: if True, save the battles in the normalized layout
+    :return: the exit code, 1 if any matchup failed
+    """
+    from src.batch import run_batch
+    from database.battle_sink import BattleSink
+
+    lines = sys.stdin if path == '-' else open(path)
+    try:
+        if save:
+            collection = connect()
+            store = normalized_store(collection) if normalized else None
+            # the team battles have their own collection, they are not in the leaderboard of the species
+            with BattleSink(collection, compact=compact, store=store, leaderboard=leaderboard_of(collection)) as sink, \
+                    BattleSink(get_collection('team_battle')) as team_sink:
+                failed = run_batch(lines, sys.stdout, sink, team_sink=team_sink)[1]
+        else:
+            failed = run_batch(lines, sys.stdout)[1]
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pokemon battle field')
+    parser.add_argument('--batch', metavar='FILE', help="play the matchups of a JSONL file ('-' for stdin) "
+                                                        "and write the results as JSONL to stdout")
+    parser.add_argument('--save', action='store_true', help='in batch mode, also save the battles to the database')
+    parser.add_argument('--verbose', action='store_true', help='in batch mode, describe each battle in the logs')
+    parser.add_argument('--metrics-port', type=int, help='serve the metrics in the Prometheus text format on this '
+                                                         'local port, at /metrics')
+    parser.add_argument('--metrics-snapshot', metavar='FILE', help='append a JSON snapshot of the metrics to this file '
+                                                                   'periodically and at exit')
+    parser.add_argument('--metrics-interval', type=float, default=metrics.DEFAULT_SNAPSHOT_INTERVAL,
+                        help='the interval in seconds between two metrics snapshots')
+    parser.add_argument('--leaderboard', action='store_true', help='print the species with the most wins and exit')
+    parser.add_argument('--head-to-head', nargs=2, metavar='NAME', help='print the record of a species against '
+                                                                        'another and exit')
+    parser.add_argument('--backfill-leaderboard', action='store_true', help='rebuild the leaderboard from the saved '
+                                                                            'battles, then print it')
+    args = parser.parse_args()
+
+    db_info = get_db_info(FILENAME, SECTION)
+    compact = db_info.get('storage') == 'compact'
+    normalized = db_info.get('layout') == 'normalized'
+    if args.batch is None:
+        logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    else:
+        # the logs go to stderr, stdout only holds the results
+        logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO if args.verbose else logging.WARNING)
+
+    # the metrics are only recorded if they are served or dumped
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+    stop_snapshots = metrics.start_snapshots(args.metrics_snapshot, args.metrics_interval) if args.metrics_snapshot else None
+    try:
+        if args.leaderboard or args.head_to_head or args.backfill_leaderboard:
+            leaderboard(connect(), args.backfill_leaderboard, args.head_to_head)
+            status = 0
+        elif args.batch is None:
+            play(compact, normalized)
+            status = 0
+        else:
+            status = batch(args.batch, args.save, compact, normalized)
+    finally:
+        if stop_snapshots is not None:
+            stop_snapshots()
+    sys.exit(status)
@@ -1,11 +1,25 @@
 import math
+import os
+import threading
+from concurrent.futures import Future
 from sys import version
 import requests
-from functools import lru_cache
 import logging
 
+from src import metrics
+from src.cache import get_cache
+from src.fetcher import get_fetcher
 from src.models.move import Move
-from src.models.pokemon import Pokemon
+from src.models.species import SpeciesTemplate
+from src.move_index import get_move_index
+from src.pokedex import get_pokedex, level_up_move_urls
+
+# base url of the PokeAPI, can be changed with the POKEAPI_URL environment variable (e.g. to use a local mirror)
+API_URL = os.environ.get('POKEAPI_URL', 'https://pokeapi.co/api/v2')
+
+API_CALLS = metrics.counter('pokemon_api_calls_total', 'Calls to the PokeAPI')
+API_CACHE_HITS = metrics.counter('pokemon_api_cache_hits_total', 'PokeAPI responses found in the cache')
+API_CACHE_MISSES = metrics.counter('pokemon_api_cache_misses_total', 'PokeAPI responses not found in the cache')
 
 
 def get_input_pokemon(level, pokemon_number):
@@ -33,38 +47,98 @@ def get_input_pokemon(level, pokemon_number):
     return pokemon
 
 
+class SpeciesTemplateCache:
+    """
+    Cache of the species templates already built, by name.
+    The threads that need a template being built wait for it instead of building it again
+    """
+
+    def __init__(self):
+        """
+        Create an empty cache
+        """
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """
+        Get the template of a species, building it if it is not in the cache
+        :param name: the name of the species
+        :return: the template
+        """
+        with self._lock:
+            future = self._futures.get(name)
+            owner = future is None
+            if owner:
+                future = self._futures[name] = Future()
+        if owner:
+            try:
+                future.set_result(generate_species_template(name))
+            except Exception as e:
+                # the failures are not cached, the next call tries again
+                with self._lock:
+                    del self._futures[name]
+                future.set_exception(e)
+        return future.result()
+
+    def clear(self):
+        """
+        Remove all the templates from the cache
+        """
+        with self._lock:
+            self._futures.clear()
+
+
+# species templates built by the process, the species are only fetched and parsed the first time they are seen
+species_templates = SpeciesTemplateCache()
+
+
+@metrics.timed('generate_pokemon')
 def generate_pokemon(name, level):
     """
     Generate a pokemon with the given name and level
     :param name: the name of the pokemon
     :param level: the level of the pokemon
-    :return: the pokemon
+    :return: the pokemon, with its own moves and PP
     """
+    return species_templates.get(name).instantiate(level)
+
+
+@metrics.timed('build_template')
+def generate_species_template(name):
+    """
+    Generate the template of a species, from the pokedex if it has the species, otherwise from the API
+    :param name: the name of the species
+    :return: the species template
+    """
+    pokedex = get_pokedex()
+    if pokedex is not None:
+        species = pokedex.species(name)
+        if species is not None:
+            return species_template_from_pokedex(species)
 
     logging.info("Fetching pokemon data for {0}".format(name))
     json_pokemon = get_pokemon_data(name)
 
-    logging.info("FOUND! Generating pokemon {0} with level {1}".format(name, level))
+    logging.info("FOUND! Generating pokemon {0}".format(name))
 
-    # initialize the pokemon
-    pokemon = {
+    # initialize the species
+    template = {
         'id': json_pokemon['id'],
         'name': name,
-        'level': level,
     }
 
     # get the pokemon's stats from the API
     stats = json_pokemon['stats']
     for stat in stats:
         if stat['stat']['name'] == 'hp':
-            pokemon["hp"] = stat['base_stat'] + level
-            pokemon["max_hp"] = stat['base_stat'] + level
+            template["hp"] = stat['base_stat']
         elif stat['stat']['name'] == 'attack':
-            pokemon["attack"] = stat['base_stat']
+            template["attack"] = stat['base_stat']
         elif stat['stat']['name'] == 'defense':
-            pokemon["defense"] = stat['base_stat']
+            template["defense"] = stat['base_stat']
         elif stat['stat']['name'] == 'speed':
-            pokemon["speed"] = stat['base_stat']
+            template["speed"] = stat['base_stat']
 
     # set the pokemon's types
     types = []
@@ -72,36 +146,81 @@ def generate_pokemon(name, level):
         type = json_pokemon['types'][i]
         types.append(type['type']['name'])
 
-    pokemon["types"] = types
+    template["types"] = types
 
     #  get the pokemon's moves from the API
     logging.info("{0} has {1} moves".format(name, len(json_pokemon['moves'])))
     logging.info("Fetching moves for {0}".format(name))
+    # selecting only moves that can be learned by level up to avoid too many API calls
+    urls = level_up_move_urls(json_pokemon)
+
+    # the moves are ranked by power with the move index, only the moves missing from the index are fetched
+    # to rank them, then the best 4 moves; the moves are fetched concurrently and kept in the order of the API
+    move_index = get_move_index()
+    try:
+        with metrics.timer('fetch_moves'):
+            missing = [url for url in urls if url not in move_index]
+            json_moves = dict(zip(missing, get_fetcher().fetch_all(get_move_data, missing)))
+            for url, json_move in json_moves.items():
+                move_index.add(url, json_move)
+            best = move_index.best(urls)
+            remaining = [url for url in best if url not in json_moves]
+            json_moves.update(zip(remaining, get_fetcher().fetch_all(get_move_data, remaining)))
+    except requests.exceptions.RequestException as e:
+        logging.error("An error occurred: {0}".format(e))
+        raise e
+    logging.info("Fetched {0} of the {1} moves of {2}".format(len(json_moves), len(urls), name))
+    for url in remaining:
+        move_index.add(url, json_moves[url])
+    move_index.save()
+    with metrics.timer('validate'):
+        moves = [parse_move(json_moves[url]) for url in best]
+        # the best moves are already ranked, select_moves keeps their order
+        template["moves"] = select_moves([Move(**move) for move in moves if move["power"] is not None])
+
+        return SpeciesTemplate(**template)
+
+
+def generate_pokemon_from_pokedex(species, level):
+    """
+    Generate a pokemon with the given level from a pokedex species, without calling the API
+    :param species: the species from the pokedex
+    :param level: the level of the pokemon
+    :return: the pokemon
+    """
+    return species_template_from_pokedex(species).instantiate(level)
+
+
+def species_template_from_pokedex(species):
+    """
+    Generate the template of a pokedex species, without calling the API
+    :param species: the species from the pokedex
+    :return: the species template
+    """
+    logging.info("Generating pokemon {0} from the pokedex".format(species.name))
     moves = []
-    with requests.Session() as session:
-        for i in range(len(json_pokemon['moves'])):
-            # selecting only moves that can be learned by level up to avoid too many API calls
-            version_group_details = json_pokemon['moves'][i]['version_group_details']
-            for j in range(len(version_group_details)):
-                if version_group_details[j]['move_learn_method']['name'] != 'level-up':
-                    continue
-                else:
-                    move = generate_move(json_pokemon['moves'][i]['move']['url'], session)
-                    # filter only attacking moves
-                    if move["power"] is not None:
-                        moves.append(Move(**move))
-                    break
+    for record in species.moves:
+        # filter only attacking moves
+        if record.power is not None:
+            moves.append(Move(id=record.id, name=record.name, type=record.type, power=math.floor(record.power/10),
+                              accuracy=record.accuracy, pp=record.pp, max_pp=record.pp))
 
-    logging.info("Selecting for you the best 4 moves...")
-    # sort the moves by power
-    moves.sort(key=lambda x: x.power, reverse=True)
-    # get only the top 4 moves
-    if len(moves) > 4:
-        moves = moves[:4]
+    return SpeciesTemplate(id=species.id, name=species.name, hp=species.hp, attack=species.attack,
+                           defense=species.defense, speed=species.speed, types=list(species.types),
+                           moves=select_moves(moves))
 
-    pokemon["moves"] = moves
 
-    return Pokemon(**pokemon)
+def select_moves(moves):
+    """
+    Select the best 4 moves of a pokemon
+    :param moves: the attacking moves of the pokemon, in the order of the API
+    :return: the 4 moves with the highest power
+    """
+    logging.info("Selecting for you the best 4 moves...")
+    # sort the moves by power, the sort is stable so moves with the same power keep the order of the API
+    moves = sorted(moves, key=lambda x: x.power, reverse=True)
+    # get only the top 4 moves
+    return moves[:4]
 
 
 def generate_move(url, session):
@@ -112,36 +231,57 @@ def generate_move(url, session):
     """
     try:
         res = get_move_data(url, session)
-        move = {
-            'name': res['name'],
-            'type': res['type']['name'],
-            'accuracy': res['accuracy'],
-            'pp': res['pp'],
-            'max_pp': res['pp'],
-        }
-        if res['power'] is not None:
-            move["power"] = math.floor(res['power']/10)
-        else:
-            move["power"] = None
     except requests.exceptions.RequestException as e:
         logging.error("An error occurred:", e)
         raise e
 
+    return parse_move(res)
+
+
+def parse_move(res):
+    """
+    Parse the move data from the API
+    :param res: the move data
+    :return: the move
+    """
+    move = {
+        'id': res.get('id'),
+        'name': res['name'],
+        'type': res['type']['name'],
+        'accuracy': res['accuracy'],
+        'pp': res['pp'],
+        'max_pp': res['pp'],
+    }
+    if res['power'] is not None:
+        move["power"] = math.floor(res['power']/10)
+    else:
+        move["power"] = None
+
     return move
 
 
-@lru_cache(maxsize=None)
 def get_pokemon_data(name):
     """
     Get the pokemon data from the API.
-    Use lru_cache to cache the results of the API calls
+    The results of the API calls are kept in the persistent PokeAPI cache, keyed by their url as the moves,
+    so that the species of different API servers don't mix
     :param name: the name of the pokemon
     :return: the pokemon data
     """
+    cache = get_cache()
+    url = '{0}/pokemon/{1}'.format(API_URL, name)
+    json_pokemon = cache.get(url)
+    if json_pokemon is not None:
+        API_CACHE_HITS.inc()
+        return json_pokemon
+    API_CACHE_MISSES.inc()
     try:
-        res = requests.get('https://pokeapi.co/api/v2/pokemon/{0}'.format(name))
+        API_CALLS.inc()
+        with metrics.timer('fetch_pokemon'):
+            res = requests.get(url)
         res.raise_for_status()  # Raise an exception for unsuccessful HTTP status codes
         json_pokemon = res.json()
+        cache.set(url, json_pokemon)
         return json_pokemon
     except requests.exceptions.HTTPError as errh:
         if errh.response.status_code == 404:
@@ -163,18 +303,28 @@ def get_pokemon_data(name):
         raise err
 
 
-@lru_cache(maxsize=None)
 def get_move_data(url, session):
     """
     Get the move data from the API.
-    Use lru_cache to cache the results of the API calls
+    The results of the API calls are kept in the persistent PokeAPI cache, keyed by the move url only
     :param url: the url of the move
+    :param session: the session used to call the API on a cache miss
     :return: the move data
     """
+    cache = get_cache()
+    json_move = cache.get(url)
+    if json_move is not None:
+        API_CACHE_HITS.inc()
+        return json_move
+    API_CACHE_MISSES.inc()
     try:
-        res = session.get(url)
+        API_CALLS.inc()
+        with metrics.timer('fetch_move'):
+            res = session.get(url)
         res.raise_for_status()  # Raise an exception for unsuccessful HTTP status codes
-        return res.json()
+        json_move = res.json()
+        cache.set(url, json_move)
+        return json_move
     except requests.exceptions.HTTPError as errh:
         if errh.response.status_code == 404:
             logging.warning("Move not found! Try again.")
@@ -0,0 +1,177 @@
+import json
+import logging
+import queue
+import random
+import threading
+
+from src.app import generate_pokemon
+from src.models.battle import MAX_SEED, Battle, is_valid_seed
+from src.models.team_battle import MAX_TEAM_SIZE, TeamBattle
+
+# default number of threads resolving the species, they mostly wait for the PokeAPI
+DEFAULT_RESOLVERS = 8
+# default size of the queues between the stages, it bounds the number of matchups in flight
+DEFAULT_QUEUE_SIZE = 256
+
+# marks the end of the items in a queue
+_DONE = object()
+
+
+def read_specs(lines):
+    """
+    Parse the matchup specs, one JSON object per line with pokemon1, pokemon2 and optionally level and seed.
+    A team battle has the lists team1 and team2, of 1 to 6 species each, instead of pokemon1 and pokemon2.
+    The level is random between 10 and 30 if missing, as in the interactive mode, and at most 100
+    :param lines: the lines of the input
+    :return: a generator of the matchups, with their line number, or with an error message if invalid
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+            if 'team1' in spec or 'team2' in spec:
+                record = {'line': number, 'team1': _team(spec['team1']), 'team2': _team(spec['team2'])}
+            else:
+                record = {'line': number, 'pokemon1': spec['pokemon1'].lower(), 'pokemon2': spec['pokemon2'].lower()}
+            level = spec.get('level')
+            if level is None:
+                level = random.randint(10, 30)
+            # as in the service, the HP and damage of higher levels don't fit in the battle log
+            if not isinstance(level, int) or isinstance(level, bool) or not 1 <= level <= 100:
+                raise ValueError("the level must be between 1 and 100")
+            if not is_valid_seed(spec.get('seed')):
+                raise ValueError("the seed must be an integer between 0 and {0}".format(MAX_SEED))
+            record.update(level=level, seed=spec.get('seed'))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            record = {'line': number, 'error': 'Invalid matchup spec: {0!r}'.format(e)}
+        yield record
+
+
+def _team(names):
+    if not isinstance(names, list) or not 1 <= len(names) <= MAX_TEAM_SIZE:
+        raise ValueError("a team has 1 to {0} pokemon".format(MAX_TEAM_SIZE))
+    return [name.lower() for name in names]
+
+
+def resolve(record):
+    """
+    Generate the two pokemon of a matchup, the fastest one first as in the interactive mode.
+    The pokemon of a team battle keep the order of their team
+    :param record: the matchup
+    :return: the matchup with its pokemon
+    """
+    if 'team1' in record:
+        team1 = [generate_pokemon(name, record['level']) for name in record['team1']]
+        team2 = [generate_pokemon(name, record['level']) for name in record['team2']]
+        record['battle'] = TeamBattle(team1=team1, team2=team2, seed=record['seed'])
+        return record
+    pokemon1 = generate_pokemon(record['pokemon1'], record['level'])
+    pokemon2 = generate_pokemon(record['pokemon2'], record['level'])
+    if pokemon2.speed > pokemon1.speed:
+        pokemon1, pokemon2 = pokemon2, pokemon1
+    record['battle'] = Battle(pokemon1=pokemon1, pokemon2=pokemon2, winner="", loser="", seed=record['seed'])
+    return record
+
+
+def simulate(record):
+    """
+    Perform the battle of a matchup
+    :param record: the matchup with its battle
+    :return: the matchup with the result of the battle
+    """
+    battle = record['battle']
+    battle.perform_battle()
+    record.update(seed=battle.seed, winner=battle.winner, loser=battle.loser, turns=battle.turns)
+    return record
+
+
+def pipe(records, function, workers=1, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Apply a stage of the pipeline to a stream of matchups in background threads.
+    The matchups are read and handed over through bounded queues, so a stage only runs ahead of the next one
+    by a few matchups, and the results are yielded as they complete, not in the input order.
+    A matchup that fails keeps the error message and skips the next stages.
+    If reading the matchups raises, the error is raised again by the generator, after the matchups read so far
+    :param records: the matchups
+    :param function: the stage, called on each matchup
+    :param workers: the number of threads running the stage
+    :param queue_size: the size of the queues
+    :return: a generator of the matchups processed by the stage
+    """
+    inbox = queue.Queue(maxsize=queue_size)
+    outbox = queue.Queue(maxsize=queue_size)
+    # the error raised while reading the matchups, if any
+    failure = []
+
+    def feed():
+        try:
+            for record in records:
+                inbox.put(record)
+        except Exception as e:
+            failure.append(e)
+        finally:
+            # the workers always stop, so the generator never waits for matchups that will not come
+            for _ in range(workers):
+                inbox.put(_DONE)
+
+    def work():
+        while True:
+            record = inbox.get()
+            if record is _DONE:
+                outbox.put(_DONE)
+                return
+            if 'error' not in record:
+                try:
+                    record = function(record)
+                except Exception as e:
+                    logging.warning("Matchup on line {0} failed: {1!r}".format(record['line'], e))
+                    record['error'] = repr(e)
+            outbox.put(record)
+
+    threading.Thread(target=feed, daemon=True).start()
+    for _ in range(workers):
+        threading.Thread(target=work, daemon=True).start()
+
+    running = workers
+    while running:
+        record = outbox.get()
+        if record is _DONE:
+            running -= 1
+        else:
+            yield record
+    if failure:
+        raise failure[0]
+
+
+def run_batch(lines, output, sink=None, resolvers=DEFAULT_RESOLVERS, queue_size=DEFAULT_QUEUE_SIZE, team_sink=None):
+    """
+    Run the battles of a stream of matchup specs: the species are resolved, the battles simulated and
+    optionally saved, and one JSON line per matchup is written as soon as its battle is over
+    :param lines: the lines of the matchup specs
+    :param output: the file where the results are written
+    :param sink: the battle sink where the battles are saved, if any
+    :param resolvers: the number of threads resolving the species
+    :param queue_size: the size of the queues between the stages
+    :param team_sink: the battle sink where the team battles are saved, if any, they are not saved otherwise
+    :return: the number of matchups and the number of failed ones
+    """
+    records = pipe(read_specs(lines), resolve, resolvers, queue_size)
+    # the battles are CPU bound, more threads would only contend for the GIL
+    records = pipe(records, simulate, 1, queue_size)
+
+    total = failed = 0
+    for record in records:
+        battle = record.pop('battle', None)
+        total += 1
+        if 'error' in record:
+            failed += 1
+        elif isinstance(battle, TeamBattle):
+            if team_sink is not None:
+                team_sink.add(battle)
+        elif sink is not None:
+            sink.add(battle)
+        output.write(json.dumps(record) + '\n')
+        output.flush()
+    logging.info("Batch over: {0} matchups, {1} failed".format(total, failed))
+    return total, failed
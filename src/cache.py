@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# default location and limits of the PokeAPI cache, can be changed with environment variables
+DEFAULT_PATH = 'pokeapi_cache.sqlite3'
+DEFAULT_MAX_ENTRIES = 20000
+# PokeAPI data rarely changes, entries older than 30 days are fetched again
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+
+class ApiCache:
+    """
+    Persistent cache of the PokeAPI responses, stored in a local SQLite file.
+    Entries are compressed JSON documents, the least recently used ones are evicted when the cache is full
+    and entries older than the TTL are treated as missing, so they get fetched again.
+    The cache can be shared between threads.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        """
+        Open (or create) the cache
+        :param path: the path of the SQLite file, ':memory:' for a cache that is not persisted
+        :param max_entries: the maximum number of entries, the least recently used are evicted
+        :param ttl: the time to live of the entries in seconds, None for entries that never expire
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                                 'key TEXT PRIMARY KEY, value BLOB NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def get(self, key):
+        """
+        Get an entry from the cache
+        :param key: the key of the entry, the url of a species or a move
+        :return: the cached JSON document, or None if it is missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT value, created FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key, value):
+        """
+        Add an entry to the cache, evicting the least recently used entries if the cache is full
+        :param key: the key of the entry, the url of a species or a move
+        :param value: the JSON document to cache
+        """
+        now = time.time()
+        blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                                     (key, blob, now, now))
+            overflow = self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._connection.execute('DELETE FROM entries WHERE key IN '
+                                         '(SELECT key FROM entries ORDER BY accessed LIMIT ?)', (overflow,))
+                self.evictions += overflow
+                logging.debug("Evicted {0} entries from the PokeAPI cache".format(overflow))
+
+    def clear(self):
+        """
+        Remove all the entries from the cache
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries')
+
+    def stats(self):
+        """
+        Get the cache counters
+        :return: a dictionary with the hits, misses, evictions and entries of the cache
+        """
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': entries}
+
+    def close(self):
+        """
+        Close the cache file
+        """
+        with self._lock:
+            self._connection.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def read_ttl(value):
+    """
+    Read the time to live of the cache entries from the POKEAPI_CACHE_TTL environment variable
+    :param value: the value of the variable, None if it is not set
+    :return: the time to live in seconds, DEFAULT_TTL if the variable is not set, None (entries never expire)
+    if it is empty, 0 or 'none'
+    :raise ValueError: if the value is not a number of seconds
+    """
+    if value is None:
+        return DEFAULT_TTL
+    if value.strip().lower() in ('', '0', 'none'):
+        return None
+    if not value.strip().isdigit():
+        raise ValueError("Invalid POKEAPI_CACHE_TTL {0!r}: it must be a number of seconds, "
+                         "or empty, 0 or 'none' for entries that never expire".format(value))
+    return int(value)
+
+
+def get_cache():
+    """
+    Get the PokeAPI cache shared by the whole process, opening it on first use.
+    The location and limits are read from the POKEAPI_CACHE_PATH, POKEAPI_CACHE_MAX_ENTRIES
+    and POKEAPI_CACHE_TTL environment variables (see read_ttl)
+    :return: the PokeAPI cache
+    :raise ValueError: if POKEAPI_CACHE_TTL is invalid
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ApiCache(os.environ.get('POKEAPI_CACHE_PATH', DEFAULT_PATH),
+                              int(os.environ.get('POKEAPI_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+                              read_ttl(os.environ.get('POKEAPI_CACHE_TTL')))
+        return _cache
+
+
+def set_cache(cache):
+    """
+    Replace the PokeAPI cache shared by the whole process
+    :param cache: the new cache
+    """
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# default number of concurrent requests to the PokeAPI, can be changed with the POKEAPI_MAX_WORKERS environment variable
+DEFAULT_MAX_WORKERS = 8
+# default number of retries and backoff (in seconds, doubled at each retry) of the failed requests
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+# status codes of the responses that are retried
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class Fetcher:
+    """
+    Fetch PokeAPI documents concurrently with a bounded thread pool sharing one pooled session.
+    Failed requests (429 and 5xx) are retried with exponential backoff, honouring the Retry-After header,
+    and concurrent requests for the same url share the same in-flight request.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        """
+        Create the fetcher
+        :param max_workers: the maximum number of concurrent requests
+        :param retries: the maximum number of retries of a failed request
+        :param backoff_factor: the backoff factor of the retries
+        """
+        self.max_workers = max_workers
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS_CODES,
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pokeapi-fetcher')
+        self._in_flight = {}
+        self._lock = threading.RLock()
+
+    def submit(self, get_data, url):
+        """
+        Fetch a document in the thread pool, sharing the request if the same url is already being fetched
+        :param get_data: the function that fetches the document, called with the url and the session
+        :param url: the url of the document
+        :return: a future with the document
+        """
+        with self._lock:
+            future = self._in_flight.get(url)
+            if future is None:
+                future = self._executor.submit(get_data, url, self.session)
+                self._in_flight[url] = future
+                future.add_done_callback(lambda _: self._forget(url))
+        return future
+
+    def fetch_all(self, get_data, urls):
+        """
+        Fetch many documents concurrently
+        :param get_data: the function that fetches a document, called with the url and the session
+        :param urls: the urls of the documents
+        :return: the documents, in the same order of the urls
+        """
+        futures = [self.submit(get_data, url) for url in urls]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Wait for the pending requests and close the session
+        """
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def _forget(self, url):
+        with self._lock:
+            self._in_flight.pop(url, None)
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    """
+    Get the fetcher shared by the whole process, creating it on first use
+    :return: the fetcher
+    """
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            max_workers = int(os.environ.get('POKEAPI_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+            logging.debug("Creating the PokeAPI fetcher with {0} workers".format(max_workers))
+            _fetcher = Fetcher(max_workers=max_workers)
+        return _fetcher
+
+
+def set_fetcher(fetcher):
+    """
+    Replace the fetcher shared by the whole process
+    :param fetcher: the new fetcher
+    """
+    global _fetcher
+    with _fetcher_lock:
+        _fetcher = fetcher
@@ -0,0 +1,318 @@
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+# default upper bounds in seconds of the buckets of the latency histograms
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+# default interval in seconds between two metrics snapshots
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+
+# the metrics are only recorded when enabled, with the POKEMON_METRICS environment variable or enable()
+_enabled = os.environ.get('POKEMON_METRICS', '') not in ('', '0')
+# metrics by name, in the order they were created
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def enable(enabled=True):
+    """
+    Start or stop recording the metrics
+    :param enabled: whether the metrics are recorded
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def enabled():
+    """
+    Check if the metrics are recorded, to skip the work only needed by the metrics
+    :return: True if the metrics are recorded
+    """
+    return _enabled
+
+
+class Counter:
+    """
+    Counter that only goes up, e.g. the number of API calls
+    """
+
+    def __init__(self, name, help):
+        """
+        Create a counter
+        :param name: the name of the counter
+        :param help: the description of the counter
+        """
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increase the counter, if the metrics are enabled
+        :param amount: the increase
+        """
+        if not _enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+    def snapshot(self):
+        return self.value
+
+    def render(self):
+        return ["# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} counter".format(self.name),
+                "{0} {1}".format(self.name, self.value)]
+
+
+class Histogram:
+    """
+    Histogram of observed values, e.g. latencies, optionally split by the value of a label (e.g. the stage)
+    """
+
+    def __init__(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        """
+        Create a histogram
+        :param name: the name of the histogram
+        :param help: the description of the histogram
+        :param label: the name of the label of the observations, if any
+        :param buckets: the upper bounds of the buckets, in increasing order
+        """
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        # for each label value: the count of each bucket (and of the values above the last one), the sum and count
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        """
+        Record an observation, if the metrics are enabled
+        :param value: the observed value
+        :param label_value: the value of the label of the observation
+        """
+        if not _enabled:
+            return
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {str(label_value): {'count': count, 'sum': total, 'buckets': list(buckets)}
+                    for label_value, (buckets, total, count) in self._series.items()}
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} histogram".format(self.name)]
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda item: str(item[0]))
+            for label_value, (buckets, total, count) in series:
+                labels = '{0}="{1}",'.format(self.label, label_value) if self.label else ''
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float('inf'),), buckets):
+                    cumulative += bucket
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(self.name, labels, le, cumulative))
+                labels = '{{{0}}}'.format(labels.rstrip(',')) if labels else ''
+                lines.append("{0}_sum{1} {2}".format(self.name, labels, total))
+                lines.append("{0}_count{1} {2}".format(self.name, labels, count))
+        return lines
+
+
+def _register(metric):
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name, help):
+    """
+    Get a counter, creating it on first use
+    :param name: the name of the counter
+    :param help: the description of the counter
+    :return: the counter
+    """
+    return _registry.get(name) or _register(Counter(name, help))
+
+
+def histogram(name, help, label=None, buckets=DEFAULT_BUCKETS):
+    """
+    Get a histogram, creating it on first use
+    :param name: the name of the histogram
+    :param help: the description of the histogram
+    :param label: the name of the label of the observations, if any
+    :param buckets: the upper bounds of the buckets
+    :return: the histogram
+    """
+    return _registry.get(name) or _register(Histogram(name, help, label, buckets))
+
+
+# latency of each stage of a battle, from the PokeAPI fetch to the database insert
+STAGE_SECONDS = histogram('pokemon_stage_seconds', 'Latency of each stage in seconds', label='stage')
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(stage):
+    """
+    Time a block of code as a stage: with timer('fetch_pokemon'): ...
+    When the metrics are disabled, the same no-op context manager is returned without measuring anything
+    :param stage: the name of the stage
+    :return: a context manager
+    """
+    return _Timer(stage) if _enabled else _NULL_TIMER
+
+
+def timed(stage):
+    """
+    Decorator that times each call of a function as a stage
+    :param stage: the name of the stage
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    Get the current value of all the metrics
+    :return: a dictionary of the metrics by name, with the time of the snapshot
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {'time': time.time(), 'metrics': {metric.name: metric.snapshot() for metric in metrics}}
+
+
+def render():
+    """
+    Get all the metrics in the Prometheus text exposition format
+    :return: the text
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """
+    Reset all the metrics to zero (e.g. in tests)
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        metric.reset()
+
+
+def start_snapshots(path, interval=DEFAULT_SNAPSHOT_INTERVAL):
+    """
+    Append a snapshot of the metrics to a file periodically, one JSON object per line, in a background thread.
+    The metrics are enabled
+    :param path: the path of the file
+    :param interval: the interval in seconds between two snapshots
+    :return: a function that stops the snapshots, after writing a last one
+    """
+    enable()
+    stopping = threading.Event()
+
+    def run():
+        while True:
+            stopped = stopping.wait(interval)
+            with open(path, 'a') as file:
+                file.write(json.dumps(snapshot()) + "\n")
+            if stopped:
+                return
+
+    thread = threading.Thread(target=run, name='metrics-snapshots', daemon=True)
+    thread.start()
+    logging.info("Writing a metrics snapshot to {0} every {1} seconds".format(path, interval))
+
+    def stop():
+        stopping.set()
+        thread.join()
+
+    return stop
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """
+    Serve the metrics in the Prometheus text format at /metrics, in a background thread.
+    The metrics are enabled
+    :param port: the port of the server, 0 for a free port
+    :param host: the host of the server, local only by default
+    :return: the server, stopped with shutdown()
+    """
+    # imported lazily, most programs never serve the metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    enable()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info("Serving the metrics at http://{0}:{1}/metrics".format(host, server.server_address[1]))
+    return server
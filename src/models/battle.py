@@ -1,10 +1,33 @@
 import logging
 import random
-from pydantic import UUID4, BaseModel
-from pymongo import errors
+import secrets
+from typing import List, Optional
+from pydantic import UUID4, BaseModel, ConfigDict, Field, field_serializer, field_validator
 
+from src import metrics
+from src.models.battle_log import NO_PP, BattleLog
+from src.models.battle_state import PokemonState
 from src.models.pokemon import Pokemon
 
+# version of the battle engine, to be increased when a change of the rules makes old battles play differently
+ENGINE_VERSION = 2
+# the seeds are non-negative 64-bit integers, as the ones drawn by perform_battle
+MAX_SEED = 2 ** 63 - 1
+
+BATTLES = metrics.counter('pokemon_battles_total', 'Battles performed')
+TURNS = metrics.counter('pokemon_turns_total', 'Turns simulated by the battles')
+DB_INSERTS = metrics.counter('pokemon_db_inserts_total', 'Battles inserted in the database')
+DB_BYTES = metrics.counter('pokemon_db_bytes_written_total', 'Size in bytes of the battles inserted in the database')
+
+
+def is_valid_seed(seed):
+    """
+    Check a seed given by the user, before it reaches the random generators
+    :param seed: the seed
+    :return: True if the seed is None (a random one is drawn) or an integer between 0 and MAX_SEED
+    """
+    return seed is None or (isinstance(seed, int) and not isinstance(seed, bool) and 0 <= seed <= MAX_SEED)
+
 
 class Battle(BaseModel):
     """
@@ -20,58 +43,165 @@ class Battle(BaseModel):
     winner: str
     # winner and loser are the names of the pokemon that won and lost the battle
     loser: str
-    # moves is a list of the moves that were performed in the battle
-    moves: list
+    # turns is the number of turns of the battle
+    turns: int = 0
+    # seed of the random generator of the battle, the battle can be replayed from the seed
+    seed: Optional[int] = None
+    # version of the battle engine, battles are replayed only by the same version
+    engine_version: int = ENGINE_VERSION
+    # HP of pokemon1 and pokemon2 before the battle, None for the battles saved before it was recorded
+    starting_hp: Optional[List[int]] = None
+    # compact is True if the battle was saved without events, with the pokemon as they were before the battle
+    compact: bool = False
+    # events is the compact log of the attacks performed in the battle, turned into text by battle_log()
+    events: BattleLog = Field(default_factory=BattleLog)
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
 
+    @field_validator('events', mode='before')
+    @classmethod
+    def load_events(cls, events):
+        # the events are saved in the database as one list per field
+        if isinstance(events, dict):
+            return BattleLog(events)
+        return events
+
+    @field_serializer('events')
+    def dump_events(self, events):
+        return events.to_document()
+
+    @metrics.timed('simulate')
     def perform_battle(self):
         """
         Perform the battle.
         In each turn, each pokemon attacks the other pokemon and vice versa
         """
+        if self.seed is None:
+            self.seed = secrets.randbits(63)
+        rng = random.Random(self.seed)
+        self.starting_hp = [self.pokemon1.hp, self.pokemon2.hp]
+
+        # the battle runs on compact battle states, the models are updated when the battle is over
+        state1 = PokemonState(self.pokemon1, self.pokemon2, 0)
+        state2 = PokemonState(self.pokemon2, self.pokemon1, 1)
+        # the attacks are described in the logs only if they are shown
+        verbose = logging.getLogger().isEnabledFor(logging.INFO)
+
         # the turn is exececuted only if both pokemon have at least one move with PP > 0
         # and if both pokemon have HP > 0
-        while self.pokemon1.hp > 0 and self.pokemon2.hp > 0 and (sum([move.pp for move in self.pokemon1.moves]) > 0 and sum([move.pp for move in self.pokemon2.moves]) > 0):
+        while state1.hp > 0 and state2.hp > 0 and state1.total_pp > 0 and state2.total_pp > 0:
+            self.turns += 1
             # pokemon1 attacks pokemon2
-            rand1 = random.randint(0, len(self.pokemon1.moves) - 1)
-            move1, battle_moves1 = self.pokemon1.attack_rival(self.pokemon2, self.pokemon1.moves[rand1])
-            self.pokemon1.moves[rand1] = move1
-            self.moves.append(battle_moves1)
-            if self.pokemon2.hp == 0:
+            state1.attack_rival(state2, rng, self.events, self.turns, verbose)
+            if state2.hp == 0:
                 break
 
             # pokemon2 attacks pokemon1
-            rand2 = random.randint(0, len(self.pokemon2.moves) - 1)
-            move2, battle_moves2 = self.pokemon2.attack_rival(self.pokemon1, self.pokemon2.moves[rand2])
-            self.pokemon2.moves[rand2] = move2
-            self.moves.append(battle_moves2)
-            if self.pokemon1.hp == 0:
+            state2.attack_rival(state1, rng, self.events, self.turns, verbose)
+            if state1.hp == 0:
                 break
 
+        state1.save()
+        state2.save()
+
         # if one Pokémon's HP drops to zero or below, that Pokémon loses the battle.
         # the Pokémon with higher remaining HP at the end of the simulation is the winner.
         if self.pokemon1.hp > 0:
             self.winner = self.pokemon1.name
             self.loser = self.pokemon2.name
-            logging.info("{0} won!".format(self.pokemon1.name))
-            self.moves.append(["{0} won!".format(self.pokemon1.name)])
         else:
             self.winner = self.pokemon2.name
             self.loser = self.pokemon1.name
-            logging.info("{0} won!".format(self.pokemon2.name))
-            self.moves.append(["{0} won!".format(self.pokemon2.name)])
+        logging.info("{0} won!".format(self.winner))
+        BATTLES.inc()
+        TURNS.inc(self.turns)
 
-    def save_to_db(self, collection):
+    @metrics.timed('format_log')
+    def battle_log(self):
+        """
+        Describe the battle turn by turn
+        :return: a list with the strings that describe each attack, and the winner at the end
+        """
+        return self.events.render(self.pokemon1, self.pokemon2) + [["{0} won!".format(self.winner)]]
+
+    def starting_pokemon(self):
+        """
+        Get the two pokemon as they were before the battle, by undoing the events of the battle.
+        The HP before the battle is recorded in starting_hp. The battles saved before it was recorded get it from
+        the first attack received, which only works if it was not a knock out: the pokemon is then assumed to have
+        started with full HP, as the generated pokemon do, and replay() fails if it did not
+        :return: a copy of pokemon1 and pokemon2 before the battle
+        """
+        pokemon = (self.pokemon1.model_copy(deep=True), self.pokemon2.model_copy(deep=True))
+        if self.compact:
+            return pokemon
+        for event in self.events:
+            if not event.flags & NO_PP:
+                pokemon[event.attacker].moves[event.move].pp += 1
+        for i in range(2):
+            if self.starting_hp is not None:
+                pokemon[i].hp = self.starting_hp[i]
+                continue
+            hits = [event for event in self.events if event.attacker == 1 - i]
+            # each attack records the HP of the rival after it, so the first one gives the HP before the battle
+            if hits:
+                pokemon[i].hp = hits[0].hp + hits[0].damage if hits[0].hp > 0 else pokemon[i].max_hp
+        return pokemon
+
+    def replay(self):
+        """
+        Replay the battle from its seed, regenerating all the events
+        :return: a new battle, equal to the original one
+        :raise ValueError: if the battle can't be replayed, or its replay differs from it
+        """
+        if self.seed is None:
+            raise ValueError("The battle has no seed and can't be replayed")
+        if self.engine_version != ENGINE_VERSION:
+            raise ValueError("The battle was performed by the engine version {0}, can't replay it with version {1}".format(
+                self.engine_version, ENGINE_VERSION))
+        pokemon1, pokemon2 = self.starting_pokemon()
+        battle = Battle(pokemon1=pokemon1, pokemon2=pokemon2, winner="", loser="", seed=self.seed)
+        battle.perform_battle()
+        if not self.compact and battle.events != self.events:
+            raise ValueError("The replay of the battle differs from it, its pokemon can't be restored")
+        return battle
+
+    def to_document(self, compact=False):
+        """
+        Get the document of the battle to save in the database
+        :param compact: if True, save only the pokemon before the battle, the seed and the result,
+        the events can be regenerated with replay()
+        :return: the document
+        """
+        if not compact or self.compact:
+            return self.model_dump()
+        pokemon1, pokemon2 = self.starting_pokemon()
+        return self.model_copy(update={'pokemon1': pokemon1, 'pokemon2': pokemon2, 'events': BattleLog(),
+                                       'compact': True}).model_dump()
+
+    def save_to_db(self, collection, compact=False):
         """
         Save the battle to the database
         :param collection: the collection where the battle will be saved
+        :param compact: if True, save the battle in the compact format (see to_document)
         """
-        battle_json = self.model_dump()
+        # imported lazily, the battles that are not saved never load the database driver
+        from bson import encode
+        from pymongo import errors
+
+        with metrics.timer('serialize'):
+            battle_json = self.to_document(compact)
         try:
-            collection.insert_one(document=battle_json)
+            with metrics.timer('db_insert'):
+                collection.insert_one(document=battle_json)
         except errors.PyMongoError as e:
             logging.error('Unable to insert battle to DB!\n{0}'.format(e))
             raise e
         else:
+            DB_INSERTS.inc()
+            # the size of the document is only computed for the metrics
+            if metrics.enabled():
+                DB_BYTES.inc(len(encode(battle_json)))
             logging.info("Battle saved to the database.")
             logging.info("Battle id: {0}".format(battle_json["_id"]))
 
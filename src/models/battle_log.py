@@ -0,0 +1,95 @@
+from array import array
+from collections import namedtuple
+
+# flags of an event
+CRITICAL_HIT = 1
+NO_PP = 2
+# in a team battle, the attacker enters the battle (hp is its HP, the other fields are zero)
+SWITCH = 4
+
+# an attack performed in a battle: the turn, the index of the attacker (0 for pokemon1, 1 for pokemon2,
+# in a team battle 2 * its slot in the team + 0 for team1 and 1 for team2),
+# the index of the move, the damage, the flags, the HP of the rival and the PP of the move after the attack
+BattleEvent = namedtuple('BattleEvent', ['turn', 'attacker', 'move', 'damage', 'flags', 'hp', 'pp'])
+
+
+def describe(event, attacker, rival):
+    """
+    Describe an event with the same strings used by Pokemon.attack_rival
+    :param event: the event
+    :param attacker: the attacking pokemon
+    :param rival: the rival pokemon
+    :return: a list of strings that describe the event
+    """
+    if event.flags & SWITCH:
+        return ["{0} enters the battle! HP {1}/{2}".format(attacker.name, event.hp, attacker.max_hp)]
+    move = attacker.moves[event.move]
+    if event.flags & NO_PP:
+        return ["{0} want to use {1} but has no more PP!".format(attacker.name, move.name)]
+    return ["{0} used {1}! PP {2}/{3}".format(attacker.name, move.name, event.pp, move.max_pp),
+            "{0} received {1} damage. HP {2}/{3}\n".format(rival.name, event.damage, event.hp, rival.max_hp)]
+
+
+class BattleLog:
+    """
+    Compact log of the events of a battle, stored as one typed array per field.
+    The events are turned into text only when describe() or render() is called, and are saved in the database
+    as one list per field, so battles can be queried by event fields (e.g. {"events.damage": {"$gt": 30}}).
+    """
+    __slots__ = BattleEvent._fields
+
+    # typecodes of the arrays of each field
+    TYPECODES = {'turn': 'H', 'attacker': 'B', 'move': 'B', 'damage': 'H', 'flags': 'B', 'hp': 'H', 'pp': 'H'}
+
+    def __init__(self, document=None):
+        """
+        Create a log, empty or from a database document
+        :param document: the document, with one list per field
+        """
+        for field, typecode in self.TYPECODES.items():
+            setattr(self, field, array(typecode, document[field] if document else ()))
+
+    def record(self, turn, attacker, move, damage, flags, hp, pp):
+        """
+        Record an event
+        """
+        self.turn.append(turn)
+        self.attacker.append(attacker)
+        self.move.append(move)
+        self.damage.append(damage)
+        self.flags.append(flags)
+        self.hp.append(hp)
+        self.pp.append(pp)
+
+    def __len__(self):
+        return len(self.turn)
+
+    def __getitem__(self, index):
+        return BattleEvent(*(getattr(self, field)[index] for field in BattleEvent._fields))
+
+    def __iter__(self):
+        return map(BattleEvent, *(getattr(self, field) for field in BattleEvent._fields))
+
+    def __eq__(self, other):
+        return isinstance(other, BattleLog) and all(getattr(self, field) == getattr(other, field)
+                                                    for field in BattleEvent._fields)
+
+    def to_document(self):
+        """
+        Get the database document of the log
+        :return: a dictionary with one list per field
+        """
+        return {field: getattr(self, field).tolist() for field in BattleEvent._fields}
+
+    def render(self, pokemon1, pokemon2):
+        """
+        Describe the events of the battle
+        :param pokemon1: the first pokemon of the battle
+        :param pokemon2: the second pokemon of the battle
+        :return: a list with the strings that describe each event
+        """
+        pokemon = (pokemon1, pokemon2)
+        return [describe(event, pokemon[event.attacker], pokemon[1 - event.attacker]) for event in self]
+
+    def __repr__(self):
+        return "BattleLog({0} events)".format(len(self))
@@ -0,0 +1,85 @@
+import logging
+
+from src import metrics
+from src.models.battle_log import CRITICAL_HIT, NO_PP, describe
+from src.type_chart import get_type_chart
+
+
+class PokemonState:
+    """
+    Compact battle state of a pokemon, used by Battle.perform_battle instead of the pydantic models.
+    It only holds what changes during the battle (HP and PP), the damage of each move against the rival
+    is computed once when the battle starts.
+    """
+    __slots__ = ('pokemon', 'index', 'hp', 'pp', 'total_pp', 'damage')
+
+    def __init__(self, pokemon, rival, index):
+        """
+        Create the battle state of a pokemon
+        :param pokemon: the pokemon
+        :param rival: the rival pokemon, None if it is set later with face()
+        :param index: the index of the pokemon in the battle, 0 for pokemon1 and 1 for pokemon2
+        (in a team battle, 2 * its slot in the team + 0 for team1 and 1 for team2)
+        """
+        self.pokemon = pokemon
+        self.index = index
+        self.hp = pokemon.hp
+        self.pp = [move.pp for move in pokemon.moves]
+        self.total_pp = sum(self.pp)
+        self.damage = None
+        if rival is not None:
+            self.face(rival)
+
+    def face(self, rival, damage=None):
+        """
+        Set the rival pokemon, e.g. when a new rival enters a team battle
+        :param rival: the rival pokemon
+        :param damage: the damage of the moves against this rival if it was already computed, as in damage
+        """
+        if damage is None:
+            multipliers = get_type_chart().move_multipliers(self.pokemon, rival)
+            damage = [(self.pokemon.calculate_damage(rival, move, 1, multiplier),
+                       self.pokemon.calculate_damage(rival, move, 2, multiplier))
+                      for move, multiplier in zip(self.pokemon.moves, multipliers)]
+        # damage[i] is the damage of the move i, without and with a critical hit
+        self.damage = damage
+
+    def attack_rival(self, rival, rng, log, turn, verbose):
+        """
+        Attack a rival pokemon with a random move, same as Pokemon.attack_rival
+        :param rival: the battle state of the rival pokemon
+        :param rng: the random generator of the battle
+        :param log: the battle log where the attack is recorded
+        :param turn: the turn of the battle
+        :param verbose: whether the attack is described in the logs
+        """
+        index = rng.randint(0, len(self.pp) - 1)
+
+        # A move can only be used if the PP for that move is greater than 0.
+        if self.pp[index] == 0:
+            log.record(turn, self.index, index, 0, NO_PP, rival.hp, 0)
+        else:
+            self.pp[index] -= 1
+            self.total_pp -= 1
+
+            # critical_hit (10% chance)
+            critical_hit = rng.randint(1, 100) <= 10
+            damage = self.damage[index][critical_hit]
+
+            # the damage is subtracted from the rival's HP, which cannot go below zero.
+            rival.hp = max(rival.hp - damage, 0)
+            log.record(turn, self.index, index, damage, CRITICAL_HIT if critical_hit else 0, rival.hp, self.pp[index])
+
+        # the attack is turned into text only if it is logged
+        if verbose:
+            with metrics.timer('format_log'):
+                for line in describe(log[-1], self.pokemon, rival.pokemon):
+                    logging.info(line)
+
+    def save(self):
+        """
+        Write the HP and PP of the battle state back to the pokemon model
+        """
+        self.pokemon.hp = self.hp
+        for move, pp in zip(self.pokemon.moves, self.pp):
+            move.pp = pp
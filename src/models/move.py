@@ -8,6 +8,8 @@ class Move(BaseModel):
     """
     # move name
     name: str
+    # PokeAPI id of the move, used to save the move once in the normalized storage
+    id: Optional[int] = None
     # move type (e.g. fire, water, etc.)
     # used to calculate the STAB (same-type attack bonus)
     type: str
@@ -1,8 +1,15 @@
 import logging
 import random
 import math
+from typing import List
 from pydantic import BaseModel
 
+from src import metrics
+from src.models.move import Move
+from src.type_chart import get_type_chart
+
+ATTACKS = metrics.counter('pokemon_attacks_total', 'Attacks performed with Pokemon.attack_rival')
+
 
 class Pokemon(BaseModel):
     """
@@ -28,7 +35,7 @@ class Pokemon(BaseModel):
     # used to calculate the STAB (same-type attack bonus)
     types: list
     # moves is a list of the pokemon's moves
-    moves: list
+    moves: List[Move]
 
     def attack_rival(self, rival, move):
         """
@@ -39,6 +46,7 @@ class Pokemon(BaseModel):
         """
         # battle_data is a list of strings that will be saved in the database to describe the battle
         battle_data = []
+        ATTACKS.inc()
 
         # if the move has no more PP, the pokemon cannot use it
         # A move can only be used if the PP for that move is greater than 0.
@@ -57,17 +65,7 @@ class Pokemon(BaseModel):
         if random_num <= 10:
             critical_hit = 2
 
-        # STAB is the same-type attack bonus. This is equal to 1.5 if the move's type matches any of the user's types, and 1 if otherwise.
-        stab = 1
-        if move.type in self.types:
-            stab = 1.5
-
-        # using a little simplified version of generation 1 from https://bulbapedia.bulbagarden.net/wiki/Damage
-        # Damage is calculated using the following formula:
-        damage = ((((((2 * self.level * critical_hit)/5) + 2) * (self.attack / rival.defense) * move.power) / 50) + 2) * stab
-
-        # round down the damage
-        damage = math.floor(damage)
+        damage = self.calculate_damage(rival, move, critical_hit)
 
         # the damage is subtracted from the rival's HP, which cannot go below zero.
         rival.receive_attack(damage)
@@ -79,6 +77,33 @@ class Pokemon(BaseModel):
 
         return move, battle_data
 
+    def calculate_damage(self, rival, move, critical_hit, multiplier=None):
+        """
+        Calculate the damage inflicted to a rival pokemon with a move.
+        The damage is deterministic once the critical hit has been drawn,
+        so it can also be used to precompute damage tables for batch simulations.
+        :param rival: the rival pokemon
+        :param move: the move used to attack the rival pokemon
+        :param critical_hit: 2 for a critical hit, 1 otherwise
+        :param multiplier: the type multiplier of the move against the rival, if already computed
+        (see TypeChart.move_multipliers)
+        :return: the damage inflicted to the rival pokemon
+        """
+        if multiplier is None:
+            # STAB is the same-type attack bonus. This is equal to 1.5 if the move's type matches any of the user's types, and 1 if otherwise.
+            stab = 1
+            if move.type in self.types:
+                stab = 1.5
+            # the type effectiveness of the move against the types of the rival, from 0 (no effect) to 4
+            multiplier = stab * get_type_chart().effectiveness(move.type, rival.types)
+
+        # using a little simplified version of generation 1 from https://bulbapedia.bulbagarden.net/wiki/Damage
+        # Damage is calculated using the following formula:
+        damage = ((((((2 * self.level * critical_hit)/5) + 2) * (self.attack / rival.defense) * move.power) / 50) + 2) * multiplier
+
+        # round down the damage
+        return math.floor(damage)
+
     def receive_attack(self, damage):
         """
         Receive an attack from a rival pokemon.
@@ -0,0 +1,42 @@
+from typing import List
+from pydantic import BaseModel
+
+from src.models.move import Move
+from src.models.pokemon import Pokemon
+
+
+class SpeciesTemplate(BaseModel):
+    """
+    SpeciesTemplate model class that represents what a pokemon species has at any level:
+    the base stats, the types and the selected moves.
+    It is built once per species, and the pokemon of each battle are instantiated from it
+    """
+    # pokemon id
+    id: int
+    # pokemon name
+    name: str
+    # base hit points, a pokemon has its base hit points plus its level
+    hp: int
+    # attack points used to calculate the damage
+    attack: int
+    # defense points used to calculate the damage
+    defense: int
+    # speed points used to determine the order of the pokemon in the battle
+    speed: int
+    # types is a list of the pokemon's types (e.g. fire, water, etc.)
+    types: list
+    # the best 4 moves of the species, with full PP
+    # they are never used in a battle, each pokemon gets its own copies
+    moves: List[Move]
+
+    def instantiate(self, level):
+        """
+        Create a pokemon of the species, with full HP and PP
+        :param level: the level of the pokemon
+        :return: the pokemon
+        """
+        # the template is already validated, so the pokemon is built without validating it again
+        return Pokemon.model_construct(id=self.id, name=self.name, level=level, hp=self.hp + level,
+                                       max_hp=self.hp + level, attack=self.attack, defense=self.defense,
+                                       speed=self.speed, types=list(self.types),
+                                       moves=[move.model_copy() for move in self.moves])
@@ -0,0 +1,219 @@
+import logging
+import random
+import secrets
+from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field, field_serializer, field_validator
+
+from src import metrics
+from src.models.battle import BATTLES, DB_BYTES, DB_INSERTS, ENGINE_VERSION, TURNS
+from src.models.battle_log import SWITCH, BattleLog, describe
+from src.models.battle_state import PokemonState
+from src.models.pokemon import Pokemon
+
+# maximum number of pokemon of a team
+MAX_TEAM_SIZE = 6
+
+
+def side_of(index):
+    """
+    Get the team and the slot in the team of a pokemon from its index in the battle events
+    :param index: the index of the pokemon in the events
+    :return: 0 for team1 or 1 for team2, and the slot of the pokemon in its team
+    """
+    return index & 1, index >> 1
+
+
+class TurnScheduler:
+    """
+    Speed-priority scheduler of the two pokemon in the battle: the faster one attacks first in each turn,
+    team1 first on a tie, as in the 1v1 battles. The order only changes when a pokemon enters the battle,
+    so it is computed then and not in each turn
+    """
+    __slots__ = ('active', 'order')
+
+    def __init__(self):
+        # the battle states of the active pokemon of each team
+        self.active = [None, None]
+        # the active battle states in the order they attack
+        self.order = ()
+
+    def enter(self, side, state):
+        """
+        Put a pokemon in the battle for its team
+        :param side: 0 for team1, 1 for team2
+        :param state: the battle state of the pokemon
+        """
+        self.active[side] = state
+        if self.active[1 - side] is not None:
+            first = 0 if self.active[0].pokemon.speed >= self.active[1].pokemon.speed else 1
+            self.order = (self.active[first], self.active[1 - first])
+
+
+class TeamBattle(BaseModel):
+    """
+    TeamBattle model class that represents a battle between two teams of up to 6 pokemon.
+    The first pokemon of each team starts, and when a pokemon faints or has no PP left the next one of its team
+    enters the battle. The battle is over when a team has no pokemon left with HP and PP, team1 wins
+    if any of its pokemon still has HP
+    """
+    # names of the trainers of the two teams, the winner and the loser are one of them
+    trainer1: str = 'team1'
+    trainer2: str = 'team2'
+    # the two teams, in the order the pokemon enter the battle
+    team1: List[Pokemon] = Field(min_length=1, max_length=MAX_TEAM_SIZE)
+    team2: List[Pokemon] = Field(min_length=1, max_length=MAX_TEAM_SIZE)
+    # winner and loser are the names of the trainers that won and lost the battle
+    winner: str = ""
+    loser: str = ""
+    # turns is the number of turns of the battle
+    turns: int = 0
+    # seed of the random generator of the battle
+    seed: Optional[int] = None
+    # version of the battle engine
+    engine_version: int = ENGINE_VERSION
+    # events is the compact log of the battle, with one SWITCH event each time a pokemon enters the battle
+    events: BattleLog = Field(default_factory=BattleLog)
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @field_validator('events', mode='before')
+    @classmethod
+    def load_events(cls, events):
+        # the events are saved in the database as one list per field
+        if isinstance(events, dict):
+            return BattleLog(events)
+        return events
+
+    @field_serializer('events')
+    def dump_events(self, events):
+        return events.to_document()
+
+    @metrics.timed('simulate')
+    def perform_battle(self):
+        """
+        Perform the battle.
+        In each turn, the active pokemon of each team attack each other, the faster one first, as in Battle.
+        A team of one pokemon plays the same battle as Battle, with the same events
+        """
+        if self.seed is None:
+            self.seed = secrets.randbits(63)
+        rng = random.Random(self.seed)
+        teams = (self.team1, self.team2)
+        # the battle states of the pokemon that entered the battle, and the next slot of each team
+        states = []
+        slots = [0, 0]
+        # damage of each pokemon against each rival, computed the first time they face each other
+        damage = {}
+        scheduler = TurnScheduler()
+        verbose = logging.getLogger().isEnabledFor(logging.INFO)
+
+        while True:
+            # the pokemon that fainted or have no PP left are replaced by the next ones of their team
+            entered = False
+            for side in (0, 1):
+                active = scheduler.active[side]
+                if active is not None and active.hp > 0 and active.total_pp > 0:
+                    continue
+                team = teams[side]
+                while slots[side] < len(team) and not _can_fight(team[slots[side]]):
+                    slots[side] += 1
+                if slots[side] == len(team):
+                    scheduler.active[side] = None
+                    break
+                pokemon = team[slots[side]]
+                state = PokemonState(pokemon, None, 2 * slots[side] + side)
+                slots[side] += 1
+                states.append(state)
+                scheduler.enter(side, state)
+                self.events.record(self.turns, state.index, 0, 0, SWITCH, state.hp, 0)
+                if verbose:
+                    logging.info("{0}: {1}".format(self.trainer1 if side == 0 else self.trainer2,
+                                                   describe(self.events[-1], pokemon, pokemon)[0]))
+                entered = True
+            if scheduler.active[0] is None or scheduler.active[1] is None:
+                break
+            if entered:
+                # the damage tables of the new pair
+                for state, rival in ((scheduler.active[0], scheduler.active[1]), (scheduler.active[1], scheduler.active[0])):
+                    key = (state.index, rival.index)
+                    state.face(rival.pokemon, damage.get(key))
+                    damage[key] = state.damage
+
+            self.turns += 1
+            first, second = scheduler.order
+            first.attack_rival(second, rng, self.events, self.turns, verbose)
+            if second.hp == 0:
+                continue
+            second.attack_rival(first, rng, self.events, self.turns, verbose)
+
+        for state in states:
+            state.save()
+
+        if any(pokemon.hp > 0 for pokemon in self.team1):
+            self.winner, self.loser = self.trainer1, self.trainer2
+        else:
+            self.winner, self.loser = self.trainer2, self.trainer1
+        logging.info("{0} won!".format(self.winner))
+        BATTLES.inc()
+        TURNS.inc(self.turns)
+
+    @metrics.timed('format_log')
+    def battle_log(self):
+        """
+        Describe the battle turn by turn
+        :return: a list with the strings that describe each event, and the winner at the end
+        """
+        teams = (self.team1, self.team2)
+        active = [None, None]
+        lines = []
+        for event in self.events:
+            side, slot = side_of(event.attacker)
+            pokemon = teams[side][slot]
+            if event.flags & SWITCH:
+                active[side] = pokemon
+            lines.append(describe(event, pokemon, active[1 - side]))
+        return lines + [["{0} won!".format(self.winner)]]
+
+    def to_document(self, compact=False):
+        """
+        Get the document of the battle to save in the database.
+        The team battles are always saved in full, with their events
+        :param compact: ignored, accepted for the battle sinks
+        :return: the document
+        """
+        return self.model_dump()
+
+    def save_to_db(self, collection):
+        """
+        Save the battle to the database
+        :param collection: the collection where the team battles are saved
+        """
+        # imported lazily, the battles that are not saved never load the database driver
+        from bson import encode
+        from pymongo import errors
+
+        with metrics.timer('serialize'):
+            battle_json = self.to_document()
+        try:
+            with metrics.timer('db_insert'):
+                collection.insert_one(document=battle_json)
+        except errors.PyMongoError as e:
+            logging.error('Unable to insert battle to DB!\n{0}'.format(e))
+            raise e
+        else:
+            DB_INSERTS.inc()
+            if metrics.enabled():
+                DB_BYTES.inc(len(encode(battle_json)))
+            logging.info("Team battle saved to the database.")
+
+    def __str__(self):
+        return "\nTeam battle: {0}: {1}, {2}: {3}, Winner: {4}, Loser: {5}".format(
+            self.trainer1, [pokemon.name for pokemon in self.team1], self.trainer2,
+            [pokemon.name for pokemon in self.team2], self.winner, self.loser)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _can_fight(pokemon):
+    return pokemon.hp > 0 and any(move.pp > 0 for move in pokemon.moves)
@@ -1,30 +1,50 @@
 from re import M
+import random
 import unittest
 from unittest.mock import patch
 from src.models.move import Move
 from src.models.pokemon import Pokemon
 from src.models.battle import Battle
+from src.models.battle_log import SWITCH
+from src.models.team_battle import TeamBattle
 import uuid
 
 
+def make_pokemon():
+    """
+    Create the two pokemon of the tests, Pikachu and Charizard, with the same stats and 4 moves each
+    :return: the two pokemon
+    """
+    pokemon1 = Pokemon(id=1, name="Pikachu", level=20, hp=100, max_hp=100, attack=30, defense=50, speed=20, types=["electric"],
+                       moves=[
+                           Move(name="Thunderbolt", type="electric", power=30, accuracy=100, pp=10, max_pp=10),
+                           Move(name="Quick Attack", type="normal", power=10, accuracy=100, pp=10, max_pp=10),
+                           Move(name="Thunder", type="electric", power=50, accuracy=100, pp=10, max_pp=10),
+                           Move(name="Agility", type="psychic", power=30, accuracy=100, pp=10, max_pp=10)
+    ])
+    pokemon2 = Pokemon(id=2, name="Charizard", level=20, hp=100, max_hp=100, attack=30, defense=50, speed=20, types=["fire"],
+                       moves=[
+                           Move(name="Flamethrower", type="fire", power=30, accuracy=100, pp=10, max_pp=10),
+                           Move(name="Scratch", type="normal", power=10, accuracy=100, pp=10, max_pp=10),
+                           Move(name="Fire Blast", type="fire", power=50, accuracy=100, pp=10, max_pp=10),
+                           Move(name="Agility", type="psychic", power=30, accuracy=100, pp=10, max_pp=10)
+    ])
+    return pokemon1, pokemon2
+
+
+def make_battle():
+    """
+    Create a battle between the two pokemon of the tests, before it is performed
+    :return: the battle
+    """
+    pokemon1, pokemon2 = make_pokemon()
+    return Battle(_id=uuid.uuid4(), pokemon1=pokemon1, pokemon2=pokemon2, winner="", loser="")
+
+
 class Test(unittest.TestCase):
     def setUp(self):
-        # Create two Pokemon instances for testing
-        self.pokemon1 = Pokemon(id=1, name="Pikachu", level=20, hp=100, max_hp=100, attack=30, defense=50, speed=20, types=["electric"],
-                                moves=[
-                                    Move(name="Thunderbolt", type="electric", power=30, accuracy=100, pp=10, max_pp=10),
-                                    Move(name="Quick Attack", type="normal", power=10, accuracy=100, pp=10, max_pp=10),
-                                    Move(name="Thunder", type="electric", power=50, accuracy=100, pp=10, max_pp=10),
-                                    Move(name="Agility", type="psychic", power=30, accuracy=100, pp=10, max_pp=10)
-        ])
-        self.pokemon2 = Pokemon(id=2, name="Charizard", level=20, hp=100, max_hp=100, attack=30, defense=50, speed=20, types=["fire"],
-                                moves=[
-                                    Move(name="Flamethrower", type="fire", power=30, accuracy=100, pp=10, max_pp=10),
-                                    Move(name="Scratch", type="normal", power=10, accuracy=100, pp=10, max_pp=10),
-                                    Move(name="Fire Blast", type="fire", power=50, accuracy=100, pp=10, max_pp=10),
-                                    Move(name="Agility", type="psychic", power=30, accuracy=100, pp=10, max_pp=10)
-        ])
-        self.battle = Battle(_id=uuid.uuid4(), pokemon1=self.pokemon1, pokemon2=self.pokemon2, winner="", loser="", moves=[])
+        self.battle = make_battle()
+        self.pokemon1, self.pokemon2 = self.battle.pokemon1, self.battle.pokemon2
 
     def test_attack_rival(self):
         # Mock the randint function to return a specific value
@@ -54,6 +74,79 @@ class Test(unittest.TestCase):
         expected_battle_moves = ['Pikachu want to use Thunderbolt but has no more PP!']
         self.assertEqual(battle_moves, expected_battle_moves)
 
+    def test_perform_battle(self):
+        pokemon1 = self.pokemon1.model_copy(deep=True)
+        pokemon2 = self.pokemon2.model_copy(deep=True)
+        self.battle.seed = 7
+        self.battle.perform_battle()
+
+        # Play the same battle with the models, as Battle.perform_battle used to do
+        random.seed(7)
+        battle_moves = []
+        while pokemon1.hp > 0 and pokemon2.hp > 0 and sum(move.pp for move in pokemon1.moves) > 0 and sum(move.pp for move in pokemon2.moves) > 0:
+            battle_moves.append(pokemon1.attack_rival(pokemon2, pokemon1.moves[random.randint(0, 3)])[1])
+            if pokemon2.hp == 0:
+                break
+            battle_moves.append(pokemon2.attack_rival(pokemon1, pokemon2.moves[random.randint(0, 3)])[1])
+            if pokemon1.hp == 0:
+                break
+
+        # Assert that the battle state gives the same battle and updates the models
+        self.assertEqual(self.battle.battle_log()[:-1], battle_moves)
+        self.assertEqual(self.battle.pokemon1, pokemon1)
+        self.assertEqual(self.battle.pokemon2, pokemon2)
+
+    def test_battle_events(self):
+        self.battle.perform_battle()
+        document = self.battle.model_dump()
+
+        # Assert that the events are saved as one list per field and loaded back
+        self.assertEqual(len(document['events']['damage']), len(self.battle.events))
+        self.assertEqual(max(document['events']['turn']), self.battle.turns)
+        self.assertEqual(Battle(**document).events, self.battle.events)
+        self.assertEqual(self.battle.battle_log()[-1], ["{0} won!".format(self.battle.winner)])
+
+    def test_replay(self):
+        self.battle.perform_battle()
+        document = self.battle.to_document(compact=True)
+
+        # Assert that the compact document has no events and that the replay regenerates the same battle
+        self.assertEqual(len(document['events']['turn']), 0)
+        self.assertEqual(document['pokemon1']['hp'], 100)
+        replay = Battle(**document).replay()
+        self.assertEqual(replay.events, self.battle.events)
+        self.assertEqual(replay.model_dump(), self.battle.model_dump())
+        self.assertEqual(self.battle.replay().model_dump(), self.battle.model_dump())
+
+        document['engine_version'] = 0
+        with self.assertRaises(ValueError):
+            Battle(**document).replay()
+
+    def test_replay_damaged(self):
+        # Charizard starts damaged and is knocked out by the first attack
+        self.pokemon2.hp = 1
+        self.battle.seed = 7
+        self.battle.perform_battle()
+        document = self.battle.to_document()
+
+        # Assert that the HP before the battle is saved, and the replay starts from it
+        self.assertEqual(document['starting_hp'], [100, 1])
+        self.assertEqual(Battle(**document).replay().model_dump(), document)
+        self.assertEqual(Battle(**document).to_document(compact=True)['pokemon2']['hp'], 1)
+
+        # Assert that a battle saved without it can't be replayed silently differently
+        document['starting_hp'] = None
+        with self.assertRaises(ValueError):
+            Battle(**document).replay()
+
+    def test_no_moves(self):
+        # a pokemon without attacking moves, such as Ditto, can't fight: the battle is over before the first turn
+        self.battle.pokemon2.moves = []
+        self.battle.perform_battle()
+
+        self.assertEqual(self.battle.turns, 0)
+        self.assertEqual(self.battle.winner, "Pikachu")
+
     def test_receive_attack(self):
 
         self.pokemon1.receive_attack(10)
@@ -61,5 +154,50 @@ class Test(unittest.TestCase):
         self.assertEqual(self.pokemon1.hp, 90)
 
 
+class TestTeamBattle(unittest.TestCase):
+    def setUp(self):
+        self.battle = make_battle()
+        self.pokemon1, self.pokemon2 = make_pokemon()
+
+    def test_one_pokemon_teams(self):
+        battle = TeamBattle(team1=[self.pokemon1.model_copy(deep=True)], team2=[self.pokemon2.model_copy(deep=True)], seed=7)
+        battle.perform_battle()
+        self.battle.seed = 7
+        self.battle.perform_battle()
+
+        # Assert that a team of one pokemon plays the same battle as Battle, with a SWITCH event for each lead
+        events = [event for event in battle.events if not event.flags & SWITCH]
+        self.assertEqual(len(battle.events) - len(events), 2)
+        self.assertEqual(events, list(self.battle.events))
+        self.assertEqual(battle.turns, self.battle.turns)
+        self.assertEqual(battle.winner, 'team1' if self.battle.winner == 'Pikachu' else 'team2')
+        self.assertEqual(battle.team1[0], self.battle.pokemon1)
+
+    def test_switch(self):
+        # Charizard is faster, it attacks first when it enters the battle
+        self.pokemon2.speed = 30
+        self.pokemon1.hp = 1
+        battle = TeamBattle(team1=[self.pokemon1, self.pokemon2.model_copy(deep=True)],
+                            team2=[self.pokemon2, self.pokemon1.model_copy(deep=True, update={'hp': 100})], seed=3)
+        battle.perform_battle()
+        log = battle.battle_log()
+
+        # Assert that Pikachu faints in the first turn and is replaced by the second pokemon of its team
+        self.assertEqual(log[:2], [["Pikachu enters the battle! HP 1/100"], ["Charizard enters the battle! HP 100/100"]])
+        self.assertEqual(battle.team1[0].hp, 0)
+        self.assertEqual(log[2], ["Charizard used Scratch! PP 9/10", "Pikachu received 3 damage. HP 0/100\n"])
+        self.assertEqual(log[3], ["Charizard enters the battle! HP 100/100"])
+        self.assertEqual((battle.events[3].turn, battle.events[3].attacker), (1, 2))
+        self.assertEqual(log[-1], ["{0} won!".format(battle.winner)])
+        # Assert that the events are saved and loaded back
+        self.assertEqual(TeamBattle(**battle.to_document()).events, battle.events)
+
+    def test_team_size(self):
+        with self.assertRaises(ValueError):
+            TeamBattle(team1=[self.pokemon1] * 7, team2=[self.pokemon2])
+        with self.assertRaises(ValueError):
+            TeamBattle(team1=[], team2=[self.pokemon2])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,197 @@
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+
+from src.pokedex import get_pokedex, read_dump
+
+# default location of the move index, can be changed with the MOVE_INDEX_PATH environment variable
+DEFAULT_PATH = 'move_index.json'
+VERSION = 1
+# fields of the PokeAPI move documents kept in the index
+FIELDS = ('id', 'name', 'type', 'power', 'accuracy', 'pp')
+
+
+def move_key(url):
+    """
+    Get the key of a move in the index, the last part of its url (the PokeAPI id), so that the index
+    does not depend on the base url of the API
+    :param url: the url of the move, e.g. https://pokeapi.co/api/v2/move/84/
+    :return: the key, e.g. '84'
+    """
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+
+class MoveIndex:
+    """
+    Index of the summary of the PokeAPI moves (id, name, type, power, accuracy and PP), by move id.
+    It is used to rank the level-up moves of a species by power before fetching them, so that only the
+    best 4 moves and the moves missing from the index are fetched.
+    The index grows with each move fetched and is saved to a JSON file, it can also be seeded from the pokedex
+    or built at once with `python -m src.move_index`
+    """
+
+    def __init__(self, path=None):
+        """
+        Open the index, reading the file if it exists. An unreadable file is replaced by an empty index,
+        the moves are fetched again
+        :param path: the path of the index file, None for an index only kept in memory
+        """
+        self.path = path
+        self._moves = {}
+        # whether moves were added since the index was read or saved
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    document = json.load(file)
+                if document.get('version') == VERSION:
+                    self._moves = dict(document['moves'])
+            except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+                logging.warning("Invalid move index {0}, starting with an empty one: {1!r}".format(path, e))
+
+    def __len__(self):
+        return len(self._moves)
+
+    def __contains__(self, url):
+        return move_key(url) in self._moves
+
+    def get(self, url):
+        """
+        Get the summary of a move
+        :param url: the url of the move
+        :return: a dictionary with the fields of FIELDS, or None if the move is not in the index
+        """
+        return self._moves.get(move_key(url))
+
+    def add(self, url, json_move):
+        """
+        Add a move to the index
+        :param url: the url of the move
+        :param json_move: the move data from the API
+        """
+        entry = {'id': json_move.get('id'), 'name': json_move['name'], 'type': json_move['type']['name'],
+                 'power': json_move['power'], 'accuracy': json_move['accuracy'], 'pp': json_move['pp']}
+        key = move_key(url)
+        with self._lock:
+            if self._moves.get(key) != entry:
+                self._moves[key] = entry
+                self._dirty = True
+
+    def seed(self, pokedex):
+        """
+        Add the moves of a pokedex missing from the index
+        :param pokedex: the pokedex
+        :return: the number of added moves
+        """
+        added = 0
+        with self._lock:
+            for record in pokedex.moves():
+                key = str(record.id)
+                if key not in self._moves:
+                    self._moves[key] = record._asdict()
+                    added += 1
+            self._dirty = self._dirty or added > 0
+        return added
+
+    def best(self, urls, count=4):
+        """
+        Rank moves by power, with the index only
+        :param urls: the urls of the moves, all of them in the index, in the order of the API
+        :param count: the number of moves to keep
+        :return: the urls of the count attacking moves with the highest power, ranked as select_moves does
+        (by the power of the Move, the tenth of the API power, keeping the order of the API between equal moves)
+        """
+        attacking = [url for url in urls if self.get(url)['power'] is not None]
+        return sorted(attacking, key=lambda url: math.floor(self.get(url)['power'] / 10), reverse=True)[:count]
+
+    def save(self):
+        """
+        Write the index to its file, if moves were added since it was read
+        """
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            # the file is replaced atomically with a temporary file of its own, the threads and processes
+            # sharing it never read or write half of it
+            descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+            try:
+                with os.fdopen(descriptor, 'w') as file:
+                    json.dump({'version': VERSION, 'moves': self._moves}, file)
+                os.replace(temporary, self.path)
+            except BaseException:
+                os.remove(temporary)
+                raise
+            self._dirty = False
+
+
+_move_index = None
+_move_index_lock = threading.Lock()
+
+
+def get_move_index():
+    """
+    Get the move index shared by the whole process, opening it on first use and seeding it from the pokedex
+    if there is one. The path is read from the MOVE_INDEX_PATH environment variable
+    :return: the move index
+    """
+    global _move_index
+    with _move_index_lock:
+        if _move_index is None:
+            _move_index = MoveIndex(os.environ.get('MOVE_INDEX_PATH', DEFAULT_PATH))
+            pokedex = get_pokedex()
+            if pokedex is not None and _move_index.seed(pokedex):
+                _move_index.save()
+        return _move_index
+
+
+def set_move_index(move_index):
+    """
+    Replace the move index shared by the whole process
+    :param move_index: the new move index, or None to open the one in MOVE_INDEX_PATH on first use
+    """
+    global _move_index
+    with _move_index_lock:
+        _move_index = move_index
+
+
+def main(argv=None):
+    """
+    Build the move index from all the moves of the PokeAPI, or from a local dump of it
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--output', default=os.environ.get('MOVE_INDEX_PATH', DEFAULT_PATH), help='the move index file')
+    parser.add_argument('--dump', help='the directory of a local dump of the PokeAPI (api-data layout)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    move_index = MoveIndex(args.output)
+    if args.dump:
+        urls = [result['url'] for result in read_dump(args.dump, 'api/v2/move')['results']]
+        for url in urls:
+            move_index.add(url, read_dump(args.dump, url))
+    else:
+        # imported lazily, so that reading the index does not need the API modules
+        import requests
+        from src.app import API_URL, get_move_data
+        from src.fetcher import get_fetcher
+
+        res = requests.get('{0}/move?limit=100000'.format(API_URL))
+        res.raise_for_status()
+        urls = [result['url'] for result in res.json()['results']]
+        for url, json_move in zip(urls, get_fetcher().fetch_all(get_move_data, urls)):
+            move_index.add(url, json_move)
+    move_index.save()
+    logging.info("Wrote {0} moves to {1}".format(len(move_index), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,300 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from collections import namedtuple
+
+# default location of the pokedex, can be changed with the POKEDEX_PATH environment variable
+DEFAULT_PATH = 'pokedex.bin'
+
+MAGIC = b'PKDX'
+VERSION = 1
+# header: magic, version, species count, move count, offsets of the species, moves, move lists, types and strings
+HEADER = struct.Struct('<4sHIIIIIII')
+# species: id, name offset and length, base hp, attack, defense and speed, two types, move list offset and length
+SPECIES = struct.Struct('<IIHHHHHBBIH')
+# move: id, name offset and length, type, power, accuracy and pp (-1 stands for a missing power or accuracy)
+MOVE = struct.Struct('<IIHBhhB')
+# type: name offset and length
+TYPE = struct.Struct('<IH')
+# index of a move in the move table, in the move list of a species
+MOVE_INDEX = struct.Struct('<H')
+# type id of a missing second type
+NO_TYPE = 0xFF
+
+SpeciesRecord = namedtuple('SpeciesRecord', ['id', 'name', 'hp', 'attack', 'defense', 'speed', 'types', 'moves'])
+MoveRecord = namedtuple('MoveRecord', ['id', 'name', 'type', 'power', 'accuracy', 'pp'])
+
+
+class Pokedex:
+    """
+    Read-only pokedex stored in a compact binary file, memory mapped so that only the records
+    that are used are loaded from disk.
+    Species are sorted by name and found with a binary search, each species lists the moves it learns by level up
+    as indices in the move table.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        Open the pokedex
+        :param path: the path of the pokedex file
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self._species_count, self._move_count, self._species_offset, self._moves_offset,
+         self._move_lists_offset, self._types_offset, self._strings_offset) = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{0} is not a pokedex file of version {1}".format(path, VERSION))
+        self._types = [self._string(*TYPE.unpack_from(self._data, self._types_offset + i * TYPE.size))
+                       for i in range((self._strings_offset - self._types_offset) // TYPE.size)]
+
+    def __len__(self):
+        return self._species_count
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    def species(self, name):
+        """
+        Get a species by name
+        :param name: the name of the species
+        :return: the species, or None if it is not in the pokedex
+        """
+        index = self._find(name)
+        if index is None:
+            return None
+        (id, name_offset, name_length, hp, attack, defense, speed, type1, type2,
+         moves_offset, moves_count) = SPECIES.unpack_from(self._data, self._species_offset + index * SPECIES.size)
+        types = [self._types[type1]] + ([self._types[type2]] if type2 != NO_TYPE else [])
+        moves = [self.move(MOVE_INDEX.unpack_from(self._data, self._move_lists_offset + (moves_offset + i) * MOVE_INDEX.size)[0])
+                 for i in range(moves_count)]
+        return SpeciesRecord(id, name, hp, attack, defense, speed, types, moves)
+
+    def move(self, index):
+        """
+        Get a move by its index in the move table
+        :param index: the index of the move
+        :return: the move
+        """
+        id, name_offset, name_length, type, power, accuracy, pp = MOVE.unpack_from(self._data, self._moves_offset + index * MOVE.size)
+        return MoveRecord(id, self._string(name_offset, name_length), self._types[type],
+                          power if power >= 0 else None, accuracy if accuracy >= 0 else None, pp)
+
+    def moves(self):
+        """
+        Iterate over all the moves of the move table
+        """
+        for index in range(self._move_count):
+            yield self.move(index)
+
+    def names(self):
+        """
+        Iterate over the names of the species, in alphabetical order
+        """
+        for index in range(self._species_count):
+            yield self._name(index).decode()
+
+    def close(self):
+        """
+        Close the pokedex file
+        """
+        self._data.close()
+
+    def _string(self, offset, length):
+        return self._data[self._strings_offset + offset:self._strings_offset + offset + length].decode()
+
+    def _name(self, index):
+        name_offset, name_length = struct.unpack_from('<IH', self._data, self._species_offset + index * SPECIES.size + 4)
+        return self._data[self._strings_offset + name_offset:self._strings_offset + name_offset + name_length]
+
+    def _find(self, name):
+        key = name.encode()
+        low, high = 0, self._species_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._species_count and self._name(low) == key:
+            return low
+        return None
+
+
+def level_up_move_urls(json_pokemon):
+    """
+    Get the urls of the moves that a pokemon learns by level up, in the order of the PokeAPI
+    :param json_pokemon: the pokemon data from the API
+    :return: the move urls
+    """
+    urls = []
+    for json_move in json_pokemon['moves']:
+        for details in json_move['version_group_details']:
+            if details['move_learn_method']['name'] == 'level-up':
+                urls.append(json_move['move']['url'])
+                break
+    return urls
+
+
+def write_pokedex(path, json_pokemons, get_move):
+    """
+    Write a pokedex file from PokeAPI data
+    :param path: the path of the pokedex file
+    :param json_pokemons: the pokemon data from the API
+    :param get_move: a function that returns the move data from the API, given the move url
+    :return: the number of species and moves written
+    """
+    strings = bytearray()
+    string_offsets = {}
+    types = {}
+    moves = {}
+    move_records = []
+    species = []
+
+    def string(value):
+        if value not in string_offsets:
+            string_offsets[value] = len(strings)
+            strings.extend(value.encode())
+        return string_offsets[value], len(value.encode())
+
+    def type_id(name):
+        if name not in types:
+            types[name] = len(types)
+        return types[name]
+
+    for json_pokemon in json_pokemons:
+        stats = {stat['stat']['name']: stat['base_stat'] for stat in json_pokemon['stats']}
+        type_ids = [type_id(json_type['type']['name']) for json_type in json_pokemon['types']][:2]
+        move_indices = []
+        for url in level_up_move_urls(json_pokemon):
+            if url not in moves:
+                json_move = get_move(url)
+                moves[url] = len(move_records)
+                move_records.append((json_move['id'], string(json_move['name']), type_id(json_move['type']['name']),
+                                     -1 if json_move['power'] is None else json_move['power'],
+                                     -1 if json_move['accuracy'] is None else json_move['accuracy'], json_move['pp'] or 0))
+            move_indices.append(moves[url])
+        species.append((json_pokemon['name'], json_pokemon['id'], stats, type_ids, move_indices))
+        logging.info("Imported {0} with {1} level-up moves".format(json_pokemon['name'], len(move_indices)))
+
+    species.sort(key=lambda record: record[0].encode())
+    species_table = bytearray()
+    move_lists = bytearray()
+    move_list_length = 0
+    for name, id, stats, type_ids, move_indices in species:
+        name_offset, name_length = string(name)
+        species_table.extend(SPECIES.pack(id, name_offset, name_length, stats['hp'], stats['attack'], stats['defense'],
+                                          stats['speed'], type_ids[0], type_ids[1] if len(type_ids) > 1 else NO_TYPE,
+                                          move_list_length, len(move_indices)))
+        for index in move_indices:
+            move_lists.extend(MOVE_INDEX.pack(index))
+        move_list_length += len(move_indices)
+    move_table = b''.join(MOVE.pack(id, name[0], name[1], type, power, accuracy, pp)
+                          for id, name, type, power, accuracy, pp in move_records)
+    type_table = b''.join(TYPE.pack(*string(name)) for name in sorted(types, key=types.get))
+
+    species_offset = HEADER.size
+    moves_offset = species_offset + len(species_table)
+    move_lists_offset = moves_offset + len(move_table)
+    types_offset = move_lists_offset + len(move_lists)
+    strings_offset = types_offset + len(type_table)
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(species), len(move_records), species_offset, moves_offset,
+                               move_lists_offset, types_offset, strings_offset))
+        for table in (species_table, move_table, move_lists, type_table, strings):
+            file.write(table)
+    return len(species), len(move_records)
+
+
+def read_dump(directory, url):
+    """
+    Read a document from a local dump of the PokeAPI (https://github.com/PokeAPI/api-data layout)
+    :param directory: the directory of the dump
+    :param url: the url or path of the document, e.g. https://pokeapi.co/api/v2/move/1/
+    :return: the document
+    """
+    path = url[url.index('/api/v2/') + 1:] if '/api/v2/' in url else url
+    with open(os.path.join(directory, path.strip('/'), 'index.json')) as file:
+        return json.load(file)
+
+
+_pokedex = None
+_pokedex_lock = threading.Lock()
+
+
+def get_pokedex():
+    """
+    Get the pokedex shared by the whole process, opening it on first use.
+    The path is read from the POKEDEX_PATH environment variable
+    :return: the pokedex, or None if there is no pokedex file
+    """
+    global _pokedex
+    with _pokedex_lock:
+        if _pokedex is None:
+            path = os.environ.get('POKEDEX_PATH', DEFAULT_PATH)
+            if not os.path.exists(path):
+                return None
+            _pokedex = Pokedex(path)
+            logging.info("Using the pokedex {0} with {1} species".format(path, len(_pokedex)))
+        return _pokedex
+
+
+def set_pokedex(pokedex):
+    """
+    Replace the pokedex shared by the whole process
+    :param pokedex: the new pokedex, or None to open the one in POKEDEX_PATH on first use
+    """
+    global _pokedex
+    with _pokedex_lock:
+        _pokedex = pokedex
+
+
+def main(argv=None):
+    """
+    Import PokeAPI data into a pokedex file, from the API or from a local dump of it
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('names', nargs='*', help='the pokemon to import, all of them if empty')
+    parser.add_argument('--output', default=os.environ.get('POKEDEX_PATH', DEFAULT_PATH), help='the pokedex file')
+    parser.add_argument('--dump', help='the directory of a local dump of the PokeAPI (api-data layout)')
+    parser.add_argument('--limit', type=int, default=100000, help='the maximum number of pokemon to import')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    if args.dump:
+        index = read_dump(args.dump, 'api/v2/pokemon')
+        urls = [result['url'] for result in index['results'] if not args.names or result['name'] in args.names]
+        json_pokemons = (read_dump(args.dump, url) for url in urls[:args.limit])
+        species, moves = write_pokedex(args.output, json_pokemons, lambda url: read_dump(args.dump, url))
+    else:
+        # imported lazily, so that reading the pokedex does not need the API modules
+        import requests
+        from src.app import API_URL, get_move_data, get_pokemon_data
+        from src.fetcher import get_fetcher
+
+        names = args.names
+        if not names:
+            res = requests.get('{0}/pokemon?limit={1}'.format(API_URL, args.limit))
+            res.raise_for_status()
+            names = [result['name'] for result in res.json()['results']]
+
+        def json_pokemons():
+            for name in names[:args.limit]:
+                json_pokemon = get_pokemon_data(name)
+                # fetch all the moves of the pokemon concurrently, so that write_pokedex finds them in the cache
+                get_fetcher().fetch_all(get_move_data, level_up_move_urls(json_pokemon))
+                yield json_pokemon
+
+        species, moves = write_pokedex(args.output, json_pokemons(),
+                                       lambda url: get_move_data(url, get_fetcher().session))
+    logging.info("Wrote {0} species and {1} moves to {2}".format(species, moves, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
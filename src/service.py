@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import requests
+from aiohttp import web
+
+from src.app import generate_pokemon
+from src.models.battle import MAX_SEED, Battle, is_valid_seed
+from src.simulation import simulate_battles
+
+# maximum number of battles of a batch simulation request
+MAX_SIMULATIONS = 10_000_000
+# number of pokemon (species and level) kept already generated
+SPECIES_CACHE_SIZE = 4096
+
+
+class AsyncSpeciesCache:
+    """
+    Cache of the pokemon already generated, by name and level, with LRU eviction.
+    Concurrent requests for a pokemon being generated wait for the same generation, which runs in a thread
+    because generate_pokemon blocks on the PokeAPI
+    """
+
+    def __init__(self, max_entries=SPECIES_CACHE_SIZE):
+        """
+        Create an empty cache
+        :param max_entries: the maximum number of pokemon in the cache
+        """
+        self.max_entries = max_entries
+        self._pokemon = OrderedDict()
+        self._pending = {}
+
+    async def get(self, name, level):
+        """
+        Get a pokemon, generating it if it is not in the cache
+        :param name: the name of the pokemon
+        :param level: the level of the pokemon
+        :return: the pokemon, shared with the other requests
+        """
+        key = (name, level)
+        if key in self._pokemon:
+            self._pokemon.move_to_end(key)
+            return self._pokemon[key]
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(None, generate_pokemon, name, level)
+            self._pending[key] = future
+            future.add_done_callback(lambda done: self._done(key, done))
+        # shielded, so that a cancelled request does not cancel the generation shared with the others
+        return await asyncio.shield(future)
+
+    def _done(self, key, future):
+        del self._pending[key]
+        # the failures are not cached, the next request tries again
+        if not future.cancelled() and future.exception() is None:
+            self._pokemon[key] = future.result()
+            if len(self._pokemon) > self.max_entries:
+                self._pokemon.popitem(last=False)
+
+
+# keys of the shared objects of the application
+SPECIES = web.AppKey('species', AsyncSpeciesCache)
+EXECUTOR = web.AppKey('executor', Executor)
+
+
+def run_battle(pokemon1, pokemon2, seed, log):
+    """
+    Perform a battle, in a worker process
+    :param pokemon1: the first pokemon
+    :param pokemon2: the second pokemon
+    :param seed: the seed of the battle, random if None
+    :param log: if True, describe the battle turn by turn in the result
+    :return: the result of the battle
+    """
+    # the pokemon are shared by the requests when the executor is not a process pool, and the battle changes them
+    battle = Battle(pokemon1=pokemon1.model_copy(deep=True), pokemon2=pokemon2.model_copy(deep=True),
+                    winner="", loser="", seed=seed)
+    battle.perform_battle()
+    result = {'pokemon1': pokemon1.name, 'pokemon2': pokemon2.name, 'level': pokemon1.level, 'seed': battle.seed,
+              'winner': battle.winner, 'loser': battle.loser, 'turns': battle.turns}
+    if log:
+        result['log'] = battle.battle_log()
+    return result
+
+
+def run_simulation(pokemon1, pokemon2, simulations, seed):
+    """
+    Simulate many battles, in a worker process
+    :param pokemon1: the pokemon that attacks first
+    :param pokemon2: the pokemon that attacks second
+    :param simulations: the number of battles
+    :param seed: the seed of the simulation
+    :return: the simulation result, as a dictionary
+    """
+    return simulate_battles(pokemon1, pokemon2, simulations, seed).model_dump()
+
+
+def _init_worker():
+    # the workers only run battles, their logs would describe every attack
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+async def _matchup(request):
+    """
+    Read the matchup of a request and generate its pokemon, the fastest one first as in main.py
+    :param request: the request, a JSON object with pokemon1, pokemon2, level and optionally seed
+    :return: the request body and the two pokemon
+    """
+    try:
+        body = await request.json()
+        names = (body['pokemon1'].lower(), body['pokemon2'].lower())
+        level = body.get('level', 20)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise web.HTTPBadRequest(text='Invalid matchup: {0!r}'.format(e))
+    if not isinstance(level, int) or isinstance(level, bool) or not 1 <= level <= 100:
+        raise web.HTTPBadRequest(text='The level must be between 1 and 100')
+    if not is_valid_seed(body.get('seed')):
+        raise web.HTTPBadRequest(text='The seed must be an integer between 0 and {0}'.format(MAX_SEED))
+
+    species = request.app[SPECIES]
+    try:
+        pokemon1, pokemon2 = await asyncio.gather(species.get(names[0], level), species.get(names[1], level))
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            raise web.HTTPNotFound(text='Pokemon not found')
+        raise web.HTTPBadGateway(text='PokeAPI error: {0}'.format(e))
+    except requests.exceptions.RequestException as e:
+        raise web.HTTPBadGateway(text='PokeAPI error: {0}'.format(e))
+    if pokemon2.speed > pokemon1.speed:
+        pokemon1, pokemon2 = pokemon2, pokemon1
+    return body, pokemon1, pokemon2
+
+
+async def battle(request):
+    """
+    POST /battle: perform a battle between two pokemon.
+    The body is a JSON object with pokemon1, pokemon2, level (default 20), and optionally seed and
+    log (true to describe the battle turn by turn)
+    """
+    body, pokemon1, pokemon2 = await _matchup(request)
+    result = await asyncio.get_running_loop().run_in_executor(
+        request.app[EXECUTOR], run_battle, pokemon1, pokemon2, body.get('seed'), bool(body.get('log')))
+    return web.json_response(result)
+
+
+async def simulate(request):
+    """
+    POST /simulate: simulate many battles between two pokemon with the batch engine.
+    The body is a JSON object with pokemon1, pokemon2, level (default 20), simulations (default 1000)
+    and optionally seed
+    """
+    body, pokemon1, pokemon2 = await _matchup(request)
+    simulations = body.get('simulations', 1000)
+    if not isinstance(simulations, int) or isinstance(simulations, bool) or not 1 <= simulations <= MAX_SIMULATIONS:
+        raise web.HTTPBadRequest(text='The simulations must be between 1 and {0}'.format(MAX_SIMULATIONS))
+    result = await asyncio.get_running_loop().run_in_executor(
+        request.app[EXECUTOR], run_simulation, pokemon1, pokemon2, simulations, body.get('seed'))
+    return web.json_response(result)
+
+
+async def health(request):
+    """
+    GET /health: check that the service is up
+    """
+    return web.json_response({'status': 'ok'})
+
+
+def create_app(executor=None, workers=None):
+    """
+    Create the battle service
+    :param executor: the executor where the battles run, a new pool of worker processes if None
+    :param workers: the number of worker processes of the new pool, the number of CPUs if None
+    :return: the aiohttp application
+    """
+    app = web.Application()
+    app[SPECIES] = AsyncSpeciesCache()
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker)
+
+        async def shutdown(app):
+            app[EXECUTOR].shutdown()
+
+        app.on_cleanup.append(shutdown)
+    app[EXECUTOR] = executor
+    app.add_routes([web.post('/battle', battle), web.post('/simulate', simulate), web.get('/health', health)])
+    return app
+
+
+def main(argv=None):
+    """
+    Serve battle simulations over HTTP
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host', default='127.0.0.1', help='the host of the service')
+    parser.add_argument('--port', type=int, default=8080, help='the port of the service')
+    parser.add_argument('--workers', type=int, help='the number of worker processes running the battles')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.WARNING)
+    web.run_app(create_app(workers=args.workers), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,445 @@
+import logging
+import math
+from statistics import NormalDist
+
+import numpy as np
+from pydantic import BaseModel
+
+from src.type_chart import get_type_chart
+
+# probability of a critical hit, same as random.randint(1, 100) <= 10 in Pokemon.attack_rival
+CRITICAL_HIT_CHANCE = 0.1
+# the batch engines draw one integer per attack, one of the outcomes of each move is a critical hit out of this number
+CRITICAL_HIT_OUTCOMES = round(1 / CRITICAL_HIT_CHANCE)
+# battles are simulated in chunks, so that the battle state of a chunk fits in the CPU cache
+CHUNK_SIZE = 1 << 15
+
+
+class SimulationResult(BaseModel):
+    """
+    SimulationResult model class that represents the outcome of a batch of battles between two pokemon
+    """
+    # names of the two pokemon, pokemon1 always attacks first
+    pokemon1: str
+    pokemon2: str
+    # number of simulated battles
+    simulations: int
+    # number of battles won by each pokemon
+    wins1: int
+    wins2: int
+    # fraction of the battles won by pokemon1
+    win_rate: float
+    # confidence interval of the win rate of pokemon1 (Wilson score interval)
+    confidence: float
+    confidence_interval: tuple
+    # mean number of turns of a battle, a turn being one attack of each pokemon
+    mean_turns: float
+    # turns_histogram[i] is the number of battles that lasted i turns
+    turns_histogram: list
+
+    def __str__(self):
+        return "{0} vs {1}: {2} battles, win rate {3:.4f} ({4:.0%} CI {5:.4f}-{6:.4f}), mean turns {7:.2f}".format(
+            self.pokemon1, self.pokemon2, self.simulations, self.win_rate, self.confidence,
+            self.confidence_interval[0], self.confidence_interval[1], self.mean_turns)
+
+
+def damage_table(attacker, rival):
+    """
+    Precompute the damage of every move of the attacker against the rival, with and without a critical hit.
+    Uses Pokemon.calculate_damage so that batch simulations share the damage formula of Pokemon.attack_rival
+    :param attacker: the attacking pokemon
+    :param rival: the rival pokemon
+    :return: an array of shape (number of moves, 2), column 0 is a normal hit and column 1 a critical hit
+    """
+    table = np.zeros((len(attacker.moves), 2), dtype=np.int32)
+    multipliers = get_type_chart().move_multipliers(attacker, rival)
+    for i, (move, multiplier) in enumerate(zip(attacker.moves, multipliers)):
+        table[i, 0] = attacker.calculate_damage(rival, move, 1, multiplier)
+        table[i, 1] = attacker.calculate_damage(rival, move, 2, multiplier)
+    return table
+
+
+def wilson_interval(successes, trials, confidence=0.95):
+    """
+    Wilson score interval for a binomial proportion
+    :param successes: the number of successes
+    :param trials: the number of trials
+    :param confidence: the confidence level of the interval
+    :return: the lower and upper bound of the interval
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    margin = z * np.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def outcome_count(move_counts):
+    """
+    Get the number of equally likely outcomes of the draw of an attack, so that every pokemon of a simulation
+    picks each of its moves with the same probability, and 1 time out of 10 with a critical hit
+    :param move_counts: the number of moves of each pokemon
+    :return: the number of outcomes, CRITICAL_HIT_OUTCOMES times a multiple of each number of moves
+    """
+    return math.lcm(*[count for count in move_counts if count > 0] or [1]) * CRITICAL_HIT_OUTCOMES
+
+
+def outcome_tables(table, outcomes):
+    """
+    Map the outcomes of the draw of an attack to the move used and its damage, with the probabilities of
+    Pokemon.attack_rival
+    :param table: the damage table of the attacker, see damage_table
+    :param outcomes: the number of outcomes, see outcome_count
+    :return: two arrays with the index of the move and the damage of each outcome
+    """
+    if table.shape[0] == 0:
+        return np.zeros(outcomes, dtype=np.intp), np.zeros(outcomes, dtype=np.int32)
+    outcome = np.arange(outcomes)
+    # each move gets a block of outcomes, the first tenth of the block is its critical hit
+    block = outcomes // table.shape[0]
+    move = outcome // block
+    critical_hit = (outcome % block < block // CRITICAL_HIT_OUTCOMES).astype(np.intp)
+    return move, table[move, critical_hit]
+
+
+def _draw(rng, outcomes, size):
+    # an exact uniform draw of an integer per attack, in the smallest type that is fast to draw
+    dtype = np.int16 if outcomes <= np.iinfo(np.int16).max else np.int64
+    return rng.integers(0, outcomes, size, dtype=dtype).astype(np.intp)
+
+
+def _attack(rng, tables, pp, offsets, total_pp, rival_hp, attacking):
+    """
+    Perform one attack in each of the battles where attacking is True, in place.
+    Mirrors Pokemon.attack_rival: a random move is picked, a move without PP does nothing,
+    otherwise the move PP is decreased and the (possibly critical) damage is dealt.
+    :param rng: the numpy random generator
+    :param tables: the move and the damage of each outcome of the draw of the attacker, see outcome_tables
+    :param pp: the PP of the attacker moves, flattened with one block of moves per battle
+    :param offsets: the offset of the block of moves of each battle in pp
+    :param total_pp: the total PP of the attacker, one value per battle
+    :param rival_hp: the HP of the rival, one value per battle
+    :param attacking: whether the attacker attacks in each battle
+    """
+    move_of, damage_of = tables
+    # a single draw per battle picks the move and the critical hit
+    outcome = _draw(rng, move_of.size, offsets.size)
+    slot = offsets + move_of[outcome]
+    pp_left = pp[slot]
+    used = (pp_left > 0) & attacking
+    pp[slot] = pp_left - used
+    total_pp -= used
+    rival_hp -= damage_of[outcome] * used
+    np.maximum(rival_hp, 0, out=rival_hp)
+
+
+def _simulate_chunk(rng, table1, table2, moves1, moves2, hp1, hp2, size):
+    """
+    Simulate a chunk of battles, small enough for the battle state to stay in the CPU cache
+    :param rng: the numpy random generator
+    :param table1: the outcome tables of pokemon1, see outcome_tables
+    :param table2: the outcome tables of pokemon2
+    :param moves1: the PP of the moves of pokemon1
+    :param moves2: the PP of the moves of pokemon2
+    :param hp1: the HP of pokemon1 at the start of the battle
+    :param hp2: the HP of pokemon2 at the start of the battle
+    :param size: the number of battles to simulate
+    :return: the number of turns of each battle and whether pokemon1 won it
+    """
+    # battle state, one entry per battle, PP are flattened with one block of moves per battle
+    hp1 = np.full(size, hp1, dtype=np.int32)
+    hp2 = np.full(size, hp2, dtype=np.int32)
+    pp1 = np.tile(moves1, size)
+    pp2 = np.tile(moves2, size)
+    total_pp1 = np.full(size, moves1.sum(), dtype=np.int32)
+    total_pp2 = np.full(size, moves2.sum(), dtype=np.int32)
+    turns = np.zeros(size, dtype=np.int32)
+    # index of each battle in the results, battles that are over get dropped from the state from time to time
+    ids = np.arange(size)
+    offsets1, offsets2 = ids * moves1.size, ids * moves2.size
+
+    all_turns = np.zeros(size, dtype=np.int32)
+    all_winner1 = np.zeros(size, dtype=bool)
+
+    while True:
+        # the turn is executed only if both pokemon have at least one move with PP > 0 and HP > 0
+        active = (hp1 > 0) & (hp2 > 0) & (total_pp1 > 0) & (total_pp2 > 0)
+        remaining = np.count_nonzero(active)
+        if remaining == 0:
+            break
+        if remaining <= ids.size // 2:
+            # drop the battles that are over, so the next turns only work on the ones still in progress
+            done = ~active
+            all_turns[ids[done]] = turns[done]
+            all_winner1[ids[done]] = hp1[done] > 0
+            ids, turns, hp1, hp2 = ids[active], turns[active], hp1[active], hp2[active]
+            total_pp1, total_pp2 = total_pp1[active], total_pp2[active]
+            pp1 = pp1.reshape(-1, moves1.size)[active].ravel()
+            pp2 = pp2.reshape(-1, moves2.size)[active].ravel()
+            active = np.ones(remaining, dtype=bool)
+            offsets1, offsets2 = np.arange(remaining) * moves1.size, np.arange(remaining) * moves2.size
+        turns += active
+
+        # pokemon1 attacks pokemon2
+        _attack(rng, table1, pp1, offsets1, total_pp1, hp2, active)
+        # pokemon2 attacks pokemon1, only if it is still alive
+        _attack(rng, table2, pp2, offsets2, total_pp2, hp1, active & (hp2 > 0))
+
+    all_turns[ids] = turns
+    all_winner1[ids] = hp1 > 0
+    return all_turns, all_winner1
+
+
+def simulate_battles(pokemon1, pokemon2, simulations, seed=None, confidence=0.95):
+    """
+    Simulate many battles between two pokemon at once, using numpy arrays instead of the models.
+    The rules are the same of Battle.perform_battle: pokemon1 attacks first, the battle goes on while both
+    pokemon have HP and PP left, and pokemon1 wins if it still has HP at the end of the battle.
+    The pokemon models are not modified.
+    :param pokemon1: the pokemon that attacks first
+    :param pokemon2: the pokemon that attacks second
+    :param simulations: the number of battles to simulate
+    :param seed: the seed of the random generator
+    :param confidence: the confidence level of the win rate interval
+    :return: the simulation result
+    """
+    if simulations <= 0:
+        raise ValueError("The number of simulations must be positive")
+
+    logging.info("Simulating {0} battles between {1} and {2}".format(simulations, pokemon1.name, pokemon2.name))
+    rng = np.random.default_rng(seed)
+    outcomes = outcome_count([len(pokemon1.moves), len(pokemon2.moves)])
+    table1 = outcome_tables(damage_table(pokemon1, pokemon2), outcomes)
+    table2 = outcome_tables(damage_table(pokemon2, pokemon1), outcomes)
+    moves1 = np.array([move.pp for move in pokemon1.moves], dtype=np.int32)
+    moves2 = np.array([move.pp for move in pokemon2.moves], dtype=np.int32)
+
+    wins1 = 0
+    histogram = np.zeros(1, dtype=np.int64)
+    for start in range(0, simulations, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, simulations - start)
+        turns, winner1 = _simulate_chunk(rng, table1, table2, moves1, moves2, pokemon1.hp, pokemon2.hp, size)
+        wins1 += int(np.count_nonzero(winner1))
+        chunk_histogram = np.bincount(turns)
+        if chunk_histogram.size > histogram.size:
+            histogram = np.pad(histogram, (0, chunk_histogram.size - histogram.size))
+        histogram[:chunk_histogram.size] += chunk_histogram
+
+    return SimulationResult(
+        pokemon1=pokemon1.name,
+        pokemon2=pokemon2.name,
+        simulations=simulations,
+        wins1=wins1,
+        wins2=simulations - wins1,
+        win_rate=wins1 / simulations,
+        confidence=confidence,
+        confidence_interval=wilson_interval(wins1, simulations, confidence),
+        mean_turns=float(np.dot(histogram, np.arange(histogram.size)) / simulations),
+        turns_histogram=histogram.tolist(),
+    )
+
+
+def _team_tables(teams, size, outcomes):
+    """
+    Precompute the move and the damage of each outcome of the draw of every pokemon against each pokemon of
+    the other team
+    :param teams: the two teams
+    :param size: the size of the largest team
+    :param outcomes: the number of outcomes of the draw, see outcome_count
+    :return: a flat array of shape (2 * size, outcomes) with the move of each outcome of each pokemon (team1
+    then team2), and a flat array of shape (2, size, size, outcomes): for each team, attacker slot and rival
+    slot, the damage of each outcome, padded with zeros
+    """
+    move_of = np.zeros((2, size, outcomes), dtype=np.intp)
+    damage_of = np.zeros((2, size, size, outcomes), dtype=np.int32)
+    for side, (team, rivals) in enumerate((teams, teams[::-1])):
+        for i, attacker in enumerate(team):
+            for j, rival in enumerate(rivals):
+                move_of[side, i], damage_of[side, i, j] = outcome_tables(damage_table(attacker, rival), outcomes)
+    return move_of.ravel(), damage_of.ravel()
+
+
+def _team_attack(rng, state, attacker, attacking):
+    """
+    Perform one attack in each of the battles where attacking is True, in place, as _attack does for a single
+    pokemon: in each battle the active pokemon of the attacker team attacks the active pokemon of the other one
+    :param rng: the numpy random generator
+    :param state: the battle state, see _simulate_team_chunk
+    :param attacker: the attacker team in each battle, 0 for team1 and 1 for team2
+    :param attacking: whether the attacker attacks in each battle
+    :return: the index of the attacker and of the rival of each battle, in hp and total_pp
+    """
+    (move_of, damage_of), hp, pp, total_pp, active, rows, base, size, move_count = state
+    outcomes = move_of.size // (2 * size)
+    # the slot of the active pokemon of each team, in the pokemon of the battle (team1 then team2)
+    attacker_slot = active[attacker, rows]
+    rival_slot = active[1 - attacker, rows]
+    # a single draw per battle picks the move and the critical hit
+    outcome = _draw(rng, outcomes, attacker.size)
+    attacker_index = base + attacker_slot
+    rival_index = base + rival_slot
+    move_index = attacker_index * move_count + move_of[attacker_slot * outcomes + outcome]
+    pp_left = pp[move_index]
+    used = (pp_left > 0) & attacking
+    pp[move_index] = pp_left - used
+    total_pp[attacker_index] -= used
+    damage = damage_of[(attacker_slot * size + rival_slot - (1 - attacker) * size) * outcomes + outcome] * used
+    hp[rival_index] = np.maximum(hp[rival_index] - damage, 0)
+    return attacker_index, rival_index
+
+
+def _simulate_team_chunk(rng, tables, hp, pp, speed, size, move_count, battles):
+    """
+    Simulate a chunk of team battles, with the same rules of TeamBattle.perform_battle.
+    The state of each battle is flattened in arrays with one block per battle: the HP and total PP of each
+    pokemon (team1 then team2, padded to the size of the largest team) and the PP of each move.
+    The active pokemon of each team is the slot of the pokemon in the block of its battle
+    :param rng: the numpy random generator
+    :param tables: the outcome tables of the teams, see _team_tables
+    :param hp: the HP of each pokemon at the start of the battle
+    :param pp: the PP of each move at the start of the battle
+    :param speed: the speed of each pokemon
+    :param size: the size of the largest team
+    :param move_count: the largest number of moves of a pokemon
+    :param battles: the number of battles to simulate
+    :return: the number of turns of each battle and whether team1 won it
+    """
+    hp = np.tile(hp, battles)
+    pp = np.tile(pp, battles)
+    total_pp = pp.reshape(-1, move_count).sum(axis=1, dtype=np.int32)
+    # active[0] and active[1] are the slots of the active pokemon of team1 and team2
+    active = np.array([np.zeros(battles, dtype=np.intp), np.full(battles, size, dtype=np.intp)])
+    # team of the pokemon that attacks first, only computed again when a pokemon enters the battle
+    first = np.zeros(battles, dtype=np.intp)
+    turns = np.zeros(battles, dtype=np.int32)
+    # index of each battle in the results, battles that are over get dropped from the state from time to time
+    ids = np.arange(battles)
+    all_turns = np.zeros(battles, dtype=np.int32)
+    all_winner1 = np.zeros(battles, dtype=bool)
+    running = np.ones(battles, dtype=bool)
+    switching = np.ones((2, battles), dtype=bool)
+    compacted = True
+
+    while True:
+        if compacted:
+            # offset of the block of each battle, and the battles as indices of the active array
+            base = np.arange(ids.size) * (2 * size)
+            rows = np.arange(ids.size)
+            compacted = False
+        if switching.any():
+            # the pokemon that fainted or have no PP left are replaced by the first one of their team that
+            # can still fight, a team without one loses the battle
+            changed = np.zeros(ids.size, dtype=bool)
+            for side in (0, 1):
+                battle = np.flatnonzero(switching[side])
+                if battle.size == 0:
+                    continue
+                team = hp.reshape(-1, 2, size)[battle, side] > 0
+                team &= total_pp.reshape(-1, 2, size)[battle, side] > 0
+                active[side, battle] = side * size + np.argmax(team, axis=1)
+                running[battle[~team.any(axis=1)]] = False
+                changed[battle] = True
+            first[changed] = speed[active[0, changed]] < speed[active[1, changed]]
+            switching[:] = False
+        remaining = np.count_nonzero(running)
+        if remaining == 0:
+            break
+        if remaining <= ids.size // 2:
+            # drop the battles that are over, so the next turns only work on the ones still in progress
+            done = ~running
+            all_turns[ids[done]] = turns[done]
+            all_winner1[ids[done]] = (hp.reshape(ids.size, 2, size)[done, 0] > 0).any(axis=1)
+            ids, turns, first = ids[running], turns[running], first[running]
+            hp = hp.reshape(running.size, -1)[running].ravel()
+            total_pp = total_pp.reshape(running.size, -1)[running].ravel()
+            pp = pp.reshape(running.size, -1)[running].ravel()
+            active = active[:, running]
+            switching = switching[:, running]
+            running = np.ones(remaining, dtype=bool)
+            compacted = True
+            continue
+        turns += running
+        state = (tables, hp, pp, total_pp, active, rows, base, size, move_count)
+
+        # the first pokemon attacks, then the second one if it is still alive
+        attacker, rival = _team_attack(rng, state, first, running)
+        second = 1 - first
+        attacker2, rival2 = _team_attack(rng, state, second, running & (hp[rival] > 0))
+
+        # the pokemon that fainted or have no PP left are replaced in the next turn,
+        # the first attacker is the rival of the second one
+        out_first = (hp[rival2] == 0) | (total_pp[attacker] == 0)
+        out_second = (hp[rival] == 0) | (total_pp[attacker2] == 0)
+        switching = np.empty((2, ids.size), dtype=bool)
+        switching[first, rows] = out_first & running
+        switching[second, rows] = out_second & running
+
+    all_turns[ids] = turns
+    all_winner1[ids] = (hp.reshape(ids.size, 2, size)[:, 0] > 0).any(axis=1)
+    return all_turns, all_winner1
+
+
+def simulate_team_battles(team1, team2, simulations, seed=None, confidence=0.95):
+    """
+    Simulate many battles between two teams at once, using numpy arrays instead of the models.
+    The rules are the same of TeamBattle.perform_battle: the active pokemon of each team attack each other,
+    the faster one first, the next pokemon of a team enters when the active one faints or has no PP left,
+    and team1 wins if any of its pokemon still has HP at the end of the battle.
+    The pokemon models are not modified.
+    :param team1: the pokemon of team1, in the order they enter the battle
+    :param team2: the pokemon of team2, in the order they enter the battle
+    :param simulations: the number of battles to simulate
+    :param seed: the seed of the random generator
+    :param confidence: the confidence level of the win rate interval
+    :return: the simulation result, with the names of the pokemon of each team joined by '/'
+    """
+    if simulations <= 0:
+        raise ValueError("The number of simulations must be positive")
+
+    name1 = '/'.join(pokemon.name for pokemon in team1)
+    name2 = '/'.join(pokemon.name for pokemon in team2)
+    logging.info("Simulating {0} battles between {1} and {2}".format(simulations, name1, name2))
+    rng = np.random.default_rng(seed)
+    teams = (team1, team2)
+    size = max(len(team1), len(team2))
+    move_count = max(len(pokemon.moves) for pokemon in team1 + team2)
+    outcomes = outcome_count([len(pokemon.moves) for pokemon in team1 + team2])
+    tables = _team_tables(teams, size, outcomes)
+    # the pokemon of each team, padded to the size of the largest team with pokemon without HP
+    hp = np.zeros(2 * size, dtype=np.int32)
+    pp = np.zeros((2 * size, move_count), dtype=np.int32)
+    speed = np.zeros(2 * size, dtype=np.int32)
+    for side, team in enumerate(teams):
+        for slot, pokemon in enumerate(team):
+            index = side * size + slot
+            hp[index] = pokemon.hp
+            pp[index, :len(pokemon.moves)] = [move.pp for move in pokemon.moves]
+            speed[index] = pokemon.speed
+    pp = pp.ravel()
+
+    wins1 = 0
+    histogram = np.zeros(1, dtype=np.int64)
+    for start in range(0, simulations, CHUNK_SIZE):
+        chunk = min(CHUNK_SIZE, simulations - start)
+        turns, winner1 = _simulate_team_chunk(rng, tables, hp, pp, speed, size, move_count, chunk)
+        wins1 += int(np.count_nonzero(winner1))
+        chunk_histogram = np.bincount(turns)
+        if chunk_histogram.size > histogram.size:
+            histogram = np.pad(histogram, (0, chunk_histogram.size - histogram.size))
+        histogram[:chunk_histogram.size] += chunk_histogram
+
+    return SimulationResult(
+        pokemon1=name1,
+        pokemon2=name2,
+        simulations=simulations,
+        wins1=wins1,
+        wins2=simulations - wins1,
+        win_rate=wins1 / simulations,
+        confidence=confidence,
+        confidence_interval=wilson_interval(wins1, simulations, confidence),
+        mean_turns=float(np.dot(histogram, np.arange(histogram.size)) / simulations),
+        turns_histogram=histogram.tolist(),
+    )
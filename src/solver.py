@@ -0,0 +1,300 @@
+import logging
+import math
+
+import numpy as np
+from pydantic import BaseModel
+
+from src.simulation import CRITICAL_HIT_CHANCE, damage_table
+
+# the solver gives up on battles where a pokemon has more reachable states than this
+MAX_STATES = 1000000
+# probability under which a battle state, or a turn of the states of a layer, is dropped:
+# the turns after picking moves without PP over and over, or the states reached after the battle is over
+TOLERANCE = 1e-15
+
+
+class BattleOutcome(BaseModel):
+    """
+    BattleOutcome model class that represents the exact outcome distribution of a battle between two pokemon
+    """
+    # names of the two pokemon, pokemon1 always attacks first
+    pokemon1: str
+    pokemon2: str
+    # probability that pokemon1 wins the battle
+    win_rate: float
+    # probability that pokemon2 wins the battle
+    loss_rate: float
+    # expected number of turns of the battle, a turn being one attack of each pokemon
+    expected_turns: float
+    # number of distinct battle states explored by the solver
+    states: int
+
+    def __str__(self):
+        return "{0} vs {1}: win rate {2:.6f}, expected turns {3:.4f} ({4} states)".format(
+            self.pokemon1, self.pokemon2, self.win_rate, self.expected_turns, self.states)
+
+
+def _canonical(state_pp, hp, normal, groups):
+    """
+    Bring the PP of states to their canonical form, in place.
+    A move that knocks the rival out in n uses never runs out of PP while the rival is alive if it has at least
+    n PP, so the PP above n are capped, and moves with the same damage are interchangeable, so their PP are sorted:
+    states that only differ there have the same future.
+    :param state_pp: the PP of the moves of each state, one row per state
+    :param hp: the HP of the rival in each state
+    :param normal: the damage of a normal hit of each move
+    :param groups: the first and last column (excluded) of each run of moves with the same damage
+    :return: state_pp
+    """
+    capped = normal > 0
+    state_pp[:, capped] = np.minimum(state_pp[:, capped], -(-hp[:, None] // normal[capped]))
+    for first, last in groups:
+        state_pp[:, first:last] = -np.sort(-state_pp[:, first:last], axis=1)
+    return state_pp
+
+
+def _merge(contributions, powers, running=None):
+    """
+    Sum the probabilities of the states of a layer reached from different states, dropping the states and the
+    turns whose probability is under TOLERANCE
+    :param contributions: a list of (PP of each state, first turn, probability of each state in each turn)
+    :param powers: the weight of the PP of each move in the code of a state
+    :param running: the probability that the rival is still attacking in each turn, if only the turns where
+    the battle is still on matter
+    :return: the PP of each distinct state, the first turn and the probability of each state in each turn,
+    or None if the whole layer has a negligible probability
+    """
+    first = min(turn for _, turn, _ in contributions)
+    last = max(turn + probability.shape[1] for _, turn, probability in contributions)
+    state_pp = np.concatenate([pp for pp, _, _ in contributions])
+    mass = np.zeros((len(state_pp), last - first))
+    row = 0
+    for pp, turn, probability in contributions:
+        mass[row:row + len(pp), turn - first:turn - first + probability.shape[1]] = probability
+        row += len(pp)
+
+    codes = state_pp @ powers
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    mass = np.add.reduceat(mass[order], starts, axis=0)
+    state_pp = state_pp[order[starts]]
+
+    relevant = mass if running is None else mass * running[first:last]
+    kept = relevant.sum(axis=1) > TOLERANCE
+    turns = np.flatnonzero(relevant[kept].sum(axis=0) > TOLERANCE)
+    if turns.size == 0:
+        return None
+    return state_pp[kept], first + turns[0], mass[kept, turns[0]:turns[-1] + 1]
+
+
+def _hold(mass, stay):
+    """
+    Add to the probability of each state in each turn the probability that it was already there and picked a move
+    without PP, which leaves the state unchanged
+    :param mass: the probability that each state is reached in each turn
+    :param stay: the probability that an attack leaves each state unchanged
+    :return: the probability that each state attacks in each turn, with more turns if some states can stay
+    """
+    top = stay.max()
+    if top == 0:
+        return mass
+    turns = mass.shape[1]
+    # the probability of staying j more turns is stay ** j, the turns after it falls under TOLERANCE are dropped
+    held = np.zeros((len(mass), turns + math.ceil(math.log(TOLERANCE) / math.log(top))))
+    held[:, :turns] = mass
+    for value in np.unique(stay[stay > 0]):
+        rows = np.flatnonzero(stay == value)
+        # held[t] = value ** t * cumsum(mass[j] / value ** j), in blocks of turns small enough not to overflow
+        block = max(1, int(200 / -math.log10(value)))
+        carry = np.zeros(rows.size)
+        for begin in range(0, held.shape[1], block):
+            powers = value ** np.arange(min(block, held.shape[1] - begin) + 1)
+            part = np.cumsum(held[rows, begin:begin + block] / powers[:-1], axis=1) * powers[:-1]
+            part += carry[:, None] * powers[1:]
+            held[rows, begin:begin + block] = part
+            carry = part[:, -1]
+    return held
+
+
+def _add(distribution, turn, probability):
+    # add the probability of each turn from the given one to a distribution, extending it if needed
+    end = turn + len(probability)
+    if end > len(distribution):
+        distribution = np.pad(distribution, (0, end - len(distribution)))
+    distribution[turn:end] += probability
+    return distribution
+
+
+def _stop_distribution(table, pp, rival_hp, max_states, running=None):
+    """
+    Compute when the attacks of one pokemon stop, turn by turn.
+    The damage dealt by a pokemon only depends on its own move picks, critical hits and PP, so each pokemon
+    is solved on its own over the (rival HP, remaining PP) states, and the two are combined afterwards.
+    Each attack either lowers the rival HP, or keeps it and lowers the PP, so the states are processed once in
+    that order, one layer at a time, with the probability of being in each state in each turn.
+    :param table: the damage table of the attacker
+    :param pp: the PP of the attacker moves
+    :param rival_hp: the HP of the rival
+    :param max_states: the maximum number of states to explore before giving up
+    :param running: the probability that the rival is still attacking in each turn, if the turns after it stops
+    do not matter: the probability of a state is then only kept if it matters to the battle
+    :return: the probability that the rival is knocked out in each turn, the probability that the attacker
+    runs out of PP in each turn (index 0 is the start of the battle) and the number of states explored
+    """
+    moves = len(pp)
+    # moves with the same damage are next to each other, see _canonical
+    order = sorted(range(moves), key=lambda i: tuple(table[i]))
+    damage = np.array([table[i] for i in order], dtype=np.int64).reshape(moves, 2)
+    normal = damage[:, 0]
+    groups = []
+    first = 0
+    for last in range(1, moves + 1):
+        if last == moves or (damage[last] != damage[first]).any():
+            if last - first > 1:
+                groups.append((first, last))
+            first = last
+    powers = (max(pp) + 1) ** np.arange(moves, dtype=np.int64)
+
+    # the move, the damage and the probability of each outcome of an attack
+    outcomes = []
+    for move, (hit, critical_hit) in enumerate(damage.tolist()):
+        if hit == critical_hit:
+            outcomes.append((move, hit, 1 / moves))
+        else:
+            outcomes.append((move, hit, (1 - CRITICAL_HIT_CHANCE) / moves))
+            outcomes.append((move, critical_hit, CRITICAL_HIT_CHANCE / moves))
+    outcome_move, outcome_hit, outcome_probability = (np.array(column) for column in zip(*outcomes))
+
+    # the layers of states not processed yet, by rival HP and PP of the moves that can hit without damage,
+    # as only those moves can be used without lowering the rival HP
+    pending = {}
+    no_damage = normal == 0
+
+    def reach(hp, state_pp, turn, probability):
+        totals = state_pp[:, no_damage].sum(axis=1)
+        keys = hp * (max(pp) * moves + 1) + totals
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for rows in np.split(order, bounds):
+            key = (int(hp[rows[0]]), int(totals[rows[0]]))
+            pending.setdefault(key, []).append((state_pp[rows], turn, probability[rows]))
+
+    knock_outs = np.zeros(1)
+    out_of_pps = np.zeros(1)
+    start = _canonical(np.array([[pp[i] for i in order]], dtype=np.int64), np.array([rival_hp]), normal, groups)
+    reach(np.array([rival_hp]), start, 0, np.ones((1, 1)))
+    states = 0
+    while pending:
+        key = max(pending)
+        layer = _merge(pending.pop(key), powers, running)
+        if layer is None:
+            continue
+        state_pp, first, mass = layer
+        states += len(state_pp)
+        if states > max_states:
+            raise ValueError("The battle has more than {0} states".format(max_states))
+
+        usable = state_pp > 0
+        held = _hold(mass, (moves - usable.sum(axis=1)) / moves)
+        if running is not None:
+            held = held[:, :len(running) - first - 1]
+            if held.shape[1] == 0:
+                continue
+        # every outcome of an attack from every state where its move has PP
+        rows, outcome = np.nonzero(usable[:, outcome_move])
+        reached = held[rows] * outcome_probability[outcome][:, None]
+        new_hp = key[0] - outcome_hit[outcome]
+        knocked_out = new_hp <= 0
+        if knocked_out.any():
+            knock_outs = _add(knock_outs, first + 1, reached[knocked_out].sum(axis=0))
+            alive = ~knocked_out
+            rows, outcome, reached, new_hp = rows[alive], outcome[alive], reached[alive], new_hp[alive]
+        new_pp = state_pp[rows]
+        new_pp[np.arange(rows.size), outcome_move[outcome]] -= 1
+        _canonical(new_pp, new_hp, normal, groups)
+        out = new_pp.sum(axis=1) == 0
+        if out.any():
+            out_of_pps = _add(out_of_pps, first + 1, reached[out].sum(axis=0))
+            left = ~out
+            new_pp, reached, new_hp = new_pp[left], reached[left], new_hp[left]
+        if len(new_pp):
+            reach(new_hp, new_pp, first + 1, reached)
+
+    length = max(len(knock_outs), len(out_of_pps))
+    return (np.pad(knock_outs, (0, length - len(knock_outs))).tolist(),
+            np.pad(out_of_pps, (0, length - len(out_of_pps))).tolist(), states)
+
+
+def _expected_stop(table, pp, rival_hp):
+    """
+    Roughly estimate when the attacks of one pokemon stop, to pick the pokemon to solve first
+    :param table: the damage table of the attacker
+    :param pp: the PP of the attacker moves
+    :param rival_hp: the HP of the rival
+    :return: the estimated number of turns
+    """
+    damage = sum(hit for (hit, _), move_pp in zip(table, pp) if move_pp > 0) / len(pp)
+    return min(rival_hp / damage if damage > 0 else math.inf, sum(pp))
+
+
+def solve_battle(pokemon1, pokemon2, max_states=MAX_STATES):
+    """
+    Compute the exact outcome distribution of a battle between two pokemon.
+    The rules are the same of Battle.perform_battle: the only randomness is the move pick and the critical hit,
+    so the battle is solved with dynamic programming over the reachable states instead of being sampled.
+    The pokemon models are not modified.
+    :param pokemon1: the pokemon that attacks first
+    :param pokemon2: the pokemon that attacks second
+    :param max_states: the maximum number of states to explore before giving up
+    :return: the battle outcome
+    """
+    logging.info("Solving the battle between {0} and {1}".format(pokemon1.name, pokemon2.name))
+    pp1 = tuple(move.pp for move in pokemon1.moves)
+    pp2 = tuple(move.pp for move in pokemon2.moves)
+
+    # the turn is executed only if both pokemon have at least one move with PP > 0 and HP > 0
+    if pokemon1.hp <= 0 or pokemon2.hp <= 0 or sum(pp1) == 0 or sum(pp2) == 0:
+        win_rate = 1.0 if pokemon1.hp > 0 else 0.0
+        return BattleOutcome(pokemon1=pokemon1.name, pokemon2=pokemon2.name, win_rate=win_rate,
+                             loss_rate=1 - win_rate, expected_turns=0.0, states=0)
+
+    # the battle stops with the first pokemon that stops attacking, so the pokemon expected to stop first is solved
+    # first, and the states of the other one only matter as long as the first one may still be attacking
+    attackers = [(damage_table(pokemon1, pokemon2).tolist(), pp1, pokemon2.hp),
+                 (damage_table(pokemon2, pokemon1).tolist(), pp2, pokemon1.hp)]
+    first, second = sorted((0, 1), key=lambda i: _expected_stop(*attackers[i]))
+    distributions = [None, None]
+    distributions[first] = _stop_distribution(*attackers[first], max_states)
+    knock_outs, out_of_pps, _ = distributions[first]
+    # the probability that the first pokemon is still attacking in each turn, summed from the end to stay exact
+    running = np.cumsum((np.array(knock_outs) + np.array(out_of_pps))[::-1])[::-1]
+    distributions[second] = _stop_distribution(*attackers[second], max_states, running)
+    (knock_out1, out_of_pp1, states1), (knock_out2, out_of_pp2, states2) = distributions
+    turns = max(len(knock_out1), len(knock_out2))
+    for distribution in (knock_out1, out_of_pp1, knock_out2, out_of_pp2):
+        distribution.extend([0.0] * (turns - len(distribution)))
+
+    # pokemon1 attacks first, so it loses only if pokemon2 knocks it out in a turn that pokemon1 started
+    # without knocking out pokemon2 (running out of PP in that turn included, as pokemon2 still attacks).
+    # The battle lasts until the first of the two pokemon stops attacking.
+    loss_rate = 0.0
+    expected_turns = 0.0
+    running1 = running2 = 1.0
+    for turn in range(1, turns):
+        loss_rate += knock_out2[turn] * (running1 - knock_out1[turn])
+        expected_turns += running1 * running2
+        running1 -= knock_out1[turn] + out_of_pp1[turn]
+        running2 -= knock_out2[turn] + out_of_pp2[turn]
+    # rounding errors must not push the probabilities out of [0, 1]
+    loss_rate = min(max(loss_rate, 0.0), 1.0)
+    win_rate = 1 - loss_rate
+
+    return BattleOutcome(
+        pokemon1=pokemon1.name,
+        pokemon2=pokemon2.name,
+        win_rate=win_rate,
+        loss_rate=loss_rate,
+        expected_turns=expected_turns,
+        states=states1 + states2,
+    )
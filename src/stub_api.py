@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubApiServer:
+    """
+    Local HTTP server that serves PokeAPI documents from memory, used to test and benchmark the program offline.
+    Documents are keyed by path (e.g. /api/v2/pokemon/pikachu), the server counts the requests of each path
+    and can be told to fail some requests or to answer with a delay.
+    """
+
+    def __init__(self, documents=None, delay=0.0, host='127.0.0.1', port=0):
+        """
+        Create the server, it starts serving with start()
+        :param documents: the documents served by the server, keyed by path
+        :param delay: the delay of each response in seconds
+        :param host: the host of the server
+        :param port: the port of the server, 0 for a free port
+        """
+        self.documents = dict(documents or {})
+        self.delay = delay
+        # failures maps a path to the list of status codes returned by its next requests
+        self.failures = {}
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        The base url of the PokeAPI served by the server
+        """
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1}/api/v2'.format(host, port)
+
+    def start(self):
+        """
+        Start serving in a background thread
+        :return: the server
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the server
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _respond(self, path):
+        with self._lock:
+            self.requests[path] += 1
+            failures = self.failures.get(path)
+            if failures:
+                return failures.pop(0), {'detail': 'stub failure'}
+        if path not in self.documents:
+            return 404, {'detail': 'Not found.'}
+        return 200, self.documents[path]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # the headers and the body are sent separately, with Nagle's algorithm each keep-alive response
+            # would wait for the delayed ACK of the client (about 40ms)
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status, document = stub._respond(self.path.rstrip('/'))
+                body = json.dumps(document).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def load_dump(directory, url):
+    """
+    Load the documents of a local dump of the PokeAPI (https://github.com/PokeAPI/api-data layout),
+    with their links pointing to the stub server
+    :param directory: the directory of the dump, containing the api/v2 directory
+    :param url: the base url of the stub server
+    :return: the documents, keyed by path
+    """
+    documents = {}
+    for root, _, files in os.walk(directory):
+        if 'index.json' not in files:
+            continue
+        with open(os.path.join(root, 'index.json')) as file:
+            documents['/' + os.path.relpath(root, directory).replace(os.sep, '/')] = json.loads(_rebase(file.read(), url))
+    return documents
+
+
+def load_fixtures(path, url):
+    """
+    Load recorded PokeAPI documents from a single JSON file, keyed by path,
+    with their links pointing to the stub server
+    :param path: the path of the file
+    :param url: the base url of the stub server
+    :return: the documents, keyed by path
+    """
+    with open(path) as file:
+        documents = json.load(file)
+    return {key: json.loads(_rebase(json.dumps(document), url)) for key, document in documents.items()}
+
+
+def _rebase(text, url):
+    # the links of the PokeAPI documents are absolute urls, or paths in the api-data dumps
+    return text.replace('"https://pokeapi.co/api/v2/', '"{0}/'.format(url)).replace('"/api/v2/', '"{0}/'.format(url))
+
+
+def main(argv=None):
+    """
+    Serve a local dump of the PokeAPI, to run the program and load test the battle service offline
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('dump', help='the directory of the dump, containing the api/v2 directory')
+    parser.add_argument('--host', default='127.0.0.1', help='the host of the server')
+    parser.add_argument('--port', type=int, default=8000, help='the port of the server')
+    parser.add_argument('--delay', type=float, default=0.0, help='the delay of each response in seconds')
+    args = parser.parse_args(argv)
+
+    server = StubApiServer(delay=args.delay, host=args.host, port=args.port)
+    server.documents.update(load_dump(args.dump, server.url))
+    print("Serving {0} documents at {1}".format(len(server.documents), server.url))
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,698 @@
+import asyncio
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from aiohttp.test_utils import TestClient, TestServer
+from src import app, metrics
+from src.batch import run_batch
+from src.cache import DEFAULT_TTL, ApiCache, get_cache, read_ttl, set_cache
+from src.fetcher import Fetcher, set_fetcher
+from src.move_index import MoveIndex, set_move_index
+from src.pokedex import Pokedex, get_pokedex, main as import_pokedex, set_pokedex
+from database.battle_sink import BattleSink
+from database.memory_collection import InMemoryCollection
+from src.models.battle import Battle
+from src.models.tests import make_pokemon
+from src.models.team_battle import TeamBattle
+from src.models.pokemon import Pokemon
+from src.simulation import simulate_battles, simulate_team_battles, damage_table
+from src.service import create_app
+from src.solver import solve_battle
+from src.stub_api import StubApiServer
+from src.tournament import rate, run_tournament
+from src.type_chart import get_type_chart
+
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.pokemon1, self.pokemon2 = make_pokemon()
+
+    def test_damage_table(self):
+        table = damage_table(self.pokemon1, self.pokemon2)
+        # Mock the randint function to never get a critical hit
+        with patch("random.randint") as mock_randint:
+            mock_randint.return_value = 100
+            self.pokemon1.attack_rival(self.pokemon2, self.pokemon1.moves[0])
+
+        # Assert that the table uses the same damage formula of attack_rival
+        self.assertEqual(table[0, 0], 100 - self.pokemon2.hp)
+        self.assertEqual(table.shape, (4, 2))
+
+    def test_simulate_battles(self):
+        result = simulate_battles(self.pokemon1, self.pokemon2, 10000, seed=42)
+
+        self.assertEqual(result.wins1 + result.wins2, 10000)
+        self.assertEqual(sum(result.turns_histogram), 10000)
+        self.assertLessEqual(result.confidence_interval[0], result.win_rate)
+        self.assertGreaterEqual(result.confidence_interval[1], result.win_rate)
+        # Assert that the models are not modified and that the seed makes the simulation reproducible
+        self.assertEqual(self.pokemon1.hp, 100)
+        self.assertEqual(result, simulate_battles(self.pokemon1, self.pokemon2, 10000, seed=42))
+
+    def test_simulate_battles_one_turn(self):
+        self.pokemon2.hp = 1
+        result = simulate_battles(self.pokemon1, self.pokemon2, 1000, seed=42)
+
+        # Assert that pokemon1 always knocks out pokemon2 in the first turn
+        self.assertEqual(result.win_rate, 1)
+        self.assertEqual(result.turns_histogram, [0, 1000])
+
+    def test_simulate_battles_no_moves(self):
+        self.pokemon2.moves = []
+        result = simulate_battles(self.pokemon1, self.pokemon2, 1000, seed=42)
+
+        # Assert that a pokemon without attacking moves can't fight, as in Battle.perform_battle
+        self.assertEqual(damage_table(self.pokemon2, self.pokemon1).shape, (0, 2))
+        self.assertEqual(result.win_rate, 1)
+        self.assertEqual(result.turns_histogram, [1000])
+
+    def test_simulate_team_battles(self):
+        # Assert that teams of one pokemon give the same simulation of simulate_battles
+        self.assertEqual(simulate_team_battles([self.pokemon1], [self.pokemon2], 10000, seed=42),
+                         simulate_battles(self.pokemon1, self.pokemon2, 10000, seed=42))
+
+        self.pokemon2.speed = 30
+        team1 = [self.pokemon1, self.pokemon2]
+        team2 = [self.pokemon2, self.pokemon1]
+        result = simulate_team_battles(team1, team2, 20000, seed=42)
+        wins = 0
+        for seed in range(500):
+            battle = TeamBattle(team1=[pokemon.model_copy(deep=True) for pokemon in team1],
+                                team2=[pokemon.model_copy(deep=True) for pokemon in team2], seed=seed)
+            battle.perform_battle()
+            wins += battle.winner == 'team1'
+
+        # Assert that the simulation follows the rules of TeamBattle
+        self.assertEqual(result.pokemon1, 'Pikachu/Charizard')
+        self.assertEqual(sum(result.turns_histogram), 20000)
+        self.assertAlmostEqual(result.win_rate, wins / 500, delta=0.07)
+        self.assertEqual(self.pokemon1.hp, 100)
+
+
+class TestTypeChart(unittest.TestCase):
+    def setUp(self):
+        self.pokemon1, self.pokemon2 = make_pokemon()
+
+    def test_effectiveness(self):
+        type_chart = get_type_chart()
+
+        self.assertEqual(type_chart.effectiveness('water', ['fire']), 2)
+        self.assertEqual(type_chart.effectiveness('ground', ['fire', 'rock']), 4)
+        self.assertEqual(type_chart.effectiveness('electric', ['water', 'ground']), 0)
+        self.assertEqual(type_chart.effectiveness('fire', ['water', 'rock']), 0.25)
+        # Assert that the types missing from the chart are neutral
+        self.assertEqual(type_chart.effectiveness('shadow', ['fire']), 1)
+        self.assertEqual(type_chart.effectiveness('fire', ['shadow']), 1)
+
+    def test_effectiveness_array(self):
+        type_chart = get_type_chart()
+        names = type_chart.types[1:]
+        # every move type against every single and dual type pokemon, padded with the neutral type id 0
+        defenders = [[type_chart.type_id(a), type_chart.type_id(b) if b != a else 0] for a in names for b in names]
+        moves = [[type_chart.type_id(name)] * len(defenders) for name in names]
+        multipliers = type_chart.effectiveness_array(moves, [defenders] * len(names))
+
+        # Assert that the vectorized lookup is the same as the scalar one
+        for i, move_type in enumerate(names):
+            for j, (a, b) in enumerate(defenders):
+                types = [type_chart.types[a]] + ([type_chart.types[b]] if b else [])
+                self.assertEqual(multipliers[i, j], type_chart.effectiveness(move_type, types))
+
+    def test_damage(self):
+        # Thunderbolt is super effective and gets the STAB, Quick Attack has no effect on a ghost type
+        self.pokemon2.types = ["water", "ghost"]
+        table = damage_table(self.pokemon1, self.pokemon2)
+
+        self.assertEqual(table[0, 0], self.pokemon1.calculate_damage(self.pokemon2, self.pokemon1.moves[0], 1))
+        self.assertEqual(table[0, 0], math.floor(((((2 * 20 / 5) + 2) * (30 / 50) * 30) / 50 + 2) * 1.5 * 2))
+        self.assertEqual(table[1].tolist(), [0, 0])
+
+        # Assert that a pokemon whose moves have no effect only wins if the rival runs out of PP first
+        for move in self.pokemon1.moves:
+            move.type = "normal"
+        self.assertEqual(simulate_battles(self.pokemon1, self.pokemon2, 1000, seed=1).wins1, 0)
+        self.assertAlmostEqual(solve_battle(self.pokemon1, self.pokemon2).win_rate, 0)
+
+
+class TestSolver(unittest.TestCase):
+    def setUp(self):
+        self.pokemon1, self.pokemon2 = make_pokemon()
+
+    def test_solve_battle(self):
+        outcome = solve_battle(self.pokemon1, self.pokemon2)
+        result = simulate_battles(self.pokemon1, self.pokemon2, 100000, seed=42)
+
+        # Assert that the exact outcome is within the confidence interval of the Monte Carlo estimate
+        self.assertAlmostEqual(outcome.win_rate + outcome.loss_rate, 1)
+        self.assertGreaterEqual(outcome.win_rate, result.confidence_interval[0])
+        self.assertLessEqual(outcome.win_rate, result.confidence_interval[1])
+        self.assertAlmostEqual(outcome.expected_turns, result.mean_turns, delta=0.05)
+
+    def test_solve_battle_long(self):
+        # A level 30 battle with weak moves of 20 PP, that lasts until the PP almost run out
+        for pokemon, hp in ((self.pokemon1, 150), (self.pokemon2, 155)):
+            pokemon.level = 30
+            pokemon.hp = pokemon.max_hp = hp
+            for move in pokemon.moves:
+                move.type = "normal"
+                move.power = 1
+                move.pp = move.max_pp = 20
+        outcome = solve_battle(self.pokemon1, self.pokemon2)
+        result = simulate_battles(self.pokemon1, self.pokemon2, 100000, seed=42)
+
+        self.assertGreaterEqual(outcome.win_rate, result.confidence_interval[0])
+        self.assertLessEqual(outcome.win_rate, result.confidence_interval[1])
+        self.assertAlmostEqual(outcome.expected_turns, result.mean_turns, delta=0.2)
+        # Assert that the solver does not explore every (HP, PP) state of each pokemon, about 400000
+        self.assertLess(outcome.states, 50000)
+
+    def test_solve_battle_out_of_pp(self):
+        # Each pokemon can attack only once, so pokemon1 wins as soon as one of them runs out of PP
+        for move in self.pokemon1.moves + self.pokemon2.moves:
+            move.pp = 0
+        self.pokemon1.moves[0].pp = 1
+        self.pokemon2.moves[0].pp = 1
+        outcome = solve_battle(self.pokemon1, self.pokemon2)
+
+        self.assertAlmostEqual(outcome.win_rate, 1)
+        # Each pokemon picks its only move with PP with probability 1/4 every turn
+        self.assertAlmostEqual(outcome.expected_turns, 1 / (1 - (3 / 4) ** 2))
+
+
+class TestTournament(unittest.TestCase):
+    def setUp(self):
+        self.pokemon1, self.pokemon2 = make_pokemon()
+
+    def test_run_tournament(self):
+        weak = self.pokemon2.model_copy(deep=True)
+        weak.name = "Magikarp"
+        weak.attack = 1
+        roster = {pokemon.name: {20: pokemon} for pokemon in (self.pokemon1, self.pokemon2, weak)}
+        result = run_tournament(roster, 1000, workers=2, seed=1)
+
+        # Assert that each pairing is played once and the weak pokemon is last
+        win_rates = result.win_rates
+        for i in range(3):
+            for j in range(3):
+                self.assertAlmostEqual(win_rates[i][j] + win_rates[j][i], 1)
+        self.assertEqual(result.ranking[-1][0], "Magikarp")
+        # Assert that the results do not depend on the number of workers
+        self.assertEqual(run_tournament(roster, 1000, workers=1, seed=1), result)
+
+    def test_rate(self):
+        ratings = rate([[0, 75], [25, 0]])
+
+        # Assert that the ratings predict the observed win rate (with the half win prior)
+        self.assertAlmostEqual(1 / (1 + 10 ** ((ratings[1] - ratings[0]) / 400)), 75.5 / 101)
+
+
+class TestApiCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite3')
+        self.cache = ApiCache(self.path, max_entries=2)
+
+    def tearDown(self):
+        self.cache.close()
+        set_cache(None)
+        self.directory.cleanup()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('pokemon/pikachu'))
+        self.cache.set('pokemon/pikachu', {'id': 25})
+
+        self.assertEqual(self.cache.get('pokemon/pikachu'), {'id': 25})
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1})
+
+    def test_lru_eviction(self):
+        self.cache.ttl = None
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        # Read a so that b is the least recently used entry
+        with patch("time.time", return_value=1e10):
+            self.cache.get('a')
+            self.cache.set('c', 3)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_ttl(self):
+        self.cache.ttl = 10
+        self.cache.set('a', 1)
+        with patch("time.time", return_value=1e10):
+            self.assertIsNone(self.cache.get('a'))
+
+    def test_read_ttl(self):
+        # Assert that the entries never expire with an empty, 0 or none TTL, and that invalid values are reported
+        self.assertEqual(read_ttl(None), DEFAULT_TTL)
+        self.assertEqual(read_ttl(' 3600'), 3600)
+        for value in ('', '0', 'None'):
+            self.assertIsNone(read_ttl(value))
+        for value in ('1 day', '-5', '1.5'):
+            with self.assertRaisesRegex(ValueError, 'POKEAPI_CACHE_TTL'):
+                read_ttl(value)
+
+    def test_warm_restart(self):
+        set_cache(self.cache)
+        with patch("requests.get") as mock_get:
+            mock_get.return_value.json.return_value = {'id': 25}
+            app.get_pokemon_data('pikachu')
+
+        # Reopen the cache file, as after a restart of the program
+        self.cache.close()
+        self.cache = ApiCache(self.path)
+        set_cache(self.cache)
+        with patch("requests.get") as mock_get:
+            self.assertEqual(app.get_pokemon_data('pikachu'), {'id': 25})
+            mock_get.assert_not_called()
+
+
+def stub_documents(url):
+    """
+    Build the PokeAPI documents of a small pokemon served by the stub server
+    :param url: the base url of the stub server
+    :return: the documents, keyed by path
+    """
+    path = url.split('/', 3)[3]
+    # (name, type, power, learn method), power is None for status moves
+    moves = [("thunder-shock", "electric", 40, "level-up"), ("growl", "normal", None, "level-up"),
+             ("quick-attack", "normal", 40, "level-up"), ("thunder", "electric", 110, "level-up"),
+             ("slam", "normal", 80, "level-up"), ("spark", "electric", 65, "level-up"),
+             ("thunder-punch", "electric", 75, "machine")]
+    documents = {
+        '/{0}/pokemon/pikachu'.format(path): {
+            'id': 25,
+            'name': 'pikachu',
+            'stats': [{'base_stat': 35, 'stat': {'name': 'hp'}}, {'base_stat': 55, 'stat': {'name': 'attack'}},
+                      {'base_stat': 40, 'stat': {'name': 'defense'}}, {'base_stat': 90, 'stat': {'name': 'speed'}}],
+            'types': [{'slot': 1, 'type': {'name': 'electric'}}],
+            'moves': [{'move': {'name': name, 'url': '{0}/move/{1}/'.format(url, i + 1)},
+                       'version_group_details': [{'level_learned_at': i, 'move_learn_method': {'name': method}}]}
+                      for i, (name, type, power, method) in enumerate(moves)],
+        },
+    }
+    for i, (name, type, power, method) in enumerate(moves):
+        documents['/{0}/move/{1}'.format(path, i + 1)] = {
+            'id': i + 1, 'name': name, 'type': {'name': type}, 'power': power, 'accuracy': 100, 'pp': 20,
+        }
+    return documents
+
+
+def start_stub_api(test):
+    """
+    Serve the stub documents of the PokeAPI to the app, with an empty cache and move index, until the test is over
+    :param test: the test case, the server is stopped and the app restored in its cleanups
+    :return: the stub server and the fetcher of the app
+    """
+    server = StubApiServer().start()
+    test.addCleanup(server.stop)
+    server.documents.update(stub_documents(server.url))
+    fetcher = Fetcher(max_workers=4, backoff_factor=0)
+    test.addCleanup(fetcher.close)
+    set_fetcher(fetcher)
+    test.addCleanup(set_fetcher, None)
+    set_cache(ApiCache(':memory:'))
+    test.addCleanup(set_cache, None)
+    set_move_index(MoveIndex())
+    test.addCleanup(set_move_index, None)
+    app.species_templates.clear()
+    api_url = patch("src.app.API_URL", server.url)
+    api_url.start()
+    test.addCleanup(api_url.stop)
+    return server, fetcher
+
+
+class TestGeneratePokemon(unittest.TestCase):
+    def setUp(self):
+        self.server, self.fetcher = start_stub_api(self)
+
+    def test_generate_pokemon(self):
+        # The first requests of a move fail and are retried
+        self.server.failures['/api/v2/move/4'] = [503, 429]
+        pokemon = app.generate_pokemon('pikachu', 10)
+
+        # Assert that the best 4 level-up moves are selected, in the same order as the serial fetch
+        self.assertEqual([move.name for move in pokemon.moves], ['thunder', 'slam', 'spark', 'thunder-shock'])
+        self.assertEqual(pokemon.hp, 45)
+        self.assertEqual(self.server.requests['/api/v2/move/4'], 3)
+        self.assertEqual(self.server.requests['/api/v2/move/1'], 1)
+        # Assert that moves that are not learned by level up are not fetched
+        self.assertNotIn('/api/v2/move/7', self.server.requests)
+
+    def test_species_template(self):
+        pokemon1 = app.generate_pokemon('pikachu', 10)
+        pokemon2 = app.generate_pokemon('pikachu', 30)
+        pokemon1.moves[0].pp -= 1
+
+        # Assert that the species is fetched once, and each pokemon has its own level and PP
+        self.assertEqual(self.server.requests['/api/v2/pokemon/pikachu'], 1)
+        self.assertEqual((pokemon1.hp, pokemon2.hp), (45, 65))
+        self.assertEqual(pokemon2.moves[0].pp, 20)
+        self.assertEqual(app.generate_pokemon('pikachu', 10).moves[0].pp, 20)
+        # Assert that the species is cached by its url, so the species of another API server are not mixed up
+        self.assertIsNotNone(get_cache().get('{0}/pokemon/pikachu'.format(self.server.url)))
+        self.assertIsNone(get_cache().get('pokemon/pikachu'))
+        self.assertEqual(pokemon2.model_dump(), Pokemon(**pokemon2.model_dump()).model_dump())
+
+    def test_move_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'move_index.json')
+            set_move_index(MoveIndex(path))
+            pokemon = app.generate_pokemon('pikachu', 10)
+            # Restart with an empty PokeAPI cache and the saved move index
+            set_cache(ApiCache(':memory:'))
+            set_move_index(MoveIndex(path))
+            app.species_templates.clear()
+            self.server.requests.clear()
+
+            # Assert that only the best 4 moves are fetched, and the same moves are selected
+            self.assertEqual(app.generate_pokemon('pikachu', 10), pokemon)
+            self.assertEqual(sorted(self.server.requests), ['/api/v2/move/1', '/api/v2/move/4', '/api/v2/move/5',
+                                                            '/api/v2/move/6', '/api/v2/pokemon/pikachu'])
+
+    def test_move_index_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'move_index.json')
+            move_index = MoveIndex(path)
+
+            def add_and_save(start):
+                for i in range(start, start + 50):
+                    move_index.add('https://pokeapi.co/api/v2/move/{0}/'.format(i), {
+                        'id': i, 'name': 'move-{0}'.format(i), 'type': {'name': 'normal'}, 'power': i, 'accuracy': 100,
+                        'pp': 10})
+                    move_index.save()
+
+            with ThreadPoolExecutor(4) as executor:
+                list(executor.map(add_and_save, range(0, 200, 50)))
+
+            # Assert that the threads saving the index at once leave a complete file, and no temporary ones
+            self.assertEqual(len(MoveIndex(path)), 200)
+            self.assertEqual(os.listdir(directory), ['move_index.json'])
+
+            # Assert that a corrupt file gives an empty index instead of raising
+            with open(path, 'w') as file:
+                file.write('{"version": 1, "mov')
+            with self.assertLogs(level='WARNING'):
+                self.assertEqual(len(MoveIndex(path)), 0)
+
+    def test_generate_pokemon_from_pokedex(self):
+        pokemon = app.generate_pokemon('pikachu', 10)
+        # Write the stub documents as a local dump of the PokeAPI and import it
+        with tempfile.TemporaryDirectory() as directory:
+            documents = dict(self.server.documents)
+            documents['/api/v2/pokemon'] = {'results': [{'name': 'pikachu', 'url': '/api/v2/pokemon/pikachu/'}]}
+            for path, document in documents.items():
+                os.makedirs(os.path.join(directory, path.strip('/')), exist_ok=True)
+                with open(os.path.join(directory, path.strip('/'), 'index.json'), 'w') as file:
+                    json.dump(document, file)
+            import_pokedex(['--dump', directory, '--output', os.path.join(directory, 'pokedex.bin')])
+            pokedex = Pokedex(os.path.join(directory, 'pokedex.bin'))
+            set_pokedex(pokedex)
+            app.species_templates.clear()
+            requests = sum(self.server.requests.values())
+
+            # Assert that the pokemon from the pokedex is the same of the API, without calling the API
+            self.assertEqual(len(pokedex), 1)
+            self.assertNotIn('bulbasaur', pokedex)
+            self.assertEqual(app.generate_pokemon('pikachu', 10), pokemon)
+            self.assertEqual(sum(self.server.requests.values()), requests)
+            # Assert that the move index can be seeded with the moves of the pokedex
+            move_index = MoveIndex()
+            self.assertEqual(move_index.seed(pokedex), 6)
+            self.assertEqual(move_index.get('{0}/move/4/'.format(self.server.url))['power'], 110)
+            set_pokedex(None)
+            pokedex.close()
+
+            # Assert that the threads opening the pokedex at once share a single one
+            def slow_open(path):
+                time.sleep(0.05)
+                return Pokedex(path)
+
+            with patch.dict(os.environ, {'POKEDEX_PATH': os.path.join(directory, 'pokedex.bin')}), \
+                    patch('src.pokedex.Pokedex', side_effect=slow_open) as open_pokedex, ThreadPoolExecutor(4) as executor:
+                pokedexes = list(executor.map(lambda _: get_pokedex(), range(4)))
+            self.assertEqual(open_pokedex.call_count, 1)
+            self.assertTrue(all(shared is pokedexes[0] for shared in pokedexes))
+            set_pokedex(None)
+            pokedexes[0].close()
+
+    def test_duplicate_requests(self):
+        self.server.delay = 0.1
+        url = '{0}/move/1/'.format(self.server.url)
+        moves = self.fetcher.fetch_all(app.get_move_data, [url, url, url])
+
+        # Assert that concurrent requests for the same url share one request
+        self.assertEqual(moves[0]['name'], 'thunder-shock')
+        self.assertEqual(moves[0], moves[2])
+        self.assertEqual(self.server.requests['/api/v2/move/1'], 1)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.server, self.fetcher = start_stub_api(self)
+
+    def test_run_batch(self):
+        lines = ['{"pokemon1": "Pikachu", "pokemon2": "pikachu", "level": 10, "seed": %d}\n' % seed for seed in range(50)]
+        lines += ['not json\n', '{"pokemon1": "pikachu", "pokemon2": "missingno", "level": 10}\n']
+        output = io.StringIO()
+        total, failed = run_batch(iter(lines), output, queue_size=4)
+        results = sorted((json.loads(line) for line in output.getvalue().splitlines()), key=lambda r: r['line'])
+
+        # Assert that each matchup gets a result line, and the failed ones an error instead of stopping the batch
+        self.assertEqual((total, failed), (52, 2))
+        self.assertEqual([result['line'] for result in results], list(range(1, 53)))
+        self.assertIn('Invalid matchup spec', results[50]['error'])
+        self.assertIn('404', results[51]['error'])
+        # Assert that the species are fetched once, and the battles are the ones of their seed
+        self.assertEqual(self.server.requests['/api/v2/pokemon/pikachu'], 1)
+        self.assertEqual(results[3]['seed'], 3)
+        self.assertEqual(results[3]['winner'], 'pikachu')
+
+    def test_run_batch_read_error(self):
+        def lines():
+            yield '{"pokemon1": "pikachu", "pokemon2": "pikachu", "level": 10, "seed": 1}\n'
+            raise UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte')
+
+        # Assert that an error reading the input is raised by the batch instead of blocking it
+        output = io.StringIO()
+        with self.assertRaises(UnicodeDecodeError):
+            run_batch(lines(), output, queue_size=4)
+
+    def test_run_batch_teams(self):
+        lines = ['{"team1": ["Pikachu", "pikachu"], "team2": ["pikachu"], "level": 10, "seed": 1}\n',
+                 '{"team1": [], "team2": ["pikachu"]}\n', '{"pokemon1": "pikachu", "pokemon2": "pikachu", "level": 10}\n',
+                 '{"pokemon1": "pikachu", "pokemon2": "pikachu", "level": 100000}\n',
+                 '{"pokemon1": "pikachu", "pokemon2": "pikachu", "level": 0}\n',
+                 '{"pokemon1": "pikachu", "pokemon2": "pikachu", "seed": "abc"}\n',
+                 '{"pokemon1": "pikachu", "pokemon2": "pikachu", "seed": -1}\n']
+        output = io.StringIO()
+        sink, team_sink = BattleSink(InMemoryCollection()), BattleSink(InMemoryCollection())
+        with sink, team_sink:
+            total, failed = run_batch(iter(lines), output, sink, team_sink=team_sink)
+        results = sorted((json.loads(line) for line in output.getvalue().splitlines()), key=lambda r: r['line'])
+
+        # Assert that the team battles are played and saved to their own sink
+        self.assertEqual((total, failed), (7, 5))
+        self.assertEqual(results[0]['team1'], ['pikachu', 'pikachu'])
+        self.assertEqual(results[0]['winner'], 'team1')
+        self.assertIn('Invalid matchup spec', results[1]['error'])
+        self.assertIn('level must be between 1 and 100', results[3]['error'])
+        self.assertIn('level must be between 1 and 100', results[4]['error'])
+        self.assertIn('seed must be an integer', results[5]['error'])
+        self.assertIn('seed must be an integer', results[6]['error'])
+        self.assertEqual(len(team_sink.collection.documents), 1)
+        self.assertEqual(len(sink.collection.documents), 1)
+        self.assertEqual(len(next(iter(team_sink.collection.documents.values()))['team1']), 2)
+
+
+class TestService(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server, self.fetcher = start_stub_api(self)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    async def asyncSetUp(self):
+        self.client = TestClient(TestServer(create_app(self.executor)))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    async def test_battle(self):
+        self.server.delay = 0.05
+        matchup = {'pokemon1': 'pikachu', 'pokemon2': 'Pikachu', 'level': 10, 'seed': 7}
+        responses = await asyncio.gather(*(self.client.post('/battle', json=matchup) for _ in range(10)))
+        results = [await response.json() for response in responses]
+
+        # Assert that the concurrent requests share one fetch of the species, and the battles follow the seed
+        self.assertEqual([response.status for response in responses], [200] * 10)
+        self.assertEqual(self.server.requests['/api/v2/pokemon/pikachu'], 1)
+        self.assertEqual(results[0], results[9])
+        self.assertEqual(results[0]['seed'], 7)
+
+        response = await self.client.post('/battle', json=dict(matchup, log=True))
+        self.assertEqual((await response.json())['log'][-1], ['pikachu won!'])
+
+    async def test_simulate(self):
+        response = await self.client.post('/simulate', json={'pokemon1': 'pikachu', 'pokemon2': 'pikachu',
+                                                             'simulations': 1000, 'seed': 1})
+        result = await response.json()
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(result['wins1'] + result['wins2'], 1000)
+
+    async def test_errors(self):
+        response = await self.client.post('/battle', json={'pokemon1': 'pikachu', 'pokemon2': 'missingno'})
+        self.assertEqual(response.status, 404)
+        response = await self.client.post('/battle', json={'pokemon1': 'pikachu'})
+        self.assertEqual(response.status, 400)
+        response = await self.client.post('/simulate', json={'pokemon1': 'pikachu', 'pokemon2': 'pikachu',
+                                                             'simulations': 0})
+        self.assertEqual(response.status, 400)
+        # Assert that the invalid seeds, levels and simulations are rejected before reaching the workers
+        for path, fields in (('/battle', {'seed': 'abc'}), ('/battle', {'seed': -1}), ('/simulate', {'seed': -1}),
+                             ('/battle', {'seed': True}), ('/battle', {'level': True}), ('/battle', {'level': '7.0'}),
+                             ('/simulate', {'simulations': True})):
+            response = await self.client.post(path, json=dict(fields, pokemon1='pikachu', pokemon2='pikachu'))
+            self.assertEqual(response.status, 400, fields)
+        response = await self.client.get('/health')
+        self.assertEqual(await response.json(), {'status': 'ok'})
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.server, self.fetcher = start_stub_api(self)
+
+    def tearDown(self):
+        metrics.enable(False)
+        metrics.reset()
+
+    def test_disabled(self):
+        metrics.reset()
+        app.generate_pokemon('pikachu', 10)
+
+        # Assert that nothing is recorded while the metrics are disabled
+        self.assertEqual(app.API_CALLS.value, 0)
+        self.assertEqual(metrics.STAGE_SECONDS.snapshot(), {})
+
+    def test_enabled(self):
+        metrics.reset()
+        metrics.enable()
+        pokemon1 = app.generate_pokemon('pikachu', 10)
+        app.species_templates.clear()
+        pokemon2 = app.generate_pokemon('pikachu', 10)
+        battle = Battle(pokemon1=pokemon1, pokemon2=pokemon2, winner="", loser="")
+        battle.perform_battle()
+        battle.save_to_db(InMemoryCollection())
+        snapshot = metrics.snapshot()['metrics']
+
+        # Assert that the pokemon and its 6 level-up moves are fetched once, then the pokemon and its best 4 moves,
+        # ranked by the move index, are found in the cache
+        self.assertEqual(snapshot['pokemon_api_calls_total'], 7)
+        self.assertEqual(snapshot['pokemon_api_cache_hits_total'], 5)
+        self.assertEqual(snapshot['pokemon_turns_total'], battle.turns)
+        self.assertGreater(snapshot['pokemon_db_bytes_written_total'], 0)
+        stages = snapshot['pokemon_stage_seconds']
+        self.assertEqual(stages['fetch_move']['count'], 6)
+        self.assertEqual(stages['build_template']['count'], 2)
+        self.assertEqual(stages['simulate']['count'], 1)
+
+    def test_http_server(self):
+        metrics.reset()
+        server = metrics.start_http_server(0)
+        try:
+            app.generate_pokemon('pikachu', 10)
+            url = 'http://127.0.0.1:{0}/metrics'.format(server.server_address[1])
+            text = requests.get(url).text
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Assert that the metrics are served in the Prometheus text format
+        self.assertIn('# TYPE pokemon_api_calls_total counter\npokemon_api_calls_total 7\n', text)
+        self.assertIn('pokemon_stage_seconds_bucket{stage="fetch_pokemon",le="+Inf"} 1\n', text)
+        self.assertIn('pokemon_stage_seconds_count{stage="fetch_pokemon"} 1\n', text)
+
+    def test_snapshots(self):
+        metrics.reset()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.jsonl')
+            stop = metrics.start_snapshots(path, interval=60)
+            app.generate_pokemon('pikachu', 10)
+            stop()
+            with open(path) as file:
+                snapshots = [json.loads(line) for line in file]
+
+        # Assert that a last snapshot is written when the snapshots stop
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(snapshots[0]['metrics']['pokemon_api_calls_total'], 7)
+
+
+class TestImports(unittest.TestCase):
+    # maximum time to import main.py, relative to the start of the interpreter: it is about 0.4 times the start,
+    # while importing numpy or pymongo alone takes about twice the start
+    MAIN_IMPORT_BUDGET = 1.0
+    # the interpreter is started a few times and the fastest start is kept, to ignore the load of the machine
+    IMPORT_RUNS = 5
+
+    def run_python(self, code):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+        return json.loads(output.stdout) if output.stdout else None
+
+    def start_time(self, code):
+        start = time.perf_counter()
+        self.run_python(code)
+        return time.perf_counter() - start
+
+    def test_main_import(self):
+        result = self.run_python(
+            "import json, sys\n"
+            "import main\n"
+            "print(json.dumps(sorted(sys.modules)))")
+
+        # Assert that importing main.py loads none of the heavy modules, they are imported on use
+        for module in ('pymongo', 'bson', 'numpy', 'aiohttp', 'requests', 'pydantic', 'src.app'):
+            self.assertNotIn(module, result)
+
+    def test_main_import_time(self):
+        # the bare interpreter and the import of main.py are timed in turns, so they run under the same load
+        baseline = main = float('inf')
+        for _ in range(self.IMPORT_RUNS):
+            baseline = min(baseline, self.start_time('pass'))
+            main = min(main, self.start_time('import main'))
+
+        # Assert that importing main.py stays within the budget
+        self.assertLess(main - baseline, self.MAIN_IMPORT_BUDGET * baseline)
+
+    def test_simulation_without_database(self):
+        result = self.run_python(
+            "import json, sys\n"
+            "from src.models.battle import Battle\n"
+            "from src.models.move import Move\n"
+            "from src.models.species import SpeciesTemplate\n"
+            "from src.tournament import run_tournament\n"
+            "moves = [Move(name='tackle', type='normal', power=5, pp=10, max_pp=10)]\n"
+            "template = SpeciesTemplate(id=1, name='eevee', hp=50, attack=50, defense=50, speed=50, types=['normal'], moves=moves)\n"
+            "Battle(pokemon1=template.instantiate(20), pokemon2=template.instantiate(20), winner='', loser='').perform_battle()\n"
+            "print(json.dumps(sorted(sys.modules)))")
+
+        # Assert that a battle is performed without loading the database driver or the PokeAPI client
+        for module in ('pymongo', 'bson', 'requests'):
+            self.assertNotIn(module, result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+from pydantic import BaseModel
+
+from src.simulation import simulate_battles
+
+# the ratings are on the Elo scale, centered on this rating
+BASE_RATING = 1500
+# iterations of the Bradley-Terry fit of the ratings
+RATING_ITERATIONS = 200
+# number of chunks of pairings per worker, more chunks balance the load better
+CHUNKS_PER_WORKER = 4
+
+# roster of the worker process, sent once when the worker starts
+_roster = None
+
+
+class TournamentResult(BaseModel):
+    """
+    TournamentResult model class that represents the result of a round-robin tournament
+    """
+    # names of the pokemon of the roster
+    roster: list
+    # levels of the battles
+    levels: tuple
+    # number of battles of each pairing
+    battles: int
+    # win_rates[i][j] is the fraction of the battles between roster[i] and roster[j] won by roster[i]
+    win_rates: list
+    # ranking is a list of (name, rating, win rate against the whole roster), best first
+    ranking: list
+
+    def __str__(self):
+        lines = ["{0:>4} {1:<20} {2:>8} {3:>9}".format('#', 'Pokemon', 'Rating', 'Win rate')]
+        for position, (name, rating, win_rate) in enumerate(self.ranking):
+            lines.append("{0:>4} {1:<20} {2:>8.1f} {3:>9.4f}".format(position + 1, name, rating, win_rate))
+        return "\n".join(lines)
+
+
+def build_roster(names, levels):
+    """
+    Generate each pokemon of the roster once for each level
+    :param names: the names of the pokemon
+    :param levels: the lowest and the highest level of the battles
+    :return: a dictionary that maps each name to a dictionary of the pokemon by level
+    """
+    # imported lazily, so that the workers do not need the API modules
+    from src.app import generate_pokemon
+
+    return {name: {level: generate_pokemon(name, level) for level in range(levels[0], levels[1] + 1)}
+            for name in names}
+
+
+def _init_worker(roster):
+    global _roster
+    _roster = roster
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _play_pairings(pairings, battles, seed):
+    """
+    Play the battles of some pairings of the roster, in a worker process.
+    Each battle is played at a random level of the range, the same for both pokemon, and the fastest pokemon
+    attacks first as in main.py
+    :param pairings: the names of the two pokemon of each pairing
+    :param battles: the number of battles of each pairing
+    :param seed: the seed of the tournament
+    :return: the number of battles won by the first pokemon of each pairing
+    """
+    results = []
+    for name1, name2 in pairings:
+        levels = sorted(_roster[name1])
+        # each pairing has its own random stream, so the results do not depend on how the pairings are chunked
+        rng = np.random.default_rng([seed, *name1.encode(), 0, *name2.encode()])
+        wins1 = 0
+        for level, count in zip(levels, rng.multinomial(battles, [1 / len(levels)] * len(levels))):
+            if count == 0:
+                continue
+            pokemon1, pokemon2 = _roster[name1][level], _roster[name2][level]
+            if pokemon2.speed > pokemon1.speed:
+                result = simulate_battles(pokemon2, pokemon1, int(count), seed=rng)
+                wins1 += result.wins2
+            else:
+                result = simulate_battles(pokemon1, pokemon2, int(count), seed=rng)
+                wins1 += result.wins1
+        results.append(wins1)
+    return results
+
+
+def rate(wins):
+    """
+    Rate the pokemon with a Bradley-Terry model fitted on the battle results, on the Elo scale
+    :param wins: wins[i][j] is the number of battles between i and j won by i
+    :return: the rating of each pokemon
+    """
+    # half a win and half a loss against each rival keep the ratings finite for unbeaten or winless pokemon
+    wins = np.asarray(wins, dtype=float) + 0.5
+    np.fill_diagonal(wins, 0)
+    games = wins + wins.T
+    strength = np.ones(len(wins))
+    for _ in range(RATING_ITERATIONS):
+        strength = wins.sum(axis=1) / (games / (strength[:, None] + strength[None, :])).sum(axis=1)
+        strength /= np.exp(np.log(strength).mean())
+    return BASE_RATING + 400 * np.log10(strength)
+
+
+def run_tournament(roster, battles, workers=None, seed=0):
+    """
+    Run a round-robin tournament: every pairing of the roster plays the given number of battles.
+    The pairings are split in chunks among a pool of worker processes, each worker receives the roster once
+    :param roster: the roster, as returned by build_roster
+    :param battles: the number of battles of each pairing
+    :param workers: the number of worker processes, the number of CPUs if None
+    :param seed: the seed of the tournament
+    :return: the tournament result
+    """
+    names = list(roster)
+    levels = sorted(next(iter(roster.values())))
+    pairings = list(combinations(names, 2))
+    workers = workers or os.cpu_count()
+    logging.info("Running {0} pairings of {1} battles on {2} workers".format(len(pairings), battles, workers))
+
+    chunk_size = max(1, math.ceil(len(pairings) / (workers * CHUNKS_PER_WORKER)))
+    chunks = [pairings[i:i + chunk_size] for i in range(0, len(pairings), chunk_size)]
+    index = {name: i for i, name in enumerate(names)}
+    wins = np.zeros((len(names), len(names)), dtype=np.int64)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(roster,)) as executor:
+        futures = [executor.submit(_play_pairings, chunk, battles, seed) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            for (name1, name2), wins1 in zip(chunk, future.result()):
+                wins[index[name1], index[name2]] = wins1
+                wins[index[name2], index[name1]] = battles - wins1
+
+    win_rates = wins / battles
+    np.fill_diagonal(win_rates, 0.5)
+    ratings = rate(wins)
+    overall = wins.sum(axis=1) / max(battles * (len(names) - 1), 1)
+    ranking = sorted(zip(names, ratings.tolist(), overall.tolist()), key=lambda entry: entry[1], reverse=True)
+    return TournamentResult(roster=names, levels=(levels[0], levels[-1]), battles=battles,
+                            win_rates=win_rates.tolist(), ranking=ranking)
+
+
+def main(argv=None):
+    """
+    Run a round-robin tournament between the pokemon of a roster
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('names', nargs='*', help='the names of the pokemon of the roster')
+    parser.add_argument('--roster', help='a file with the names of the pokemon of the roster, one per line')
+    parser.add_argument('--levels', type=int, nargs=2, default=(10, 30), help='the lowest and the highest level')
+    parser.add_argument('--battles', type=int, default=1000, help='the number of battles of each pairing')
+    parser.add_argument('--workers', type=int, help='the number of worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the tournament')
+    parser.add_argument('--output', help='the JSON file where the result is written')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    names = [name.lower() for name in args.names]
+    if args.roster:
+        with open(args.roster) as file:
+            names += [line.strip().lower() for line in file if line.strip()]
+    if len(names) < 2:
+        parser.error('the roster needs at least two pokemon')
+
+    roster = build_roster(names, args.levels)
+    result = run_tournament(roster, args.battles, args.workers, args.seed)
+    print(result)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result.model_dump(), file)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+# snapshot of the damage relations of the PokeAPI types, shipped with the program so that no API call is needed
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'type_chart.json')
+# multiplier of each damage relation of the PokeAPI
+RELATIONS = {'double_damage_to': 2.0, 'half_damage_to': 0.5, 'no_damage_to': 0.0}
+# multiplier of a move whose type matches one of the types of the attacker (same-type attack bonus)
+STAB = 1.5
+
+
+class TypeChart:
+    """
+    Type effectiveness chart, a dense matrix of the damage multipliers indexed by small integer type ids:
+    matrix[attacking type id, defending type id]. The id 0 is reserved for the types missing from the chart,
+    which are neutral against every type
+    """
+
+    def __init__(self, relations):
+        """
+        Build the chart from the damage relations of the types
+        :param relations: a dictionary that maps each type name to its damage relations as in the PokeAPI,
+        e.g. {'fire': {'double_damage_to': ['grass', ...], 'half_damage_to': [...], 'no_damage_to': [...]}}
+        """
+        self.types = ['unknown'] + list(relations)
+        self.ids = {name: i for i, name in enumerate(self.types)}
+        self.matrix = np.ones((len(self.types), len(self.types)), dtype=np.float64)
+        for name, damage_relations in relations.items():
+            for relation, multiplier in RELATIONS.items():
+                for target in damage_relations.get(relation, []):
+                    if target in self.ids:
+                        self.matrix[self.ids[name], self.ids[target]] = multiplier
+        self.relations = relations
+
+    def type_id(self, name):
+        """
+        Get the id of a type
+        :param name: the name of the type
+        :return: the id of the type, 0 if it is not in the chart
+        """
+        return self.ids.get(name, 0)
+
+    def effectiveness(self, move_type, defender_types):
+        """
+        Get the damage multiplier of a move type against a pokemon
+        :param move_type: the type of the move
+        :param defender_types: the types of the defending pokemon
+        :return: the product of the multipliers against each type of the pokemon (0, 0.25, 0.5, 1, 2 or 4)
+        """
+        row = self.matrix[self.type_id(move_type)]
+        multiplier = 1.0
+        for defender_type in defender_types:
+            multiplier *= row[self.type_id(defender_type)]
+        return float(multiplier)
+
+    def effectiveness_array(self, move_type_ids, defender_type_ids):
+        """
+        Vectorized type effectiveness, for batch simulations
+        :param move_type_ids: an array of move type ids, of any shape
+        :param defender_type_ids: an array of the type ids of the defending pokemon, with one more dimension
+        than move_type_ids for the types of each pokemon (padded with 0, which is neutral)
+        :return: an array of the damage multipliers, with the shape of move_type_ids
+        """
+        # the ids are integers even when the arrays are empty, e.g. for a pokemon without attacking moves
+        move_type_ids = np.asarray(move_type_ids, dtype=np.intp)
+        defender_type_ids = np.asarray(defender_type_ids, dtype=np.intp)
+        return self.matrix[move_type_ids[..., None], defender_type_ids].prod(axis=-1)
+
+    def move_multipliers(self, attacker, defender):
+        """
+        Precompute the damage multiplier of each move of a pokemon against a rival: the type effectiveness
+        times the same-type attack bonus
+        :param attacker: the attacking pokemon
+        :param defender: the defending pokemon
+        :return: the multiplier of each move of the attacker, in the order of its moves
+        """
+        move_type_ids = [self.type_id(move.type) for move in attacker.moves]
+        defender_type_ids = [self.type_id(name) for name in defender.types]
+        effectiveness = self.effectiveness_array(move_type_ids, [defender_type_ids] * len(move_type_ids))
+        stab = [STAB if move.type in attacker.types else 1.0 for move in attacker.moves]
+        return (effectiveness * stab).tolist()
+
+    def to_document(self):
+        """
+        Get the damage relations of the chart, as saved in the snapshot
+        :return: the damage relations
+        """
+        return self.relations
+
+
+def load_type_chart(path=SNAPSHOT_PATH):
+    """
+    Load a type chart snapshot
+    :param path: the path of the snapshot
+    :return: the type chart
+    """
+    with open(path) as file:
+        return TypeChart(json.load(file))
+
+
+def type_chart_from_api(json_types):
+    """
+    Build a type chart from the PokeAPI type data
+    :param json_types: the data of each type from the API (/type/{name})
+    :return: the type chart
+    """
+    return TypeChart({json_type['name']: {relation: [target['name'] for target in json_type['damage_relations'][relation]]
+                                          for relation in RELATIONS}
+                      for json_type in json_types if json_type['damage_relations']['double_damage_to']
+                      or json_type['damage_relations']['half_damage_to']
+                      or json_type['damage_relations']['no_damage_to']})
+
+
+_type_chart = None
+
+
+def get_type_chart():
+    """
+    Get the type chart shared by the whole process, loading it on first use.
+    The snapshot path can be changed with the TYPE_CHART_PATH environment variable
+    :return: the type chart
+    """
+    global _type_chart
+    if _type_chart is None:
+        _type_chart = load_type_chart(os.environ.get('TYPE_CHART_PATH', SNAPSHOT_PATH))
+    return _type_chart
+
+
+def set_type_chart(type_chart):
+    """
+    Replace the type chart shared by the whole process (e.g. in tests)
+    :param type_chart: the new type chart, or None to load the snapshot again on next use
+    """
+    global _type_chart
+    _type_chart = type_chart
+
+
+def main(argv=None):
+    """
+    Refresh the type chart snapshot from the PokeAPI
+    """
+    # imported lazily, the chart itself does not need the API modules
+    import requests
+    from src.app import API_URL
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--output', default=SNAPSHOT_PATH, help='the path of the snapshot')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    res = requests.get('{0}/type?limit=100'.format(API_URL))
+    res.raise_for_status()
+    json_types = []
+    for result in res.json()['results']:
+        logging.info("Fetching type {0}".format(result['name']))
+        res = requests.get(result['url'])
+        res.raise_for_status()
+        json_types.append(res.json())
+
+    type_chart = type_chart_from_api(json_types)
+    with open(args.output, 'w') as file:
+        json.dump(type_chart.to_document(), file, indent=2)
+    logging.info("Type chart with {0} types written to {1}".format(len(type_chart.types) - 1, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())